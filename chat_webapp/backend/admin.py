@@ -0,0 +1,321 @@
+"""
+Admin endpoints (/admin/...) để xem bên trong server đang chạy, không cần restart
+- CPU profile dạng sampling: thread nền chụp stack của thread event loop mỗi interval,
+  kết quả là collapsed stack (flamegraph.pl / speedscope đọc được)
+- Heap: snapshot tracemalloc, top allocation và diff giữa hai snapshot (tìm leak)
+- State: số session, độ sâu queue, file transfer dang dở, top talkers (server cung cấp)
+Có admin token: mọi request phải gửi header X-Admin-Token đúng; không có token: chỉ localhost
+(cùng kiểm tra cho /stats, /stats/loop: lộ session, loop và stack của server)
+"""
+import asyncio
+import gc
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+ADMIN_TOKEN_ENV = "CHAT_ADMIN_TOKEN"
+
+DEFAULT_PROFILE_SECONDS = 10.0
+MAX_PROFILE_SECONDS = 300.0
+DEFAULT_SAMPLE_INTERVAL = 0.005  # giây
+MAX_STACK_DEPTH = 64
+DEFAULT_TRACE_FRAMES = 10
+MAX_HEAP_SNAPSHOTS = 5
+DEFAULT_TOP = 20
+# Path cần quyền admin (middleware áp dụng cả khi admin endpoints tắt)
+PROTECTED_PATH_PREFIXES = ("/admin", "/stats")
+
+
+class AdminSettings:
+    """Bật admin endpoints; token (hoặc env CHAT_ADMIN_TOKEN) để truy cập từ ngoài localhost"""
+    __slots__ = ("enabled", "token")
+
+    def __init__(self, enabled: bool = True, token: Optional[str] = None):
+        self.enabled = enabled
+        self.token = token if token is not None else os.getenv(ADMIN_TOKEN_ENV) or None
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(filename[-2:])}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Sampling profiler cho một thread: đếm collapsed stack, không chạy code trong thread bị đo"""
+
+    def __init__(self, thread_id: int, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.finished_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, args=(seconds,), name="admin-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, seconds: float):
+        deadline = time.monotonic() + seconds
+        labels: Dict[object, str] = {}  # Cache label theo code object
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+        self.finished_at = time.time()
+
+    def collapsed(self) -> str:
+        """Mỗi dòng "frame;frame;frame count" (stack ngoài cùng trước)"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def snapshot(self, top: int = DEFAULT_TOP) -> Dict:
+        leaf = Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "top_functions": [
+                {"function": name, "samples": count, "percent": round(count * 100 / self.samples, 1)}
+                for name, count in leaf.most_common(top)
+            ] if self.samples else [],
+        }
+
+
+def _stat_entry(stat) -> Dict:
+    frame = stat.traceback[0]
+    return {"location": f"{frame.filename}:{frame.lineno}", "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count}
+
+
+def _diff_entry(stat) -> Dict:
+    return {**_stat_entry(stat), "size_diff_kb": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff}
+
+
+def process_state() -> Dict:
+    """RSS, số task asyncio, thread và thống kê gc của process"""
+    rss_kb = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss_kb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return {
+        "pid": os.getpid(),
+        "rss_kb": rss_kb,
+        "asyncio_tasks": len(asyncio.all_tasks()),
+        "threads": threading.active_count(),
+        "gc_counts": gc.get_count(),
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+
+
+def _query_int(request: web.Request, name: str, default: int) -> int:
+    try:
+        return int(request.query.get(name, default))
+    except ValueError:
+        return default
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=str)
+
+
+def _is_local(remote: Optional[str]) -> bool:
+    if not remote:
+        return False
+    try:
+        return ipaddress.ip_address(remote).is_loopback
+    except ValueError:
+        return False
+
+
+class AdminInterface:
+    """
+    Đăng ký /admin/... vào app; state() do server cung cấp (dict JSON được)
+    Profile và heap snapshot giữ trong bộ nhớ của process, tải về qua GET
+    """
+
+    def __init__(self, settings: AdminSettings = None, state: Callable[[], Dict] = None):
+        self.settings = settings or AdminSettings()
+        self.state = state or (lambda: {})
+        self.profiler: Optional[StackSampler] = None
+        self.heap_snapshots: "OrderedDict[int, tracemalloc.Snapshot]" = OrderedDict()
+        self._snapshot_id = 0
+        self._loop_thread_id: Optional[int] = None
+
+    def setup(self, app: web.Application):
+        if not self.settings.enabled:
+            return
+        app.router.add_get('/admin/state', self.state_handler)
+        app.router.add_post('/admin/profile/start', self.profile_start)
+        app.router.add_post('/admin/profile/stop', self.profile_stop)
+        app.router.add_get('/admin/profile', self.profile_status)
+        app.router.add_get('/admin/profile/download', self.profile_download)
+        app.router.add_post('/admin/heap/snapshot', self.heap_snapshot)
+        app.router.add_get('/admin/heap/diff', self.heap_diff)
+        app.router.add_post('/admin/heap/stop', self.heap_stop)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+
+    async def _on_startup(self, app: web.Application):
+        self._loop_thread_id = threading.get_ident()
+
+    async def _on_cleanup(self, app: web.Application):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def middleware(self):
+        """Chặn /admin/... và /stats/... không có quyền (xem authorized)"""
+        @web.middleware
+        async def middleware(request: web.Request, handler):
+            if request.path.startswith(PROTECTED_PATH_PREFIXES) and not self.authorized(request):
+                logger.warning("Từ chối truy cập admin", extra={"remote": request.remote, "path": request.path})
+                return web.json_response({'success': False, 'message': 'Forbidden'}, status=403)
+            return await handler(request)
+        return middleware
+
+    def authorized(self, request: web.Request) -> bool:
+        """Có cấu hình token: bắt buộc token (kể cả localhost, vì sau reverse proxy mọi request đều từ localhost)"""
+        if self.settings.token:
+            token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+            return hmac.compare_digest(token.encode(), self.settings.token.encode())
+        return _is_local(request.remote)
+
+    # ---------- state ----------
+
+    async def state_handler(self, request: web.Request):
+        """GET /admin/state"""
+        return web.json_response({"process": process_state(), **self.state()}, dumps=_dumps)
+
+    # ---------- CPU profile ----------
+
+    async def profile_start(self, request: web.Request):
+        """POST /admin/profile/start?seconds=10&interval_ms=5"""
+        if self.profiler is not None and self.profiler.running:
+            return web.json_response({'success': False, 'message': 'Profile đang chạy'}, status=409)
+        try:
+            seconds = float(request.query.get('seconds', DEFAULT_PROFILE_SECONDS))
+            interval = float(request.query.get('interval_ms', DEFAULT_SAMPLE_INTERVAL * 1000)) / 1000
+        except ValueError:
+            return web.json_response({'success': False, 'message': 'seconds/interval_ms không hợp lệ'}, status=400)
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        interval = max(interval, 0.001)
+        self.profiler = StackSampler(self._loop_thread_id or threading.get_ident(), interval)
+        self.profiler.start(seconds)
+        logger.info("Bắt đầu CPU profile %.1f giây", seconds, extra={"interval_ms": interval * 1000})
+        return web.json_response({'success': True, 'seconds': seconds, 'interval_ms': interval * 1000})
+
+    async def profile_stop(self, request: web.Request):
+        """POST /admin/profile/stop - dừng sớm (thread profiler dừng sau tối đa một interval)"""
+        if self.profiler is None:
+            return web.json_response({'success': False, 'message': 'Chưa có profile'}, status=404)
+        await asyncio.get_running_loop().run_in_executor(None, self.profiler.stop)
+        return web.json_response({'success': True, **self.profiler.snapshot()})
+
+    async def profile_status(self, request: web.Request):
+        """GET /admin/profile - trạng thái và hàm chiếm nhiều sample nhất"""
+        if self.profiler is None:
+            return web.json_response({'success': False, 'message': 'Chưa có profile'}, status=404)
+        return web.json_response({'success': True, **self.profiler.snapshot(_query_int(request, 'top', DEFAULT_TOP))})
+
+    async def profile_download(self, request: web.Request):
+        """GET /admin/profile/download - collapsed stack"""
+        if self.profiler is None:
+            return web.json_response({'success': False, 'message': 'Chưa có profile'}, status=404)
+        return web.Response(
+            text=self.profiler.collapsed(),
+            headers={'Content-Disposition': f'attachment; filename="profile-{os.getpid()}.collapsed"'}
+        )
+
+    # ---------- heap ----------
+
+    async def heap_snapshot(self, request: web.Request):
+        """POST /admin/heap/snapshot?frames=10 - bật tracemalloc nếu chưa bật, chụp snapshot"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(_query_int(request, 'frames', DEFAULT_TRACE_FRAMES))
+            logger.info("Bật tracemalloc")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        self._snapshot_id += 1
+        self.heap_snapshots[self._snapshot_id] = snapshot
+        while len(self.heap_snapshots) > MAX_HEAP_SNAPSHOTS:
+            self.heap_snapshots.popitem(last=False)
+
+        top = _query_int(request, 'top', DEFAULT_TOP)
+        current, peak = tracemalloc.get_traced_memory()
+        return web.json_response({
+            'success': True,
+            'id': self._snapshot_id,
+            'snapshots': list(self.heap_snapshots),
+            'traced_kb': current // 1024,
+            'peak_kb': peak // 1024,
+            'top': [_stat_entry(stat) for stat in snapshot.statistics('lineno')[:top]],
+        })
+
+    async def heap_diff(self, request: web.Request):
+        """GET /admin/heap/diff?from=1&to=2 (mặc định: hai snapshot gần nhất)"""
+        ids = list(self.heap_snapshots)
+        try:
+            old_id = int(request.query.get('from', ids[-2] if len(ids) >= 2 else 0))
+            new_id = int(request.query.get('to', ids[-1] if ids else 0))
+        except ValueError:
+            return web.json_response({'success': False, 'message': 'from/to không hợp lệ'}, status=400)
+        if old_id not in self.heap_snapshots or new_id not in self.heap_snapshots:
+            return web.json_response(
+                {'success': False, 'message': 'Cần hai snapshot', 'snapshots': ids}, status=404
+            )
+        top = _query_int(request, 'top', DEFAULT_TOP)
+        stats = self.heap_snapshots[new_id].compare_to(self.heap_snapshots[old_id], 'lineno')
+        return web.json_response({
+            'success': True,
+            'from': old_id,
+            'to': new_id,
+            'size_diff_kb': round(sum(stat.size_diff for stat in stats) / 1024, 1),
+            'top': [_diff_entry(stat) for stat in stats[:top]],
+        })
+
+    async def heap_stop(self, request: web.Request):
+        """POST /admin/heap/stop - tắt tracemalloc (tốn bộ nhớ và CPU khi bật) và bỏ snapshot"""
+        tracemalloc.stop()
+        self.heap_snapshots.clear()
+        return web.json_response({'success': True})
@@ -0,0 +1,103 @@
+"""
+Admission control cho WebSocket upgrade
+Giới hạn tốc độ nhận connection (token bucket) và số handshake đang xử lý
+(xác thực, đăng ký, broadcast presence, replay) để reconnect storm sau deploy
+không kéo cả process xuống; connection bị từ chối nhận retry delay có jitter
+"""
+import asyncio
+import random
+from typing import Dict, Optional
+
+from .rate_limit import TokenBucket
+
+# Close code "Try Again Later" (RFC 6455 registry)
+CLOSE_TRY_AGAIN_LATER = 1013
+
+DEFAULT_ACCEPT_RATE = 200.0  # connection/giây
+DEFAULT_ACCEPT_BURST = 400
+DEFAULT_MAX_HANDSHAKES = 100
+DEFAULT_HANDSHAKE_WAIT = 2.0  # Giây chờ slot handshake trước khi từ chối
+DEFAULT_RETRY_MIN = 1.0
+DEFAULT_RETRY_MAX = 10.0
+
+
+class AdmissionSettings:
+    """Tham số admission control cho mỗi deployment"""
+    __slots__ = ("enabled", "accept_rate", "accept_burst", "max_handshakes",
+                 "handshake_wait", "retry_min", "retry_max")
+
+    def __init__(self, enabled: bool = True, accept_rate: float = DEFAULT_ACCEPT_RATE,
+                 accept_burst: int = DEFAULT_ACCEPT_BURST, max_handshakes: int = DEFAULT_MAX_HANDSHAKES,
+                 handshake_wait: float = DEFAULT_HANDSHAKE_WAIT, retry_min: float = DEFAULT_RETRY_MIN,
+                 retry_max: float = DEFAULT_RETRY_MAX):
+        self.enabled = enabled
+        self.accept_rate = accept_rate
+        self.accept_burst = accept_burst
+        self.max_handshakes = max_handshakes
+        self.handshake_wait = handshake_wait
+        self.retry_min = retry_min
+        self.retry_max = max(retry_min, retry_max)
+
+
+class AdmissionStats:
+    """Bộ đếm connection được nhận, phải chờ và bị từ chối"""
+
+    def __init__(self):
+        self.accepted = 0
+        self.deferred = 0  # Phải chờ slot handshake
+        self.rejected_rate = 0  # Vượt token bucket
+        self.rejected_busy = 0  # Chờ slot handshake quá handshake_wait
+
+    def snapshot(self) -> Dict:
+        return {
+            "accepted": self.accepted,
+            "deferred": self.deferred,
+            "rejected_rate": self.rejected_rate,
+            "rejected_busy": self.rejected_busy,
+        }
+
+
+class AdmissionController:
+    """
+    enter() trước khi xử lý upgrade, leave() khi handshake xong (đã gửi trạng thái ban đầu)
+    enter() trả về None nếu được nhận, ngược lại là retry delay (giây) gợi ý cho client
+    """
+
+    def __init__(self, settings: AdmissionSettings = None, stats: AdmissionStats = None):
+        self.settings = settings or AdmissionSettings()
+        self.stats = stats or AdmissionStats()
+        self.bucket = TokenBucket(self.settings.accept_rate, self.settings.accept_burst)
+        self.handshakes = asyncio.Semaphore(self.settings.max_handshakes)
+        self.in_progress = 0
+
+    def retry_delay(self, base: float = 0.0) -> float:
+        """Retry delay = base + jitter trong [retry_min, retry_max] để các client không reconnect cùng lúc"""
+        settings = self.settings
+        return base + random.uniform(settings.retry_min, settings.retry_max)
+
+    async def enter(self) -> Optional[float]:
+        settings = self.settings
+        if settings.enabled:
+            if not self.bucket.try_acquire():
+                self.stats.rejected_rate += 1
+                return self.retry_delay(self.bucket.wait_time())
+
+            if self.handshakes.locked():
+                self.stats.deferred += 1
+            try:
+                await asyncio.wait_for(self.handshakes.acquire(), settings.handshake_wait)
+            except asyncio.TimeoutError:
+                self.stats.rejected_busy += 1
+                return self.retry_delay()
+
+        self.in_progress += 1
+        self.stats.accepted += 1
+        return None
+
+    def leave(self):
+        self.in_progress -= 1
+        if self.settings.enabled:
+            self.handshakes.release()
+
+    def snapshot(self) -> Dict:
+        return {**self.stats.snapshot(), "in_progress": self.in_progress}
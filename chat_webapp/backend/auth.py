@@ -0,0 +1,119 @@
+"""
+Xác thực JWT dùng chung cho REST API và WebSocket server
+Token đã verify được cache theo digest (TTL, không vượt quá exp của token)
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import jwt
+from aiohttp import web
+
+# JWT Secret (trong production nên dùng environment variable)
+JWT_SECRET = "your-secret-key-change-in-production"
+JWT_ALGORITHM = "HS256"
+JWT_EXPIRATION_HOURS = 24
+
+# Cache token đã verify
+DEFAULT_TOKEN_CACHE_SIZE = 10000
+DEFAULT_TOKEN_CACHE_TTL = 300  # giây
+
+# Key lưu username đã xác thực trong aiohttp request
+REQUEST_USER_KEY = "username"
+
+
+def generate_token(username: str) -> str:
+    """Tạo JWT token"""
+    payload = {
+        'username': username,
+        'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS),
+        'iat': datetime.utcnow()
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+def bearer_token(request: web.Request) -> Optional[str]:
+    """Lấy token từ header Authorization: Bearer <token>"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    return auth_header[7:]
+
+
+class TokenVerifier:
+    """
+    Verify JWT và cache payload theo sha256(token)
+    Entry hết hạn sau ttl giây hoặc khi token hết hạn (exp), tùy cái nào sớm hơn
+    """
+
+    def __init__(self, secret: str = JWT_SECRET, algorithm: str = JWT_ALGORITHM,
+                 max_entries: int = DEFAULT_TOKEN_CACHE_SIZE, ttl: float = DEFAULT_TOKEN_CACHE_TTL):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()  # {digest: (expires_at, payload)}
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def verify(self, token: str) -> Optional[dict]:
+        """Payload của token hợp lệ, None nếu sai chữ ký/hết hạn"""
+        if not token:
+            return None
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        now = time.time()
+        cached = self._cache.get(digest)
+        if cached is not None:
+            expires_at, payload = cached
+            if now < expires_at:
+                self.hits += 1
+                self._cache.move_to_end(digest)
+                return payload
+            del self._cache[digest]
+
+        self.misses += 1
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        except jwt.InvalidTokenError:  # Bao gồm ExpiredSignatureError
+            self.rejected += 1
+            return None
+
+        expires_at = now + self.ttl
+        exp = payload.get('exp')
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        self._cache[digest] = (expires_at, payload)
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return payload
+
+    def username(self, token: str) -> Optional[str]:
+        payload = self.verify(token)
+        return payload.get('username') if payload else None
+
+    def snapshot(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached_tokens": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def auth_middleware(verifier: TokenVerifier):
+    """
+    Middleware xác thực một lần cho mỗi request:
+    request["username"] = username nếu có Bearer token hợp lệ, ngược lại None
+    (handler tự quyết định trả 401)
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        token = bearer_token(request)
+        request[REQUEST_USER_KEY] = verifier.username(token) if token else None
+        return await handler(request)
+    return middleware
@@ -1,43 +1,47 @@
 """
 Xử lý authentication (đăng ký, đăng nhập)
 """
+from typing import Optional
+
 from .database import Database
 from .protocol import Message, MessageType
+from .session import SessionRegistry
 
 class AuthHandler:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, sessions: SessionRegistry = None):
         self.db = db
-        self.authenticated_users = {}  # {client_id: username}
+        # Session dùng chung với server và các handler (username nằm trên Session)
+        self.sessions = sessions if sessions is not None else SessionRegistry()
     
-    async def handle_register(self, client_id: str, data: dict) -> bytes:
+    async def handle_register(self, client_id: str, data: dict) -> dict:
         """Xử lý đăng ký - nhận username từ form"""
         username = data.get('username', '').strip()
         email = data.get('email', '').strip()
         password = data.get('password', '')
         
         if not username or not email or not password:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Username, email và password không được để trống"
             )
         
         if len(username) < 3:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Username phải có ít nhất 3 ký tự"
             )
         
         if '@' not in email:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Email không hợp lệ"
             )
         
         if len(password) < 6:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Password phải có ít nhất 6 ký tự"
@@ -46,26 +50,26 @@ class AuthHandler:
         success, message, registered_username = self.db.register_user(username, email, password)
         
         if success:
-            return Message.create_response(
+            return Message.response(
                 MessageType.SUCCESS,
                 True,
                 message,
                 {"action": "register", "email": email, "username": registered_username}
             )
         else:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 message
             )
     
-    async def handle_login(self, client_id: str, data: dict) -> bytes:
+    async def handle_login(self, client_id: str, data: dict) -> dict:
         """Xử lý đăng nhập - chỉ dùng email"""
         email = data.get('email', '').strip()
         password = data.get('password', '')
         
         if not email or not password:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Email và password không được để trống"
@@ -74,8 +78,8 @@ class AuthHandler:
         success, message, username = self.db.authenticate_user(email, password)
         
         if success and username:
-            self.authenticated_users[client_id] = username
-            return Message.create_response(
+            self.sessions.authenticate(client_id, username)
+            return Message.response(
                 MessageType.SUCCESS,
                 True,
                 message,
@@ -86,24 +90,25 @@ class AuthHandler:
                 }
             )
         else:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 message
             )
     
-    async def handle_logout(self, client_id: str) -> bytes:
+    async def handle_logout(self, client_id: str) -> dict:
         """Xử lý đăng xuất"""
-        if client_id in self.authenticated_users:
-            username = self.authenticated_users.pop(client_id)
-            return Message.create_response(
+        session = self.sessions.get(client_id)
+        username = self.sessions.deauthenticate(session) if session else None
+        if username:
+            return Message.response(
                 MessageType.SUCCESS,
                 True,
                 f"Đăng xuất thành công",
                 {"action": "logout", "username": username}
             )
         else:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Bạn chưa đăng nhập"
@@ -111,13 +116,13 @@ class AuthHandler:
     
     def is_authenticated(self, client_id: str) -> bool:
         """Kiểm tra client đã đăng nhập chưa"""
-        return client_id in self.authenticated_users
+        return self.sessions.username(client_id) is not None
     
-    def get_username(self, client_id: str) -> str:
+    def get_username(self, client_id: str) -> Optional[str]:
         """Lấy username của client"""
-        return self.authenticated_users.get(client_id, None)
+        return self.sessions.username(client_id)
     
     def get_all_users(self) -> list:
         """Lấy danh sách tất cả users đang online"""
-        return list(self.authenticated_users.values())
+        return self.sessions.online_usernames()
 
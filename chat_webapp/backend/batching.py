@@ -0,0 +1,142 @@
+"""
+Gom các message outbound của một connection thành một frame BATCH
+Client bật qua trường "batch" trong message AUTH
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .protocol import Message, MessageType
+
+logger = logging.getLogger(__name__)
+
+# Giới hạn server cho tham số client yêu cầu
+MAX_BATCH_DELAY_MS = 50
+MAX_BATCH_MESSAGES = 256
+DEFAULT_BATCH_DELAY_MS = 5
+DEFAULT_BATCH_MESSAGES = 32
+
+# Bucket (số message/batch) cho thống kê phân bố kích thước batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class BatchStats:
+    """Thống kê batch size và độ trễ thêm vào (dùng chung cho mọi connection)"""
+
+    def __init__(self):
+        self.batches = 0
+        self.messages = 0
+        self.size_buckets = [0] * len(BATCH_SIZE_BUCKETS)
+        self.added_latency_total = 0.0  # Tổng độ trễ (giây) của message đầu mỗi batch
+        self.added_latency_max = 0.0
+
+    def record(self, size: int, added_latency: float):
+        self.batches += 1
+        self.messages += size
+        for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= bound:
+                self.size_buckets[i] += 1
+                break
+        self.added_latency_total += added_latency
+        if added_latency > self.added_latency_max:
+            self.added_latency_max = added_latency
+
+    def snapshot(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "avg_batch_size": self.messages / self.batches if self.batches else 0,
+            "size_buckets": dict(zip(BATCH_SIZE_BUCKETS, self.size_buckets)),
+            "avg_added_latency_ms": self.added_latency_total / self.batches * 1000 if self.batches else 0,
+            "max_added_latency_ms": self.added_latency_max * 1000,
+        }
+
+
+class OutboundBatcher:
+    """
+    Gom message trong tối đa max_delay giây hoặc max_messages message
+    rồi gửi một lần qua send_frame
+    """
+
+    def __init__(self, send_frame: Callable[[dict], Awaitable], max_delay: float,
+                 max_messages: int, stats: BatchStats = None):
+        self.send_frame = send_frame
+        self.max_delay = max_delay
+        self.max_messages = max_messages
+        self.stats = stats
+        self._pending: List[dict] = []
+        self._first_at = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._closed = False
+
+    @classmethod
+    def from_request(cls, options: dict, send_frame: Callable, stats: BatchStats = None):
+        """Tạo batcher từ tham số client gửi trong AUTH (đã giới hạn theo server)"""
+        if not isinstance(options, dict):
+            options = {}
+        delay_ms = options.get('max_delay_ms', DEFAULT_BATCH_DELAY_MS)
+        max_messages = options.get('max_messages', DEFAULT_BATCH_MESSAGES)
+        if not isinstance(delay_ms, (int, float)) or delay_ms <= 0:
+            delay_ms = DEFAULT_BATCH_DELAY_MS
+        if not isinstance(max_messages, int) or max_messages <= 0:
+            max_messages = DEFAULT_BATCH_MESSAGES
+        return cls(
+            send_frame,
+            min(delay_ms, MAX_BATCH_DELAY_MS) / 1000,
+            min(max_messages, MAX_BATCH_MESSAGES),
+            stats
+        )
+
+    def __len__(self) -> int:
+        """Số message đang chờ trong batch"""
+        return len(self._pending)
+
+    def settings(self) -> dict:
+        """Tham số thực tế (gửi lại cho client)"""
+        return {"max_delay_ms": self.max_delay * 1000, "max_messages": self.max_messages}
+
+    async def send(self, message: dict):
+        """Đưa message vào batch; gửi ngay khi đủ max_messages"""
+        if self._closed:
+            return
+        if not self._pending:
+            self._first_at = time.perf_counter()
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._on_timer)
+        self._pending.append(message)
+        if len(self._pending) >= self.max_messages:
+            await self.flush()
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.ensure_future(self._flush_safely())
+
+    async def _flush_safely(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("Lỗi gửi batch: %s", e)
+
+    async def flush(self):
+        """Gửi toàn bộ message đang chờ"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        pending = self._pending
+        if not pending:
+            return
+        self._pending = []
+        if self.stats:
+            self.stats.record(len(pending), time.perf_counter() - self._first_at)
+        if len(pending) == 1:
+            await self.send_frame(pending[0])
+        else:
+            await self.send_frame(Message.build(MessageType.BATCH, {"messages": pending}))
+
+    def close(self):
+        """Hủy timer, bỏ các message chưa gửi (connection đã đóng)"""
+        self._closed = True
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = []
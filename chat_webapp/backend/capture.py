@@ -0,0 +1,303 @@
+"""
+Ghi lại traffic inbound (WebSocket frame và REST request) để replay sau bằng benchmarks/replay.py
+- File nhị phân: header CHATCAP1, sau đó các record có length prefix
+  record = >I độ dài | >d timestamp | B kind | >H độ dài session id | session id | payload
+- Ghi ở thread nền qua queue có giới hạn: queue đầy thì bỏ record và đếm, event loop không bao giờ chờ
+- Xoay file theo kích thước giống RotatingFileHandler: path, path.1, ..., path.<max_files - 1>
+- Không ghi secret: token của AUTH/handshake và password của LOGIN/REGISTER bị bỏ trước khi ghi
+  (AUTH chỉ giữ username trong token để replay tạo token mới)
+"""
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from base64 import b64encode
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import jwt
+from aiohttp import web
+
+from .auth import REQUEST_USER_KEY
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CHATCAP1"
+# Độ dài record (không tính chính nó), timestamp, kind, độ dài session id
+RECORD_HEADER = struct.Struct(">IdBH")
+LENGTH = struct.Struct(">I")
+
+# Loại record
+KIND_WS_OPEN = 1      # payload JSON: path, codec, username (xác thực lúc upgrade), query
+KIND_WS_TEXT = 2      # payload: frame text nguyên bản (UTF-8)
+KIND_WS_BINARY = 3    # payload: frame binary nguyên bản
+KIND_WS_CLOSE = 4     # payload rỗng
+KIND_HTTP = 5         # payload JSON: method, path, username, content_type, body (base64) hoặc body_size
+KIND_WS_REDACTED = 6  # payload JSON: message đã bỏ secret (AUTH/LOGIN/REGISTER), kèm username của AUTH
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_FILES = 5
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_BODY = 64 * 1024
+FLUSH_INTERVAL = 1.0  # giây
+
+# Tham số query của handshake được giữ lại (token thì không)
+HANDSHAKE_QUERY = ("last_seq", "last_broadcast_seq", "batch_ms")
+# Message có secret: ghi dạng KIND_WS_REDACTED
+SECRET_FIELDS = {"AUTH": "token", "LOGIN": "password", "REGISTER": "password"}
+# Path không ghi (traffic vận hành, không phải của client)
+SKIP_PATH_PREFIXES = ("/admin", "/stats", "/metrics")
+
+
+class CaptureSettings:
+    """Bật capture khi có path; kích thước mỗi file và số file giữ lại khi xoay"""
+    __slots__ = ("path", "max_bytes", "max_files", "queue_size", "max_body")
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_files: int = DEFAULT_MAX_FILES, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 max_body: int = DEFAULT_MAX_BODY):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_files = max(1, max_files)
+        self.queue_size = queue_size
+        self.max_body = max_body
+
+
+class CaptureRecord:
+    """Một record đọc từ file capture"""
+    __slots__ = ("timestamp", "kind", "session_id", "payload")
+
+    def __init__(self, timestamp: float, kind: int, session_id: str, payload: bytes):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.session_id = session_id
+        self.payload = payload
+
+    def json(self) -> Dict:
+        return json.loads(self.payload)
+
+
+def encode_record(timestamp: float, kind: int, session_id: str, payload: bytes) -> bytes:
+    sid = session_id.encode("utf-8")
+    return RECORD_HEADER.pack(RECORD_HEADER.size - LENGTH.size + len(sid) + len(payload),
+                              timestamp, kind, len(sid)) + sid + payload
+
+
+def capture_files(path) -> List[Path]:
+    """Các file của một capture theo thứ tự thời gian (file xoay cũ nhất trước)"""
+    path = Path(path)
+    rotated = sorted((candidate for candidate in path.parent.glob(path.name + ".*")
+                      if candidate.suffix[1:].isdigit()),
+                     key=lambda candidate: int(candidate.suffix[1:]), reverse=True)
+    return rotated + ([path] if path.exists() else [])
+
+
+def read_capture(path) -> Iterator[CaptureRecord]:
+    """Đọc mọi record của capture (kể cả file đã xoay); record cuối bị cắt dở thì bỏ qua"""
+    for file_path in capture_files(path):
+        with open(file_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{file_path} không phải file capture")
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, timestamp, kind, sid_length = RECORD_HEADER.unpack(header)
+                body = f.read(length - RECORD_HEADER.size + LENGTH.size)
+                if len(body) < length - RECORD_HEADER.size + LENGTH.size:
+                    break
+                yield CaptureRecord(timestamp, kind, body[:sid_length].decode("utf-8"), body[sid_length:])
+
+
+class CaptureFile:
+    """Ghi record đã encode vào file, xoay khi vượt max_bytes (không thread-safe)"""
+
+    def __init__(self, path, max_bytes: int = DEFAULT_MAX_BYTES, max_files: int = DEFAULT_MAX_FILES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_files = max(1, max_files)
+        self.rotations = 0
+        self._file = None
+        self._size = 0
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(MAGIC)
+            self._size = len(MAGIC)
+
+    def write(self, record: bytes):
+        if self._size + len(record) > self.max_bytes and self._size > len(MAGIC):
+            self.rotate()
+        self._file.write(record)
+        self._size += len(record)
+
+    def rotate(self):
+        self._file.close()
+        if self.max_files > 1:
+            for index in range(self.max_files - 2, 0, -1):
+                source = self.path.with_name(f"{self.path.name}.{index}")
+                if source.exists():
+                    os.replace(source, self.path.with_name(f"{self.path.name}.{index + 1}"))
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self.rotations += 1
+        self._open()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def redact(message: Dict) -> Optional[Dict]:
+    """
+    Bản sao message không có secret nếu là AUTH/LOGIN/REGISTER, ngược lại None
+    AUTH giữ username đọc từ token (không verify chữ ký, chỉ để replay tạo token mới)
+    """
+    if not isinstance(message, dict):
+        return None
+    field = SECRET_FIELDS.get(message.get("type"))
+    data = message.get("data")
+    if field is None or not isinstance(data, dict):
+        return None
+    redacted = {"type": message["type"], "data": {key: value for key, value in data.items() if key != field}}
+    if field == "token":
+        try:
+            redacted["username"] = jwt.decode(str(data.get("token", "")),
+                                              options={"verify_signature": False}).get("username")
+        except jwt.PyJWTError:
+            redacted["username"] = None
+    return redacted
+
+
+class CaptureWriter:
+    """
+    Capture cho một server: các hàm ws_* / http_request chỉ encode rồi đưa vào queue,
+    thread "capture-writer" ghi file, flush mỗi FLUSH_INTERVAL và xoay file
+    Gọi khi enabled (server kiểm tra `if capture.enabled` trước để không tốn gì khi tắt)
+    """
+
+    def __init__(self, settings: CaptureSettings = None):
+        self.settings = settings or CaptureSettings()
+        self.enabled = self.settings.path is not None
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(self.settings.queue_size)
+        self._file: Optional[CaptureFile] = None
+        self._thread: Optional[threading.Thread] = None
+        if self.enabled:
+            self._file = CaptureFile(self.settings.path, self.settings.max_bytes, self.settings.max_files)
+            self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+            self._thread.start()
+            logger.info("Capture traffic vào %s", self.settings.path)
+
+    def write(self, kind: int, session_id: str, payload: bytes = b"", timestamp: float = None):
+        record = encode_record(time.time() if timestamp is None else timestamp, kind, session_id, payload)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.records += 1
+        self.bytes += len(record)
+
+    def ws_open(self, session_id: str, request: web.Request, codec_name: str, username: Optional[str]):
+        self.write(KIND_WS_OPEN, session_id, json.dumps({
+            "path": request.path,
+            "codec": codec_name,
+            "username": username,
+            "query": {name: request.query[name] for name in HANDSHAKE_QUERY if name in request.query},
+        }).encode("utf-8"))
+
+    def ws_frame(self, session_id: str, frame, message):
+        """frame: dữ liệu gốc (str/bytes); message: kết quả parse (None nếu frame lỗi)"""
+        redacted = redact(message)
+        if redacted is not None:
+            self.write(KIND_WS_REDACTED, session_id, json.dumps(redacted).encode("utf-8"))
+        elif isinstance(frame, str):
+            self.write(KIND_WS_TEXT, session_id, frame.encode("utf-8"))
+        else:
+            self.write(KIND_WS_BINARY, session_id, bytes(frame))
+
+    def ws_close(self, session_id: str):
+        self.write(KIND_WS_CLOSE, session_id)
+
+    async def http_request(self, request: web.Request):
+        """Ghi request REST; body lớn hoặc multipart chỉ ghi kích thước, password trong JSON bị bỏ"""
+        entry = {
+            "method": request.method,
+            "path": request.path_qs,
+            "username": request.get(REQUEST_USER_KEY),
+            "content_type": request.content_type if request.can_read_body else None,
+        }
+        size = request.content_length or 0
+        if request.can_read_body and size <= self.settings.max_body and not request.content_type.startswith("multipart/"):
+            body = await request.read()
+            if request.content_type == "application/json" and b'"password"' in body:
+                try:
+                    data = json.loads(body)
+                    data.pop("password", None)
+                    body = json.dumps(data).encode("utf-8")
+                except (ValueError, AttributeError):
+                    body = b""
+            entry["body"] = b64encode(body).decode("ascii")
+        elif request.can_read_body:
+            entry["body_size"] = size
+        self.write(KIND_HTTP, "rest", json.dumps(entry).encode("utf-8"))
+
+    def middleware(self):
+        """Middleware REST (sau auth_middleware để biết username)"""
+        @web.middleware
+        async def middleware(request: web.Request, handler):
+            if self.enabled and not request.path.startswith(SKIP_PATH_PREFIXES) and request.method != "OPTIONS":
+                await self.http_request(request)
+            return await handler(request)
+        return middleware
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                self._file.flush()
+                continue
+            if record is None:
+                break
+            try:
+                self._file.write(record)
+            except OSError:
+                logger.exception("Lỗi ghi capture")
+        self._file.close()
+
+    def close(self):
+        """Ghi hết record còn trong queue rồi đóng file (gọi nhiều lần được)"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.enabled = False
+
+    def snapshot(self) -> Dict:
+        """Thống kê cho /stats"""
+        if self._file is None:
+            return {"enabled": False}
+        return {
+            "enabled": self.enabled,
+            "path": str(self.settings.path),
+            "records": self.records,
+            "bytes": self.bytes,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "rotations": self._file.rotations,
+        }
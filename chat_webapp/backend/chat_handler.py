@@ -1,41 +1,47 @@
 """
 Xử lý chat messages
 """
-from .database import Database
+from .database import Database, BROADCAST_STREAM
 from .protocol import Message, MessageType
-from typing import Dict, Callable, Optional
+from .session import Session, SessionRegistry
+from .loop_monitor import LoopMonitor
+from .metrics import FANOUT_RECIPIENTS, FANOUT_SECONDS, MESSAGES_OUT
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Số người nhận và thời gian mỗi lần fan-out, theo loại
+FANOUT_KINDS = ("broadcast", "presence", "private")
+_FANOUT_RECIPIENTS = {kind: FANOUT_RECIPIENTS.labels(kind) for kind in FANOUT_KINDS}
+_FANOUT_SECONDS = {kind: FANOUT_SECONDS.labels(kind) for kind in FANOUT_KINDS}
 
 class ChatHandler:
-    def __init__(self, db: Database, auth_handler=None):
+    def __init__(self, db: Database, auth_handler=None, message_cache=None, monitor: LoopMonitor = None):
         self.db = db
         self.auth_handler = auth_handler
-        self.clients: Dict[str, Callable] = {}  # {client_id: send_callback}
+        self.message_cache = message_cache  # MessageCache (REST server), cập nhật ngay khi lưu
+        # Session dùng chung với AuthHandler: client đã xác thực là client nhận message
+        self.sessions: SessionRegistry = auth_handler.sessions if auth_handler else SessionRegistry()
+        # Đo thời gian các vòng fan-out
+        self.monitor = monitor or LoopMonitor(enabled=False)
     
-    async def register_client(self, client_id: str, send_callback: Callable):
-        """Đăng ký client để nhận messages"""
-        self.clients[client_id] = send_callback
-        
-        # Gửi thông báo user online đến tất cả clients
-        if self.auth_handler:
-            username = self.auth_handler.get_username(client_id)
-            if username:
-                print(f"[ChatHandler] Registering client {client_id} for user {username}")
-                # Broadcast user online status
-                await self._broadcast_user_status(username, True, exclude_id=client_id)
-            else:
-                print(f"[ChatHandler] Warning: No username found for client {client_id}")
+    async def register_client(self, client_id: str):
+        """Client vừa xác thực: thông báo user online đến các client khác"""
+        username = self.sessions.username(client_id)
+        if username:
+            logger.debug("Client đã xác thực", extra={"client_id": client_id, "username": username})
+            # Broadcast user online status
+            await self._broadcast_user_status(username, True, exclude_id=client_id)
+        else:
+            logger.warning("Client chưa xác thực, bỏ qua thông báo online", extra={"client_id": client_id})
     
     async def unregister_client(self, client_id: str):
-        """Hủy đăng ký client"""
-        if client_id in self.clients:
-            # Gửi thông báo user offline đến tất cả clients
-            if self.auth_handler:
-                username = self.auth_handler.get_username(client_id)
-                if username:
-                    # Broadcast user offline status
-                    await self._broadcast_user_status(username, False)
-            
-            del self.clients[client_id]
+        """Client sắp ngắt kết nối: thông báo user offline (gọi trước khi bỏ xác thực)"""
+        username = self.sessions.username(client_id)
+        if username:
+            # Broadcast user offline status
+            await self._broadcast_user_status(username, False)
     
     async def _broadcast_user_status(self, username: str, is_online: bool, exclude_id: str = None):
         """Broadcast trạng thái online/offline của user"""
@@ -50,19 +56,19 @@ class ChatHandler:
             "data": status_data
         }
         
-        print(f"[ChatHandler] Broadcasting user status: {username} is {'online' if is_online else 'offline'}, clients: {list(self.clients.keys())}, exclude: {exclude_id}")
-        
-        # Gửi đến tất cả clients
-        for client_id, callback in self.clients.items():
-            if client_id != exclude_id:
-                try:
-                    # Gửi JSON message trực tiếp (không encode thành bytes)
-                    await callback(status_msg)
-                    print(f"[ChatHandler] Sent {message_type} to {client_id}")
-                except Exception as e:
-                    print(f"[ChatHandler] Lỗi gửi user status đến {client_id}: {e}")
+        # Gửi đến tất cả clients đã xác thực
+        recipients = 0
+        with self.monitor.step("fanout.presence"), _FANOUT_SECONDS["presence"].time():
+            for session in self.sessions.authenticated():
+                if session.client_id != exclude_id:
+                    await self._send(session, status_msg, counted=False)
+                    recipients += 1
+        _FANOUT_RECIPIENTS["presence"].observe(recipients)
+        logger.debug("Broadcast trạng thái user",
+                     extra={"username": username, "status": status_data["status"], "recipients": recipients})
+        MESSAGES_OUT.labels(message_type).inc(recipients)
     
-    async def handle_chat(self, sender_id: str, sender_username: str, data: dict) -> bytes:
+    async def handle_chat(self, sender_id: str, sender_username: str, data: dict) -> dict:
         """Xử lý chat message"""
         message_text = data.get('message', '').strip()
         receiver_username = data.get('receiver', '').strip()
@@ -98,20 +104,19 @@ class ChatHandler:
             pass
         
         if not message_text:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Message không được để trống"
             )
         
-        # Lưu vào database
-        self.db.save_message(
-            sender_username, 
-            receiver_username, 
-            message_text,
-            message_type=message_type,
-            file_path=file_path
-        )
+        # Không lưu/xếp hàng chờ giao cho receiver không tồn tại
+        if receiver_username and not self.db.user_exists(receiver_username):
+            return Message.response(
+                MessageType.ERROR,
+                False,
+                f"User {receiver_username} không tồn tại"
+            )
         
         # Tạo message data với file info nếu có
         message_data = message_text
@@ -124,17 +129,24 @@ class ChatHandler:
                 "message_type": "file"
             }
         
+        # Lưu vào database kèm event log (mỗi stream nhận một seq)
+        events = self.save_message(
+            sender_username,
+            receiver_username,
+            message_data,
+            message_type=message_type,
+            file_path=file_path
+        )
+        
         # Nếu có receiver, gửi private message
         if receiver_username:
-            return await self._send_private_message(
-                sender_username, receiver_username, message_data
-            )
+            return await self._send_private_message(sender_username, receiver_username, events)
         else:
             # Broadcast message
-            return await self._broadcast_message(sender_username, message_data, exclude_id=sender_id)
+            return await self._broadcast_message(events[BROADCAST_STREAM], exclude_id=sender_id)
     
-    async def _send_private_message(self, sender: str, receiver: str, message_data) -> bytes:
-        """Gửi private message đến một user cụ thể"""
+    def build_event(self, sender: str, receiver: str, message_data) -> dict:
+        """Tạo event PRIVATE_MESSAGE/BROADCAST (chưa có seq) từ message text hoặc dict file"""
         # Xử lý message_data có thể là dict hoặc string
         if isinstance(message_data, dict):
             message_text = message_data.get("message", "")
@@ -143,107 +155,171 @@ class ChatHandler:
             message_text = message_data
             file_info = {}
         
-        # Tìm client_id của receiver
-        receiver_id = None
-        if self.auth_handler:
-            for client_id in self.clients.keys():
-                if self.auth_handler.get_username(client_id) == receiver:
-                    receiver_id = client_id
-                    break
-        
-        # Gửi message đến receiver nếu tìm thấy
-        if receiver_id:
-            private_msg_data = {
+        if receiver:
+            return Message.build(MessageType.PRIVATE_MESSAGE, {
                 "sender": sender,
                 "receiver": receiver,
                 "message": message_text,
                 "type": "private",
                 **file_info
-            }
-            private_msg = Message.encode(MessageType.PRIVATE_MESSAGE, private_msg_data)
-            await self.send_to_client(receiver_id, private_msg)
-        
-        # Gửi message lại cho sender để hiển thị trong UI
-        sender_id = None
-        if self.auth_handler:
-            for client_id in self.clients.keys():
-                if self.auth_handler.get_username(client_id) == sender:
-                    sender_id = client_id
-                    break
-        
-        if sender_id:
-            sender_msg_data = {
-                "sender": sender,
-                "receiver": receiver,
+            })
+        return Message.build(MessageType.BROADCAST, {
+            "sender": sender,
+            "message": message_text,
+            "type": "broadcast",
+            **file_info
+        })
+    
+    def save_message(self, sender: str, receiver: str, message_data,
+                     message_type: str = 'text', file_path: str = None) -> Dict[str, dict]:
+        """
+        Lưu message và ghi event vào log
+        Private: stream của receiver và sender, thêm vào hàng chờ giao của receiver;
+        broadcast: BROADCAST_STREAM
+        Returns: {stream: event đã gắn seq}
+        """
+        event = self.build_event(sender, receiver, message_data)
+        message_text = event["data"]["message"]
+        streams = [receiver, sender] if receiver else [BROADCAST_STREAM]
+        events = self.db.save_message_with_events(
+            sender, receiver, message_text, event, streams,
+            message_type=message_type, file_path=file_path,
+            pending_for=receiver or None
+        )
+        if not events:
+            # Ghi log lỗi: vẫn gửi real-time, chỉ là không có seq để replay
+            return {stream: event for stream in streams}
+        
+        if self.message_cache:
+            saved = next(iter(events.values()))["data"]
+            self.message_cache.add({
+                "id": saved["id"],
+                "sender_username": sender,
+                "receiver_username": receiver,
                 "message": message_text,
-                "type": "private",
-                **file_info
-            }
-            sender_msg = Message.encode(MessageType.PRIVATE_MESSAGE, sender_msg_data)
-            await self.send_to_client(sender_id, sender_msg)
+                "message_type": message_type,
+                "file_path": file_path,
+                "timestamp": saved["timestamp"]
+            })
+        return events
+    
+    async def _send_private_message(self, sender: str, receiver: str, events: Dict[str, dict]) -> dict:
+        """Gửi private message đến một user cụ thể"""
+        event_data = events[receiver]["data"]
+        file_info = {k: v for k, v in event_data.items() if k in ["file_id", "filename", "file_size", "message_type"]}
+        
+        # Gửi message đến các session của receiver (index theo username)
+        receiver_sessions = list(self.sessions.for_user(receiver))
+        sender_sessions = list(self.sessions.for_user(sender))
+        with _FANOUT_SECONDS["private"].time():
+            for session in receiver_sessions:
+                await self._send(session, events[receiver])
+            
+            # Gửi message lại cho sender để hiển thị trong UI
+            for session in sender_sessions:
+                await self._send(session, events[sender])
+        _FANOUT_RECIPIENTS["private"].observe(len(receiver_sessions) + len(sender_sessions))
         
         # Response cho sender
-        return Message.create_response(
+        return Message.response(
             MessageType.SUCCESS,
             True,
-            "Message đã được gửi" if receiver_id else f"User {receiver} không online",
+            "Message đã được gửi" if receiver_sessions else f"User {receiver} không online, message sẽ được giao khi user đăng nhập",
             {
                 "action": "chat",
                 "receiver": receiver,
-                "message": message_text,
+                "message": event_data["message"],
                 **file_info
             }
         )
     
-    async def _broadcast_message(self, sender: str, message_data, exclude_id: str = None):
+    async def _broadcast_message(self, broadcast_msg: dict, exclude_id: str = None):
         """Broadcast message đến tất cả clients"""
-        # Xử lý message_data có thể là dict hoặc string
-        if isinstance(message_data, dict):
-            message_text = message_data.get("message", "")
-            file_info = {k: v for k, v in message_data.items() if k in ["file_id", "filename", "file_size", "message_type"]}
-        else:
-            message_text = message_data
-            file_info = {}
-        
-        broadcast_data = {
-            "sender": sender,
-            "message": message_text,
-            "type": "broadcast",
-            **file_info
-        }
-        
-        broadcast_msg = Message.encode(MessageType.BROADCAST, broadcast_data)
+        broadcast_data = broadcast_msg["data"]
+        file_info = {k: v for k, v in broadcast_data.items() if k in ["file_id", "filename", "file_size", "message_type"]}
         
         # Gửi đến tất cả clients trừ sender
-        for client_id, callback in self.clients.items():
-            if client_id != exclude_id:
-                try:
-                    await callback(broadcast_msg)
-                except Exception as e:
-                    print(f"Lỗi gửi message đến {client_id}: {e}")
+        recipients = 0
+        with self.monitor.step("fanout.broadcast"), _FANOUT_SECONDS["broadcast"].time():
+            for session in self.sessions.authenticated():
+                if session.client_id != exclude_id:
+                    await self._send(session, broadcast_msg, counted=False)
+                    recipients += 1
+        _FANOUT_RECIPIENTS["broadcast"].observe(recipients)
+        MESSAGES_OUT.labels(broadcast_msg["type"]).inc(recipients)
         
-        # Response cho sender
-        return Message.create_response(
+        # Response cho sender (broadcast_seq để client sender cập nhật vị trí đã nhận)
+        response_data = {"action": "chat", "message": broadcast_data["message"], **file_info}
+        if "seq" in broadcast_data:
+            response_data["broadcast_seq"] = broadcast_data["seq"]
+        return Message.response(
             MessageType.SUCCESS,
             True,
             "Message đã được gửi",
-            {"action": "chat", "message": message_text, **file_info}
+            response_data
+        )
+    
+    def mark_read(self, username: str, peer: str, up_to_id: int) -> Optional[dict]:
+        """
+        Cập nhật read marker và ghi READ_RECEIPT vào event log của peer
+        Returns: event READ_RECEIPT (None nếu marker không đổi)
+        """
+        result = self.db.mark_read(username, peer, up_to_id)
+        if result is None:
+            return None
+        last_read_id, unread_count = result
+        receipt = Message.build(MessageType.READ_RECEIPT, {
+            "reader": username,
+            "peer": peer,
+            "last_read_id": last_read_id,
+            "unread_count": unread_count
+        })
+        events = self.db.append_events([peer], receipt)
+        return events.get(peer, receipt)
+    
+    async def handle_mark_read(self, client_id: Optional[str], username: str, data: dict) -> dict:
+        """
+        Xử lý MARK_READ (WebSocket/TCP và POST /api/chat/read, client_id None):
+        đánh dấu đã đọc conversation với peer tới message_id
+        """
+        peer = data.get('peer', '')
+        message_id = data.get('message_id')
+        if not isinstance(peer, str) or not peer.strip():
+            return Message.response(MessageType.ERROR, False, "Thiếu peer")
+        if not isinstance(message_id, int) or isinstance(message_id, bool) or message_id <= 0:
+            return Message.response(MessageType.ERROR, False, "message_id không hợp lệ")
+        peer = peer.strip()
+        
+        receipt = self.mark_read(username, peer, message_id)
+        if receipt:
+            # Gửi read receipt cho bên kia nếu đang online ở process này; session ở process
+            # khác nhận từ event log (SYNC khi thấy seq nhảy cóc)
+            for session in list(self.sessions.for_user(peer)):
+                await self._send(session, receipt)
+            read_state = {"last_read_id": receipt["data"]["last_read_id"],
+                          "unread_count": receipt["data"]["unread_count"]}
+        else:
+            read_state = self.db.get_read_state(username, peer)
+        
+        return Message.response(
+            MessageType.SUCCESS,
+            True,
+            "Đã đánh dấu đã đọc",
+            {"action": "mark_read", "peer": peer, **read_state}
         )
     
-    async def send_to_client(self, client_id: str, message: bytes):
+    async def send_to_client(self, client_id: str, message: dict):
         """Gửi message đến một client cụ thể"""
-        if client_id in self.clients:
-            try:
-                await self.clients[client_id](message)
-            except Exception as e:
-                print(f"Lỗi gửi message đến {client_id}: {e}")
+        session = self.sessions.get(client_id)
+        if session is not None:
+            await self._send(session, message)
+    
+    async def _send(self, session: Session, message: dict, counted: bool = True):
+        try:
+            await session.send(message, counted)
+        except Exception as e:
+            logger.warning("Lỗi gửi message: %s", e, extra={"client_id": session.client_id})
     
     def get_online_users(self) -> list:
         """Lấy danh sách username của các user đang online"""
-        online_users = []
-        if self.auth_handler:
-            for client_id in self.clients.keys():
-                username = self.auth_handler.get_username(client_id)
-                if username and username not in online_users:
-                    online_users.append(username)
-        return online_users
\ No newline at end of file
+        return self.sessions.online_usernames()
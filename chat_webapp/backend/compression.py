@@ -0,0 +1,171 @@
+"""
+Cấu hình permessage-deflate cho WebSocket
+Cho phép chỉnh level, window bits, context takeover và ngưỡng kích thước:
+frame nhỏ hơn ngưỡng được gửi không nén để tiết kiệm CPU
+"""
+import inspect
+import time
+import zlib
+from typing import Dict, Optional
+
+from aiohttp import web, WSMsgType
+
+try:
+    from aiohttp.compression_utils import ZLibCompressor
+except ImportError:  # aiohttp cũ: writer dùng zlib.compressobj trực tiếp
+    ZLibCompressor = None
+
+# Frame lớn hơn mức này được aiohttp nén trong executor
+MAX_SYNC_CHUNK_SIZE = 16 * 1024
+
+
+class CompressionSettings:
+    """Tham số nén cho mỗi deployment"""
+    __slots__ = ("enabled", "level", "window_bits", "context_takeover", "threshold")
+
+    def __init__(self, enabled: bool = True, level: int = 1, window_bits: int = 15,
+                 context_takeover: bool = True, threshold: int = 256):
+        self.enabled = enabled
+        self.level = level  # 0-9 (zlib)
+        self.window_bits = max(9, min(15, window_bits))
+        self.context_takeover = context_takeover
+        self.threshold = threshold  # Frame nhỏ hơn (bytes) gửi không nén
+
+
+class CompressionStats:
+    """Bộ đếm băng thông và CPU nén (dùng chung cho mọi connection)"""
+
+    def __init__(self):
+        self.frames_compressed = 0
+        self.frames_uncompressed = 0
+        self.bytes_in = 0  # Bytes payload trước khi nén (mọi frame)
+        self.bytes_compressed_in = 0  # Bytes payload của các frame được nén
+        self.bytes_compressed_out = 0  # Bytes sau khi nén
+        self.compress_seconds = 0.0  # CPU time cho zlib
+
+    def snapshot(self) -> Dict:
+        saved = self.bytes_compressed_in - self.bytes_compressed_out
+        return {
+            "frames_compressed": self.frames_compressed,
+            "frames_uncompressed": self.frames_uncompressed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_in - saved,
+            "bytes_saved": saved,
+            "compression_ratio": (self.bytes_compressed_out / self.bytes_compressed_in
+                                  if self.bytes_compressed_in else 1.0),
+            "compress_cpu_ms": self.compress_seconds * 1000,
+        }
+
+
+class _InstrumentedCompressor:
+    """Bọc compressor của aiohttp để đo bytes ra và CPU time"""
+
+    def __init__(self, inner, stats: CompressionStats):
+        self._inner = inner
+        self._stats = stats
+        self._async_compress = inspect.iscoroutinefunction(getattr(inner, 'compress', None))
+
+    def _record(self, start: float, output: bytes) -> bytes:
+        self._stats.compress_seconds += time.perf_counter() - start
+        self._stats.bytes_compressed_out += len(output)
+        return output
+
+    def compress_sync(self, data) -> bytes:
+        start = time.perf_counter()
+        return self._record(start, self._inner.compress_sync(data))
+
+    def compress(self, data):
+        if self._async_compress:
+            return self._compress_async(data)
+        start = time.perf_counter()
+        return self._record(start, self._inner.compress(data))
+
+    async def _compress_async(self, data) -> bytes:
+        start = time.perf_counter()
+        return self._record(start, await self._inner.compress(data))
+
+    def flush(self, *args) -> bytes:
+        start = time.perf_counter()
+        return self._record(start, self._inner.flush(*args))
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+class WebSocketCompressor:
+    """
+    Điều khiển nén cho một WebSocket đã prepare
+    Dùng writer nội bộ của aiohttp; nếu không tương thích thì để aiohttp tự xử lý
+    """
+
+    def __init__(self, ws: web.WebSocketResponse, settings: CompressionSettings,
+                 stats: CompressionStats):
+        self.ws = ws
+        self.settings = settings
+        self.stats = stats
+        self.negotiated = ws.compress or 0  # Window bits client chấp nhận (0 = không nén)
+        self.writer = getattr(ws, '_writer', None)
+        self.controllable = False
+        self._compressed_inflight = 0
+        if self.negotiated and self.writer is not None and hasattr(self.writer, 'compress'):
+            self.controllable = self._install_compressor()
+
+    def _install_compressor(self) -> bool:
+        settings = self.settings
+        wbits = min(self.negotiated, settings.window_bits)
+        if not settings.context_takeover:
+            # Server luôn được phép tự reset context (Z_FULL_FLUSH)
+            self.writer.notakeover = True
+        if ZLibCompressor is not None:
+            inner = ZLibCompressor(level=settings.level, wbits=-wbits,
+                                   max_sync_chunk_size=MAX_SYNC_CHUNK_SIZE)
+        else:
+            inner = zlib.compressobj(settings.level, zlib.DEFLATED, -wbits)
+        if not hasattr(self.writer, '_compressobj'):
+            return False
+        self.writer._compressobj = _InstrumentedCompressor(inner, self.stats)
+        return True
+
+    def _send_text(self, data: bytes):
+        # send_frame (aiohttp mới) gửi thẳng bytes UTF-8, không decode/encode lại
+        send_frame = getattr(self.ws, 'send_frame', None)
+        if send_frame is not None:
+            return send_frame(data, WSMsgType.TEXT)
+        return self.ws.send_str(data.decode('utf-8'))
+
+    async def send(self, data: bytes, binary: bool):
+        """Gửi frame đã encode (text là JSON UTF-8), chỉ nén khi vượt ngưỡng"""
+        size = len(data)
+        stats = self.stats
+        stats.bytes_in += size
+        send = self.ws.send_bytes if binary else self._send_text
+
+        if not self.negotiated:
+            stats.frames_uncompressed += 1
+            await send(data)
+            return
+
+        # Không tắt nén khi đang có frame nén gửi dở để giữ đúng thứ tự frame
+        if self.controllable and size < self.settings.threshold and not self._compressed_inflight:
+            stats.frames_uncompressed += 1
+            self.writer.compress = 0
+            try:
+                await send(data)
+            finally:
+                self.writer.compress = self.negotiated
+            return
+
+        stats.frames_compressed += 1
+        if self.controllable:
+            stats.bytes_compressed_in += size
+        self._compressed_inflight += 1
+        try:
+            await send(data)
+        finally:
+            self._compressed_inflight -= 1
+
+
+def create_websocket_response(settings: Optional[CompressionSettings], **kwargs) -> web.WebSocketResponse:
+    """Tạo WebSocketResponse với permessage-deflate bật/tắt theo settings"""
+    kwargs.setdefault('compress', settings.enabled if settings else True)
+    return web.WebSocketResponse(**kwargs)
@@ -3,14 +3,35 @@ Database models và quản lý kết nối database
 """
 import sqlite3
 import hashlib
+import json
+import logging
 import os
-from typing import Optional, Tuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 import bcrypt
 
+from .user_directory import UserDirectory
+from .metrics import observe_query
+
+logger = logging.getLogger(__name__)
+
+# Stream event chung cho broadcast (mỗi user có stream riêng theo username)
+BROADCAST_STREAM = "*"
+# Số event giữ lại cho mỗi stream: bằng giới hạn replay khi reconnect (lệch nhiều hơn thì client
+# nhận RESYNC), event cũ hơn không bao giờ được đọc nên bị xóa ngay khi ghi event mới
+EVENT_RETENTION = 500
+# Số message chờ giao (pending_deliveries) tối đa mỗi receiver: client không gửi DELIVERY_ACK
+# (bot raw TCP, client cũ) không làm bảng lớn mãi; phần cũ hơn client tải lại qua REST khi nhận RESYNC
+PENDING_DELIVERY_LIMIT = 1000
+# Cắt theo lô: hàng chờ của receiver vượt giới hạn thêm PENDING_TRIM_EVERY entry mới cắt về
+# PENDING_DELIVERY_LIMIT (đếm bằng pending_counts), không tốn một range scan mỗi message
+PENDING_TRIM_EVERY = 32
+
 class Database:
     def __init__(self, db_path: str = "chat_app.db"):
         self.db_path = db_path
         self.init_database()
+        self.users = UserDirectory(self)  # Cache profile user (username/email)
     
     def get_connection(self):
         """Tạo kết nối database"""
@@ -47,9 +68,71 @@ class Database:
             )
         """)
         
+        # Seq cuối cùng của mỗi stream (username hoặc BROADCAST_STREAM)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS event_sequences (
+                stream TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        
+        # Event log: khóa chính (stream, seq) để replay bằng range scan
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                stream TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                message_id INTEGER,
+                payload TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (stream, seq)
+            ) WITHOUT ROWID
+        """)
+        
+        # Trạng thái đọc của mỗi conversation: unread_count cập nhật dần khi lưu message/đánh dấu đọc
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_reads (
+                username TEXT NOT NULL,
+                peer_username TEXT NOT NULL,
+                last_read_id INTEGER NOT NULL DEFAULT 0,
+                unread_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (username, peer_username)
+            ) WITHOUT ROWID
+        """)
+        
+        # Đếm message mới đọc bằng range scan theo (receiver, sender, id)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation
+            ON messages (receiver_username, sender_username, id)
+        """)
+        
+        # Private message chưa được receiver xác nhận (DELIVERY_ACK)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pending_deliveries (
+                receiver_username TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (receiver_username, message_id)
+            ) WITHOUT ROWID
+        """)
+        
+        # Số entry trong pending_deliveries của mỗi receiver, cập nhật cùng transaction với hàng chờ
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pending_counts (
+                receiver_username TEXT PRIMARY KEY,
+                pending INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        # Đếm lại lúc khởi động (database cũ chưa có bảng đếm)
+        cursor.execute("""
+            INSERT OR REPLACE INTO pending_counts (receiver_username, pending)
+            SELECT receiver_username, COUNT(*) FROM pending_deliveries GROUP BY receiver_username
+        """)
+        
         conn.commit()
         conn.close()
     
+    @observe_query
     def register_user(self, username: str, email: str, password: str) -> Tuple[bool, str, Optional[str]]:
         """
         Đăng ký user mới - nhận username từ form
@@ -68,36 +151,47 @@ class Database:
             if '@' not in email:
                 return False, "Email không hợp lệ", None
             
+            # User đã có trong cache thì không cần hỏi database
+            if self.users.is_cached_username(username):
+                return False, "Username đã tồn tại", None
+            if self.users.is_cached_email(email):
+                return False, "Email đã tồn tại", None
+            
             conn = self.get_connection()
             cursor = conn.cursor()
             
-            # Kiểm tra username đã tồn tại
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            if cursor.fetchone():
-                conn.close()
-                return False, "Username đã tồn tại", None
-            
-            # Kiểm tra email đã tồn tại
-            cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
-            if cursor.fetchone():
+            # Kiểm tra username/email đã tồn tại trong một query
+            cursor.execute(
+                "SELECT username, email, created_at FROM users WHERE username = ? OR email = ?",
+                (username, email)
+            )
+            existing = cursor.fetchall()
+            if existing:
                 conn.close()
+                for row in existing:
+                    self.users.remember(dict(row))
+                if any(row['username'] == username for row in existing):
+                    return False, "Username đã tồn tại", None
                 return False, "Email đã tồn tại", None
             
             # Hash password
             password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
             
             # Thêm user mới
+            created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
             cursor.execute(
-                "INSERT INTO users (username, password_hash, email) VALUES (?, ?, ?)",
-                (username, password_hash, email)
+                "INSERT INTO users (username, password_hash, email, created_at) VALUES (?, ?, ?, ?)",
+                (username, password_hash, email, created_at)
             )
             conn.commit()
             conn.close()
+            self.users.remember({"username": username, "email": email, "created_at": created_at})
             return True, "Đăng ký thành công", username
         
         except Exception as e:
             return False, f"Lỗi đăng ký: {str(e)}", None
     
+    @observe_query
     def authenticate_user(self, email: str, password: str) -> Tuple[bool, str, Optional[str]]:
         """
         Xác thực user - chỉ dùng email
@@ -141,18 +235,39 @@ class Database:
         except Exception as e:
             return False, f"Lỗi đăng nhập: {str(e)}", None
     
-    def user_exists(self, username: str) -> bool:
-        """Kiểm tra user có tồn tại không"""
+    @observe_query
+    def create_users(self, users: Iterable[Tuple[str, str, str, str]]) -> int:
+        """
+        Thêm nhiều user trong một transaction (dataset/load test), bỏ qua user đã tồn tại
+        users: (username, email, password_hash, created_at) - password_hash đã hash sẵn
+        (hash bcrypt từng user như register_user mất ~0.2 s/user)
+        Returns: số user đã thêm
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone() is not None
-        conn.close()
-        return result
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT OR IGNORE INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                users
+            )
+            inserted = cursor.rowcount
+            conn.commit()
+            return inserted
+        finally:
+            conn.close()
+
+    def user_exists(self, username: str) -> bool:
+        """Kiểm tra user có tồn tại không (qua cache UserDirectory)"""
+        return self.users.exists(username)
+    
+    def get_user_profile(self, username: str) -> Optional[dict]:
+        """Profile (username, email, created_at) của user, None nếu không tồn tại"""
+        return self.users.get(username)
     
+    @observe_query
     def save_message(self, sender: str, receiver: str, message: str, 
-                    message_type: str = 'text', file_path: str = None):
-        """Lưu message vào database"""
+                    message_type: str = 'text', file_path: str = None) -> Optional[int]:
+        """Lưu message vào database, trả về id của message"""
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
@@ -161,8 +276,327 @@ class Database:
                    VALUES (?, ?, ?, ?, ?)""",
                 (sender, receiver, message, message_type, file_path)
             )
+            message_id = cursor.lastrowid
+            self._increment_unread(cursor, sender, receiver)
             conn.commit()
             conn.close()
+            return message_id
+        except Exception as e:
+            logger.error("Lỗi lưu message: %s", e)
+            return None
+    
+    @observe_query
+    def save_message_with_events(self, sender: str, receiver: str, message: str, event: dict,
+                                 streams: Iterable[str], message_type: str = 'text',
+                                 file_path: str = None, pending_for: str = None) -> Dict[str, dict]:
+        """
+        Lưu message và ghi event vào log của từng stream trong cùng một transaction
+        pending_for: username cần xác nhận đã nhận (thêm vào pending_deliveries)
+        Returns: {stream: event đã gắn "id", "timestamp" và "seq"} (rỗng nếu lỗi)
+        """
+        # Timestamp ghi rõ (cùng format CURRENT_TIMESTAMP) để caller dựng lại row mà không cần SELECT
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        event = {"type": event['type'], "data": {**(event.get('data') or {}), "timestamp": timestamp}}
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                """INSERT INTO messages (sender_username, receiver_username, message, message_type, file_path, timestamp)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (sender, receiver, message, message_type, file_path, timestamp)
+            )
+            message_id = cursor.lastrowid
+            self._increment_unread(cursor, sender, receiver)
+            events = self._append_events(cursor, streams, event, message_id)
+            if pending_for:
+                cursor.execute(
+                    "INSERT INTO pending_deliveries (receiver_username, message_id, payload) VALUES (?, ?, ?)",
+                    (pending_for, message_id,
+                     json.dumps(events.get(pending_for, event), ensure_ascii=False))
+                )
+                self._count_pending(cursor, pending_for)
+            conn.commit()
+            return events
         except Exception as e:
-            print(f"Lỗi lưu message: {e}")
+            conn.rollback()
+            logger.error("Lỗi lưu message: %s", e)
+            return {}
+        finally:
+            conn.close()
+    
+    @observe_query
+    def save_messages(self, messages: Iterable[Tuple]) -> int:
+        """
+        Lưu nhiều message trong một transaction (import lịch sử/dataset)
+        messages: (sender, receiver, message, message_type, file_path, timestamp), receiver None = broadcast
+        unread_count được cộng dồn theo conversation; không ghi event log và hàng chờ giao
+        (message cũ, client đọc qua REST)
+        Returns: số message đã lưu
+        """
+        messages = list(messages)
+        unread: Dict[Tuple[str, str], int] = {}
+        for sender, receiver, *_ in messages:
+            if receiver and receiver != sender:
+                unread[(receiver, sender)] = unread.get((receiver, sender), 0) + 1
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany(
+                """INSERT INTO messages (sender_username, receiver_username, message, message_type, file_path, timestamp)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                messages
+            )
+            cursor.executemany(
+                """INSERT INTO conversation_reads (username, peer_username, unread_count) VALUES (?, ?, ?)
+                   ON CONFLICT(username, peer_username) DO UPDATE SET unread_count = unread_count + excluded.unread_count""",
+                [(receiver, sender, count) for (receiver, sender), count in unread.items()]
+            )
+            conn.commit()
+            return len(messages)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
+    def _increment_unread(self, cursor, sender: str, receiver: Optional[str]):
+        """Tăng unread_count của receiver cho conversation với sender (chỉ private message)"""
+        if not receiver or receiver == sender:
+            return
+        cursor.execute(
+            """INSERT INTO conversation_reads (username, peer_username, unread_count) VALUES (?, ?, 1)
+               ON CONFLICT(username, peer_username) DO UPDATE SET unread_count = unread_count + 1""",
+            (receiver, sender)
+        )
+    
+    @observe_query
+    def mark_read(self, username: str, peer: str, up_to_id: int) -> Optional[Tuple[int, int]]:
+        """
+        Đánh dấu đã đọc các message peer gửi cho username có id <= up_to_id
+        Chỉ đếm các message nằm giữa marker cũ và mới (không quét lại lịch sử)
+        Returns: (last_read_id, unread_count) nếu marker tiến lên, None nếu không đổi
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                "SELECT last_read_id FROM conversation_reads WHERE username = ? AND peer_username = ?",
+                (username, peer)
+            )
+            row = cursor.fetchone()
+            last_read_id = row['last_read_id'] if row else 0
+            
+            # Không cho marker vượt quá message mới nhất của conversation
+            cursor.execute(
+                "SELECT MAX(id) FROM messages WHERE receiver_username = ? AND sender_username = ?",
+                (username, peer)
+            )
+            newest_id = cursor.fetchone()[0] or 0
+            up_to_id = min(up_to_id, newest_id)
+            if up_to_id <= last_read_id:
+                conn.rollback()
+                return None
+            
+            cursor.execute(
+                """SELECT COUNT(*) FROM messages
+                   WHERE receiver_username = ? AND sender_username = ? AND id > ? AND id <= ?""",
+                (username, peer, last_read_id, up_to_id)
+            )
+            newly_read = cursor.fetchone()[0]
+            cursor.execute(
+                """INSERT INTO conversation_reads (username, peer_username, last_read_id, unread_count)
+                   VALUES (?, ?, ?, 0)
+                   ON CONFLICT(username, peer_username) DO UPDATE SET
+                       last_read_id = excluded.last_read_id,
+                       unread_count = MAX(unread_count - ?, 0)""",
+                (username, peer, up_to_id, newly_read)
+            )
+            cursor.execute(
+                "SELECT unread_count FROM conversation_reads WHERE username = ? AND peer_username = ?",
+                (username, peer)
+            )
+            unread_count = cursor.fetchone()[0]
+            conn.commit()
+            return up_to_id, unread_count
+        except Exception as e:
+            conn.rollback()
+            logger.error("Lỗi đánh dấu đã đọc: %s", e)
+            return None
+        finally:
+            conn.close()
+    
+    @observe_query
+    def get_read_state(self, username: str, peer: str) -> dict:
+        """Trạng thái đọc của một conversation"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT last_read_id, unread_count FROM conversation_reads WHERE username = ? AND peer_username = ?",
+            (username, peer)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return {"last_read_id": 0, "unread_count": 0}
+        return {"last_read_id": row['last_read_id'], "unread_count": row['unread_count']}
+    
+    @observe_query
+    def get_read_states(self, username: str) -> Dict[str, dict]:
+        """Trạng thái đọc mọi conversation của user: {peer: {"last_read_id", "unread_count"}}"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT peer_username, last_read_id, unread_count FROM conversation_reads WHERE username = ?",
+            (username,)
+        )
+        states = {
+            row['peer_username']: {"last_read_id": row['last_read_id'], "unread_count": row['unread_count']}
+            for row in cursor.fetchall()
+        }
+        conn.close()
+        return states
+    
+    @observe_query
+    def append_events(self, streams: Iterable[str], event: dict, message_id: int = None) -> Dict[str, dict]:
+        """Ghi một event (không kèm message mới) vào log của các stream"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            events = self._append_events(cursor, streams, event, message_id)
+            conn.commit()
+            return events
+        except Exception as e:
+            conn.rollback()
+            logger.error("Lỗi ghi event: %s", e)
+            return {}
+        finally:
+            conn.close()
+    
+    def _append_events(self, cursor, streams: Iterable[str], event: dict,
+                       message_id: Optional[int]) -> Dict[str, dict]:
+        """Cấp seq kế tiếp cho từng stream (caller giữ write lock), ghi event và bỏ event ngoài EVENT_RETENTION"""
+        result = {}
+        for stream in dict.fromkeys(streams):
+            cursor.execute(
+                """INSERT INTO event_sequences (stream, last_seq) VALUES (?, 1)
+                   ON CONFLICT(stream) DO UPDATE SET last_seq = last_seq + 1""",
+                (stream,)
+            )
+            cursor.execute("SELECT last_seq FROM event_sequences WHERE stream = ?", (stream,))
+            seq = cursor.fetchone()[0]
+            data = dict(event.get('data') or {})
+            data['seq'] = seq
+            if message_id is not None:
+                data['id'] = message_id
+            stream_event = {"type": event['type'], "data": data}
+            cursor.execute(
+                "INSERT INTO events (stream, seq, message_id, payload) VALUES (?, ?, ?, ?)",
+                (stream, seq, message_id, json.dumps(stream_event, ensure_ascii=False))
+            )
+            # Range theo khóa chính (stream, seq): thường chỉ xóa đúng một row
+            cursor.execute("DELETE FROM events WHERE stream = ? AND seq <= ?", (stream, seq - EVENT_RETENTION))
+            result[stream] = stream_event
+        return result
+    
+    @observe_query
+    def get_last_seq(self, stream: str) -> int:
+        """Seq mới nhất của stream (0 nếu chưa có event)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT last_seq FROM event_sequences WHERE stream = ?", (stream,))
+        row = cursor.fetchone()
+        conn.close()
+        return row['last_seq'] if row else 0
+    
+    @observe_query
+    def get_last_seqs(self, streams: Iterable[str]) -> Dict[str, int]:
+        """Seq mới nhất của nhiều stream trong một query"""
+        streams = list(streams)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT stream, last_seq FROM event_sequences WHERE stream IN ({','.join('?' * len(streams))})",
+            streams
+        )
+        seqs = {stream: 0 for stream in streams}
+        seqs.update({row['stream']: row['last_seq'] for row in cursor.fetchall()})
+        conn.close()
+        return seqs
+    
+    @observe_query
+    def get_events_since(self, stream: str, after_seq: int, limit: int) -> List[dict]:
+        """Các event có seq > after_seq (range scan trên khóa chính), tối đa limit event"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT payload FROM events WHERE stream = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (stream, after_seq, limit)
+        )
+        events = [json.loads(row['payload']) for row in cursor.fetchall()]
+        conn.close()
+        return events
+    
+    def _count_pending(self, cursor, receiver: str):
+        """
+        Tăng số entry chờ giao của receiver vừa thêm một entry; vượt giới hạn thêm PENDING_TRIM_EVERY
+        thì chỉ giữ PENDING_DELIVERY_LIMIT message chờ giao mới nhất
+        """
+        cursor.execute(
+            """INSERT INTO pending_counts (receiver_username, pending) VALUES (?, 1)
+               ON CONFLICT(receiver_username) DO UPDATE SET pending = pending + 1""",
+            (receiver,)
+        )
+        cursor.execute("SELECT pending FROM pending_counts WHERE receiver_username = ?", (receiver,))
+        pending = cursor.fetchone()[0]
+        if pending < PENDING_DELIVERY_LIMIT + PENDING_TRIM_EVERY:
+            return
+        cursor.execute(
+            """DELETE FROM pending_deliveries WHERE receiver_username = ? AND message_id <= (
+                   SELECT message_id FROM pending_deliveries WHERE receiver_username = ?
+                   ORDER BY message_id DESC LIMIT 1 OFFSET ?)""",
+            (receiver, receiver, PENDING_DELIVERY_LIMIT)
+        )
+        cursor.execute(
+            "UPDATE pending_counts SET pending = pending - ? WHERE receiver_username = ?",
+            (cursor.rowcount, receiver)
+        )
+    
+    @observe_query
+    def get_pending_deliveries(self, receiver: str, after_id: int, limit: int) -> List[dict]:
+        """Message chờ giao có id > after_id, theo thứ tự id (dùng để drain theo từng batch)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT payload FROM pending_deliveries
+               WHERE receiver_username = ? AND message_id > ?
+               ORDER BY message_id LIMIT ?""",
+            (receiver, after_id, limit)
+        )
+        messages = [json.loads(row['payload']) for row in cursor.fetchall()]
+        conn.close()
+        return messages
+    
+    @observe_query
+    def ack_deliveries(self, receiver: str, message_ids: Iterable[int]) -> int:
+        """Xóa các message receiver đã xác nhận, trả về số entry đã xóa"""
+        ids = [(receiver, message_id) for message_id in message_ids]
+        if not ids:
+            return 0
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "DELETE FROM pending_deliveries WHERE receiver_username = ? AND message_id = ?",
+            ids
+        )
+        deleted = cursor.rowcount
+        cursor.execute(
+            "UPDATE pending_counts SET pending = MAX(0, pending - ?) WHERE receiver_username = ?",
+            (deleted, receiver)
+        )
+        conn.commit()
+        conn.close()
+        return deleted
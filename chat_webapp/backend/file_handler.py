@@ -7,7 +7,16 @@ import aiofiles
 from pathlib import Path
 from .database import Database
 from .protocol import Message, MessageType
-from typing import Dict, Callable, Optional
+from .session import SessionRegistry
+from .metrics import FILE_BYTES
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes file nhận từ client (chunk WebSocket/TCP, upload REST) và gửi đi (download REST)
+FILE_BYTES_RECEIVED = FILE_BYTES.labels("received")
+FILE_BYTES_SENT = FILE_BYTES.labels("sent")
 
 class FileHandler:
     def __init__(self, db: Database, auth_handler=None, upload_dir: str = "uploads"):
@@ -15,38 +24,42 @@ class FileHandler:
         self.auth_handler = auth_handler
         self.upload_dir = Path(upload_dir)
         self.upload_dir.mkdir(exist_ok=True)
-        self.clients: Dict[str, Callable] = {}  # {client_id: send_callback}
+        # Session dùng chung với AuthHandler (tìm connection của receiver theo username)
+        self.sessions: SessionRegistry = auth_handler.sessions if auth_handler else SessionRegistry()
         self.file_transfers: Dict[str, dict] = {}  # {transfer_id: {sender, receiver, filename, size, chunks}}
     
-    def register_client(self, client_id: str, send_callback: Callable):
-        """Đăng ký client"""
-        self.clients[client_id] = send_callback
-    
     def unregister_client(self, client_id: str):
-        """Hủy đăng ký client"""
-        if client_id in self.clients:
-            del self.clients[client_id]
+        """Hủy các transfer dang dở của client đã ngắt kết nối"""
+        for transfer_id in [t for t, transfer in self.file_transfers.items() if transfer["sender_id"] == client_id]:
+            del self.file_transfers[transfer_id]
     
-    async def handle_file_request(self, sender_id: str, sender_username: str, data: dict) -> bytes:
+    async def handle_file_request(self, sender_id: str, sender_username: str, data: dict) -> dict:
         """Xử lý yêu cầu gửi file"""
         filename = data.get('filename', '').strip()
         file_size = data.get('size', 0)
         receiver_username = data.get('receiver', '').strip()
         
         if not filename:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Tên file không được để trống"
             )
         
         if file_size <= 0:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Kích thước file không hợp lệ"
             )
         
+        if receiver_username and not self.db.user_exists(receiver_username):
+            return Message.response(
+                MessageType.ERROR,
+                False,
+                f"User {receiver_username} không tồn tại"
+            )
+        
         # Tạo transfer_id
         import uuid
         transfer_id = str(uuid.uuid4())
@@ -66,7 +79,7 @@ class FileHandler:
         if receiver_username:
             await self._notify_receiver(transfer_id, receiver_username, sender_username, filename, file_size)
         
-        return Message.create_response(
+        return Message.response(
             MessageType.SUCCESS,
             True,
             "File request đã được tạo",
@@ -78,10 +91,10 @@ class FileHandler:
             }
         )
     
-    async def handle_file_data(self, sender_id: str, transfer_id: str, data: dict) -> bytes:
+    async def handle_file_data(self, sender_id: str, transfer_id: str, data: dict) -> dict:
         """Xử lý dữ liệu file chunk"""
         if transfer_id not in self.file_transfers:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Transfer ID không hợp lệ"
@@ -91,7 +104,7 @@ class FileHandler:
         
         # Kiểm tra sender
         if transfer["sender_id"] != sender_id:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Không có quyền gửi file này"
@@ -102,7 +115,7 @@ class FileHandler:
         is_last = data.get('is_last', False)
         
         if not chunk_data:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 "Chunk data không được để trống"
@@ -116,19 +129,20 @@ class FileHandler:
                 "data": chunk_bytes
             })
             transfer["received_size"] += len(chunk_bytes)
+            FILE_BYTES_RECEIVED.inc(len(chunk_bytes))
             
             # Nếu là chunk cuối, lưu file
             if is_last:
-                await self._save_file(transfer_id, transfer)
+                ready_event = await self._save_file(transfer_id, transfer)
                 
                 # Gửi thông báo đến receiver nếu có
-                if transfer["receiver_username"]:
-                    await self._send_file_to_receiver(transfer_id, transfer)
+                if ready_event:
+                    await self._send_file_to_receiver(transfer, ready_event)
                 
                 # Xóa transfer
                 del self.file_transfers[transfer_id]
                 
-                return Message.create_response(
+                return Message.response(
                     MessageType.SUCCESS,
                     True,
                     "File đã được nhận và lưu thành công",
@@ -139,7 +153,7 @@ class FileHandler:
                     }
                 )
             else:
-                return Message.create_response(
+                return Message.response(
                     MessageType.FILE_ACK,
                     True,
                     "Chunk đã được nhận",
@@ -151,14 +165,17 @@ class FileHandler:
                 )
         
         except Exception as e:
-            return Message.create_response(
+            return Message.response(
                 MessageType.ERROR,
                 False,
                 f"Lỗi xử lý file chunk: {str(e)}"
             )
     
-    async def _save_file(self, transfer_id: str, transfer: dict):
-        """Lưu file vào disk"""
+    async def _save_file(self, transfer_id: str, transfer: dict) -> Optional[dict]:
+        """
+        Lưu file vào disk
+        Returns: event file_ready (đã gắn seq) nếu có receiver
+        """
         # Sắp xếp chunks theo index
         chunks = sorted(transfer["chunks"], key=lambda x: x["index"])
         
@@ -171,29 +188,44 @@ class FileHandler:
             for chunk in chunks:
                 await f.write(chunk["data"])
         
-        # Lưu vào database
-        self.db.save_message(
+        receiver_username = transfer["receiver_username"]
+        if not receiver_username:
+            # Lưu vào database
+            self.db.save_message(
+                transfer["sender_username"],
+                receiver_username,
+                f"File: {transfer['filename']}",
+                message_type="file",
+                file_path=str(file_path)
+            )
+            return None
+        
+        # Lưu vào database kèm event file_ready trong log của receiver
+        notification_data = {
+            "transfer_id": transfer_id,
+            "sender": transfer["sender_username"],
+            "filename": transfer["filename"],
+            "size": transfer["size"],
+            "action": "file_ready",
+            "file_path": str(file_path)
+        }
+        event = Message.build(MessageType.FILE_REQUEST, notification_data)
+        events = self.db.save_message_with_events(
             transfer["sender_username"],
-            transfer["receiver_username"],
+            receiver_username,
             f"File: {transfer['filename']}",
+            event,
+            [receiver_username],
             message_type="file",
             file_path=str(file_path)
         )
+        return events.get(receiver_username, event)
     
     async def _notify_receiver(self, transfer_id: str, receiver_username: str, 
                               sender_username: str, filename: str, file_size: int):
         """Thông báo receiver về file sắp được gửi"""
-        if not self.auth_handler:
-            return
-        
-        # Tìm receiver client_id
-        receiver_id = None
-        for client_id in self.clients.keys():
-            if self.auth_handler.get_username(client_id) == receiver_username:
-                receiver_id = client_id
-                break
-        
-        if receiver_id:
+        receiver_sessions = list(self.sessions.for_user(receiver_username))
+        if receiver_sessions:
             notification_data = {
                 "transfer_id": transfer_id,
                 "sender": sender_username,
@@ -201,45 +233,29 @@ class FileHandler:
                 "size": file_size,
                 "action": "file_incoming"
             }
-            notification = Message.encode(MessageType.FILE_REQUEST, notification_data)
-            await self.send_to_client(receiver_id, notification)
+            notification = Message.build(MessageType.FILE_REQUEST, notification_data)
+            for session in receiver_sessions:
+                await self._send(session, notification)
     
-    async def _send_file_to_receiver(self, transfer_id: str, transfer: dict):
+    async def _send_file_to_receiver(self, transfer: dict, ready_event: dict):
         """Gửi thông báo file đã sẵn sàng đến receiver"""
-        if not self.auth_handler:
-            return
-        
         receiver_username = transfer.get("receiver_username")
         if not receiver_username:
             return
         
-        # Tìm receiver client_id
-        receiver_id = None
-        for client_id in self.clients.keys():
-            if self.auth_handler.get_username(client_id) == receiver_username:
-                receiver_id = client_id
-                break
-        
-        if receiver_id:
-            # Đọc file và gửi
-            file_path = self.upload_dir / f"{transfer_id}_{transfer['filename']}"
-            if file_path.exists():
-                notification_data = {
-                    "transfer_id": transfer_id,
-                    "sender": transfer["sender_username"],
-                    "filename": transfer["filename"],
-                    "size": transfer["size"],
-                    "action": "file_ready",
-                    "file_path": str(file_path)
-                }
-                notification = Message.encode(MessageType.FILE_REQUEST, notification_data)
-                await self.send_to_client(receiver_id, notification)
+        # Receiver offline sẽ nhận event này khi reconnect (replay theo seq)
+        for session in list(self.sessions.for_user(receiver_username)):
+            await self._send(session, ready_event)
     
-    async def send_to_client(self, client_id: str, message: bytes):
+    async def send_to_client(self, client_id: str, message: dict):
         """Gửi message đến một client cụ thể"""
-        if client_id in self.clients:
-            try:
-                await self.clients[client_id](message)
-            except Exception as e:
-                print(f"Lỗi gửi file message đến {client_id}: {e}")
+        session = self.sessions.get(client_id)
+        if session is not None:
+            await self._send(session, message)
+    
+    async def _send(self, session, message: dict):
+        try:
+            await session.send(message)
+        except Exception as e:
+            logger.warning("Lỗi gửi file message: %s", e, extra={"client_id": session.client_id})
 
@@ -6,8 +6,11 @@ from cryptography.x509.oid import NameOID
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from datetime import datetime, timedelta
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 def generate_self_signed_cert(cert_file: str = "server.crt", key_file: str = "server.key"):
     """Tạo self-signed SSL certificate"""
     
@@ -58,11 +61,13 @@ def generate_self_signed_cert(cert_file: str = "server.crt", key_file: str = "se
             encryption_algorithm=serialization.NoEncryption()
         ))
     
-    print(f"SSL certificate đã được tạo:")
-    print(f"  Certificate: {cert_file}")
-    print(f"  Private Key: {key_file}")
-    print(f"  Valid for: 365 days")
+    logger.info("SSL certificate đã được tạo:")
+    logger.info("  Certificate: %s", cert_file)
+    logger.info("  Private Key: %s", key_file)
+    logger.info("  Valid for: 365 days")
 
 if __name__ == "__main__":
+    # Chạy trực tiếp (python backend/generate_ssl_cert.py): chỉ cần in message ra stdout
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     generate_self_signed_cert()
 
@@ -0,0 +1,199 @@
+"""
+Heartbeat ping/pong, idle timeout và dọn connection chết (half-open)
+Mọi connection dùng chung một hashed timer wheel và một callback mỗi tick
+(thay cho heartbeat của aiohttp: mỗi socket một timer)
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Mặc định (giây)
+DEFAULT_PING_INTERVAL = 30.0  # Không nhận được gì trong khoảng này thì gửi ping
+DEFAULT_PONG_TIMEOUT = 10.0  # Sau ping mà vẫn im lặng thì coi là connection chết
+DEFAULT_IDLE_TIMEOUT = 0.0  # Không có message ứng dụng trong khoảng này thì đóng (0 = tắt)
+DEFAULT_TICK = 1.0
+DEFAULT_WHEEL_SLOTS = 512
+
+
+class HeartbeatSettings:
+    """Tham số heartbeat cho mỗi deployment"""
+    __slots__ = ("enabled", "ping_interval", "pong_timeout", "idle_timeout", "tick")
+
+    def __init__(self, enabled: bool = True, ping_interval: float = DEFAULT_PING_INTERVAL,
+                 pong_timeout: float = DEFAULT_PONG_TIMEOUT, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 tick: float = DEFAULT_TICK):
+        self.enabled = enabled
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+
+
+class HeartbeatStats:
+    """Bộ đếm ping và connection bị dọn"""
+
+    def __init__(self):
+        self.pings_sent = 0
+        self.reaped_dead = 0
+        self.reaped_idle = 0
+
+    def snapshot(self) -> Dict:
+        return {
+            "pings_sent": self.pings_sent,
+            "reaped_dead": self.reaped_dead,
+            "reaped_idle": self.reaped_idle,
+        }
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: item được đặt vào slot (tick hết hạn % số slot)
+    Delay dài hơn một vòng wheel thì item nằm lại slot cho tới vòng đúng tick
+    schedule/cancel O(1), advance chỉ duyệt các slot đã qua
+    """
+
+    def __init__(self, slots: int = DEFAULT_WHEEL_SLOTS, tick: float = DEFAULT_TICK):
+        self.tick = tick
+        self.slots: List[set] = [set() for _ in range(slots)]
+        self.deadlines: Dict[object, int] = {}  # {item: tick hết hạn}
+        self.current = 0  # Tick đã xử lý gần nhất
+
+    def schedule(self, item, delay: float):
+        """Đặt (hoặc dời) item hết hạn sau delay giây (làm tròn lên theo tick, tối thiểu 1 tick)"""
+        self.cancel(item)
+        expire = self.current + max(1, math.ceil(delay / self.tick))
+        self.deadlines[item] = expire
+        self.slots[expire % len(self.slots)].add(item)
+
+    def cancel(self, item):
+        expire = self.deadlines.pop(item, None)
+        if expire is not None:
+            self.slots[expire % len(self.slots)].discard(item)
+
+    def advance(self, ticks: int = 1) -> list:
+        """Tiến wheel thêm ticks tick, trả về các item đã hết hạn"""
+        expired = []
+        for _ in range(ticks):
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            if not slot:
+                continue
+            due = [item for item in slot if self.deadlines[item] <= self.current]
+            for item in due:
+                slot.discard(item)
+                del self.deadlines[item]
+            expired.extend(due)
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+
+class HeartbeatMonitor:
+    """
+    Theo dõi Session của server: gửi ping khi connection im lặng, dọn connection
+    không trả lời ping hoặc quá idle_timeout qua server.disconnect_client
+    Transport thu session.last_seen (mọi frame nhận được) và session.last_message (message ứng dụng)
+    """
+
+    def __init__(self, server, settings: HeartbeatSettings = None, stats: HeartbeatStats = None):
+        self.server = server
+        self.settings = settings or HeartbeatSettings()
+        self.stats = stats or HeartbeatStats()
+        self.wheel = TimerWheel(tick=self.settings.tick)
+        self._handle = None
+        self._last_tick = 0.0
+
+    def start(self):
+        if not self.settings.enabled or self._handle is not None:
+            return
+        self._last_tick = time.monotonic()
+        self._handle = asyncio.get_running_loop().call_later(self.settings.tick, self._tick)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def track(self, session):
+        """Bắt đầu theo dõi session vừa kết nối"""
+        now = time.monotonic()
+        session.last_seen = now
+        session.last_message = now
+        session.ping_sent = None
+        if not self.settings.enabled:
+            return
+        delay = self._next_check(session, now)
+        if delay is not None:
+            self.wheel.schedule(session, delay)
+
+    def untrack(self, session):
+        self.wheel.cancel(session)
+
+    def _can_ping(self, session) -> bool:
+        return hasattr(session.conn, 'ping')  # Raw TCP không có ping, chỉ áp dụng idle_timeout
+
+    def _next_check(self, session, now: float):
+        """Số giây tới lần kiểm tra tiếp theo (None = không cần theo dõi)"""
+        settings = self.settings
+        delays = []
+        if settings.idle_timeout > 0:
+            delays.append(session.last_message + settings.idle_timeout - now)
+        if self._can_ping(session) and settings.ping_interval > 0:
+            if session.ping_sent is not None:
+                delays.append(session.ping_sent + settings.pong_timeout - now)
+            else:
+                delays.append(session.last_seen + settings.ping_interval - now)
+        return min(delays) if delays else None
+
+    def _tick(self):
+        now = time.monotonic()
+        # Bù tick bị trễ khi event loop bận
+        ticks = max(1, int((now - self._last_tick) / self.settings.tick))
+        self._last_tick += ticks * self.settings.tick
+        self._handle = asyncio.get_running_loop().call_later(
+            max(0.0, self._last_tick + self.settings.tick - now), self._tick
+        )
+        for session in self.wheel.advance(ticks):
+            self._check(session, now)
+
+    def _check(self, session, now: float):
+        """Session hết hạn trên wheel: dọn, gửi ping hoặc hẹn lại (activity không dời timer, chỉ cập nhật last_seen)"""
+        settings = self.settings
+        if settings.idle_timeout > 0 and now - session.last_message >= settings.idle_timeout:
+            self.stats.reaped_idle += 1
+            self._reap(session, "idle timeout")
+            return
+
+        if session.ping_sent is not None:
+            if session.last_seen >= session.ping_sent:
+                session.ping_sent = None  # Đã nhận pong (hoặc frame khác) sau ping
+            elif now - session.ping_sent >= settings.pong_timeout:
+                self.stats.reaped_dead += 1
+                self._reap(session, "không trả lời ping")
+                return
+
+        if (session.ping_sent is None and self._can_ping(session) and settings.ping_interval > 0
+                and now - session.last_seen >= settings.ping_interval):
+            session.ping_sent = now
+            self.stats.pings_sent += 1
+            asyncio.ensure_future(self._ping(session))
+
+        delay = self._next_check(session, now)
+        if delay is not None:
+            self.wheel.schedule(session, delay)
+
+    async def _ping(self, session):
+        try:
+            await session.conn.ping()
+        except Exception:
+            # Ghi lỗi: pong_timeout sẽ dọn connection
+            pass
+
+    def _reap(self, session, reason: str):
+        logger.info("Đóng connection: %s", reason, extra={"client_id": session.client_id})
+        asyncio.ensure_future(self.server.disconnect_client(session.client_id))
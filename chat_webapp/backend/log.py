@@ -0,0 +1,182 @@
+"""
+Logging có cấu trúc, theo level, không chặn event loop
+- Module dùng logging.getLogger(__name__) như bình thường, field cấu trúc qua extra={...}
+- Record được đẩy vào queue (QueueHandler), thread nền (QueueListener) mới format và ghi ra stream
+  Queue đầy thì bỏ record và đếm số record bị bỏ, không bao giờ chờ
+- Level chung + level theo module (vd. backend.rest_api.access=warning)
+- Sample record DEBUG của từng message (chỉ giữ 1/N), output text hoặc JSON (mỗi dòng một object)
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Dict, Optional, TextIO
+
+ROOT_LOGGER = "backend"
+DEFAULT_LEVEL = "info"
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_SAMPLE_EVERY = 1  # Giữ 1 trong N record DEBUG (1 = giữ hết)
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s%(fields)s"
+
+# Thuộc tính có sẵn của LogRecord; thuộc tính khác là field do extra={...} thêm vào
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "fields"}
+
+
+def record_fields(record: logging.LogRecord) -> Dict:
+    """Các field cấu trúc của record (truyền qua extra)"""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class LogSettings:
+    """Cấu hình logging cho mỗi process"""
+    __slots__ = ("level", "module_levels", "json", "sample_every", "queue_size", "stream")
+
+    def __init__(self, level: str = DEFAULT_LEVEL, module_levels: Dict[str, str] = None, json: bool = False,
+                 sample_every: int = DEFAULT_SAMPLE_EVERY, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 stream: TextIO = None):
+        self.level = level
+        self.module_levels = module_levels or {}
+        self.json = json
+        self.sample_every = max(1, sample_every)
+        self.queue_size = queue_size
+        self.stream = stream
+
+    @staticmethod
+    def parse_module_levels(values) -> Dict[str, str]:
+        """["backend.rest_api=debug", ...] -> {"backend.rest_api": "debug"}"""
+        levels = {}
+        for value in values or ():
+            name, _, level = value.partition("=")
+            if not level:
+                raise ValueError(f"Cần dạng module=level: {value}")
+            levels[name.strip()] = level.strip()
+        return levels
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi record một dòng JSON: ts, level, logger, msg + các field cấu trúc"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Dòng text dễ đọc, field cấu trúc nối ở cuối dạng key=value"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = record_fields(record)
+        record.fields = "".join(f" {key}={value}" for key, value in fields.items()) if fields else ""
+        return super().format(record)
+
+
+class SampleFilter(logging.Filter):
+    """Chỉ giữ 1 trong every record DEBUG (log từng message); INFO trở lên luôn giữ"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self.seen = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        self.seen += 1
+        return self.seen % self.every == 1
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không chờ: queue đầy thì bỏ record"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Đưa nguyên record vào queue: ghép msg % args và format traceback để thread ghi log làm
+        (QueueHandler.prepare làm việc đó trên thread gọi log và bỏ exc_info, field "exc" mất theo)
+        Queue nằm trong process nên không cần pickle được
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LogState:
+    handler: Optional[DroppingQueueHandler] = None
+    listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _level(name: str) -> int:
+    level = logging.getLevelName(str(name).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Log level không hợp lệ: {name}")
+    return level
+
+
+def setup_logging(settings: LogSettings = None) -> DroppingQueueHandler:
+    """Gắn QueueHandler vào logger "backend" và chạy thread ghi log (gọi một lần lúc khởi động)"""
+    settings = settings or LogSettings()
+    level = _level(settings.level)
+    module_levels = {name: _level(value) for name, value in settings.module_levels.items()}
+    shutdown_logging()
+
+    output = logging.StreamHandler(settings.stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if settings.json else TextFormatter())
+
+    handler = DroppingQueueHandler(queue.Queue(settings.queue_size))
+    handler.addFilter(SampleFilter(settings.sample_every))
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.addHandler(handler)
+    root.propagate = False
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener.start()
+    _LogState.handler, _LogState.listener = handler, listener
+    return handler
+
+
+def shutdown_logging():
+    """Dừng thread ghi log sau khi ghi hết record còn trong queue"""
+    if _LogState.listener is not None:
+        _LogState.listener.stop()
+        logging.getLogger(ROOT_LOGGER).removeHandler(_LogState.handler)
+    _LogState.handler = _LogState.listener = None
+
+
+def snapshot() -> Dict:
+    """Thống kê cho /stats: số record đang chờ và bị bỏ"""
+    handler = _LogState.handler
+    if handler is None:
+        return {"enabled": False}
+    return {"enabled": True, "queued": handler.queue.qsize(), "dropped": handler.dropped}
+
+
+def elapsed_ms(start: float) -> float:
+    """Thời gian (ms) từ time.perf_counter() start, làm tròn cho field duration_ms"""
+    return round((time.perf_counter() - start) * 1000, 2)
@@ -0,0 +1,235 @@
+"""
+Đo độ trễ lập lịch của event loop (loop lag) và phát hiện đoạn code chặn loop
+- Probe call_later định kỳ: lag = thời điểm chạy thực tế - thời điểm hẹn, lưu histogram
+- Watchdog thread: loop không chạy probe quá threshold thì chụp stack của thread loop
+  (thấy ngay bcrypt, sqlite hay vòng broadcast nào đang chặn)
+- step(name): đo thời gian từng bước (DB call, nhánh dispatch, vòng fan-out), ghi lại bước chậm
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from .metrics import histogram_lines, sample_lines
+
+logger = logging.getLogger(__name__)
+
+# Bucket histogram loop lag (ms), bucket cuối là +Inf
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+DEFAULT_PROBE_INTERVAL = 0.1  # giây
+DEFAULT_SLOW_THRESHOLD = 0.1  # giây
+MAX_SLOW_EVENTS = 50
+MAX_STACK_FRAMES = 20
+
+# Các method Database (sqlite, chạy đồng bộ trên loop) được đo bằng instrument()
+DB_TIMED_METHODS = (
+    "register_user", "authenticate_user", "save_message", "save_message_with_events",
+    "mark_read", "append_events", "get_last_seqs", "get_events_since",
+    "get_pending_deliveries", "ack_deliveries", "get_read_states",
+)
+
+
+class StepStats:
+    """Thống kê một bước được đo"""
+    __slots__ = ("count", "total", "max", "slow")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+
+class _Step:
+    """Context manager đo một bước (dùng được quanh cả code sync và await)"""
+    __slots__ = ("monitor", "name", "start")
+
+    def __init__(self, monitor: "LoopMonitor", name: str):
+        self.monitor = monitor
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.monitor.record_step(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class LoopMonitor:
+    """Loop lag + bước chậm + stack sample; đủ nhẹ để bật trong production"""
+
+    def __init__(self, interval: float = DEFAULT_PROBE_INTERVAL, threshold: float = DEFAULT_SLOW_THRESHOLD,
+                 enabled: bool = True):
+        self.interval = interval
+        self.threshold = threshold
+        self.enabled = enabled
+        self.lag_buckets = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.steps: Dict[str, StepStats] = {}
+        self.slow_events = deque(maxlen=MAX_SLOW_EVENTS)  # Bước chậm và stack khi loop bị chặn
+        self.stall_samples = 0
+        self._handle = None
+        self._expected = 0.0
+        self._last_beat = 0.0
+        self._beat_sampled = False
+        self._loop_thread_id: Optional[int] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---------- probe loop lag ----------
+
+    def start(self):
+        if not self.enabled or self._handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._expected = loop.time() + self.interval
+        self._handle = loop.call_at(self._expected, self._probe)
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._stop.set()
+
+    def _probe(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.record_lag(max(0.0, now - self._expected))
+        self._last_beat = time.perf_counter()
+        self._beat_sampled = False
+        self._expected = now + self.interval
+        self._handle = loop.call_at(self._expected, self._probe)
+
+    def record_lag(self, lag: float):
+        lag_ms = lag * 1000
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.lag_buckets[i] += 1
+                break
+        else:
+            self.lag_buckets[-1] += 1
+        self.lag_count += 1
+        self.lag_total += lag
+        if lag > self.lag_max:
+            self.lag_max = lag
+
+    # ---------- watchdog thread ----------
+
+    def _watch(self):
+        """Chạy ngoài event loop: chụp stack thread loop khi probe trễ quá threshold"""
+        check_every = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(check_every):
+            blocked = time.perf_counter() - self._last_beat - self.interval
+            if blocked < self.threshold or self._beat_sampled:
+                continue
+            self._beat_sampled = True  # Một sample cho mỗi lần bị chặn
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_list(traceback.extract_stack(frame)[-MAX_STACK_FRAMES:])
+            self.stall_samples += 1
+            self.slow_events.append({
+                "kind": "loop_blocked",
+                "at": time.time(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "stack": [line.rstrip() for line in stack],
+            })
+            logger.warning("Event loop bị chặn %.0f ms tại %s", blocked * 1000,
+                           stack[-1].strip().splitlines()[0] if stack else "?")
+
+    # ---------- đo từng bước ----------
+
+    def step(self, name: str) -> _Step:
+        """with monitor.step("db.save_message"): ..."""
+        return _Step(self, name)
+
+    def record_step(self, name: str, duration: float):
+        stats = self.steps.get(name)
+        if stats is None:
+            stats = self.steps[name] = StepStats()
+        stats.count += 1
+        stats.total += duration
+        if duration > stats.max:
+            stats.max = duration
+        if duration >= self.threshold:
+            stats.slow += 1
+            self.slow_events.append({
+                "kind": "slow_step",
+                "at": time.time(),
+                "step": name,
+                "duration_ms": round(duration * 1000, 1),
+            })
+
+    def instrument(self, obj, prefix: str, method_names: Iterable[str]):
+        """Bọc các method sync của obj (vd. Database) để đo từng lần gọi"""
+        if not self.enabled:
+            return
+        for method_name in method_names:
+            method = getattr(obj, method_name)
+            setattr(obj, method_name, self._timed(f"{prefix}.{method_name}", method))
+
+    def _timed(self, name: str, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record_step(name, time.perf_counter() - start)
+        timed.__name__ = method.__name__
+        timed.__doc__ = method.__doc__
+        return timed
+
+    # ---------- snapshot ----------
+
+    def lag_histogram(self) -> Dict:
+        labels = [str(bound) for bound in LAG_BUCKETS_MS] + ["+Inf"]
+        return dict(zip(labels, self.lag_buckets))
+
+    def metric_lines(self) -> List[str]:
+        """Loop lag (giây) và số lần loop bị chặn cho /metrics"""
+        return histogram_lines(
+            "chat_event_loop_lag_seconds", "Độ trễ lập lịch của event loop",
+            [bound / 1000 for bound in LAG_BUCKETS_MS], self.lag_buckets, self.lag_total
+        ) + sample_lines(
+            "chat_event_loop_stalls_total", "counter", "Số lần loop bị chặn quá threshold",
+            {"": self.stall_samples}
+        )
+
+    def snapshot(self, include_events: bool = False) -> Dict:
+        result = {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "lag": {
+                "count": self.lag_count,
+                "avg_ms": self.lag_total / self.lag_count * 1000 if self.lag_count else 0.0,
+                "max_ms": self.lag_max * 1000,
+                "buckets_ms": self.lag_histogram(),
+            },
+            "stall_samples": self.stall_samples,
+            "steps": {
+                name: {
+                    "count": stats.count,
+                    "avg_ms": stats.total / stats.count * 1000 if stats.count else 0.0,
+                    "max_ms": stats.max * 1000,
+                    "slow": stats.slow,
+                }
+                for name, stats in self.steps.items()
+            },
+        }
+        if include_events:
+            result["slow_events"] = list(self.slow_events)
+        return result
@@ -0,0 +1,248 @@
+"""
+Cache read-through các message mới nhất của từng conversation (và kênh broadcast)
+Giới hạn bộ nhớ bằng LRU; được cập nhật từ write path nên không bị stale
+"""
+import os
+import sqlite3
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .database import Database
+
+# Khóa cache của kênh broadcast (message có receiver_username IS NULL)
+BROADCAST_KEY = ("*",)
+
+# Số message mới nhất giữ cho mỗi conversation
+DEFAULT_PER_CONVERSATION = 100
+# Giới hạn bộ nhớ ước lượng của toàn cache
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# Số row tối đa đọc mỗi lần khi bắt kịp ghi từ process khác
+CATCH_UP_BATCH = 1000
+# Khoảng thiếu lớn hơn chừng này batch thì bỏ toàn bộ cache thay vì đọc bù (không chặn loop lâu)
+CATCH_UP_MAX_BATCHES = 4
+
+# Overhead ước lượng của một dict message (ngoài độ dài chuỗi)
+_MESSAGE_OVERHEAD = 400
+
+
+def conversation_key(sender: str, receiver: Optional[str]) -> Tuple:
+    """Khóa cache: cặp username đã sắp xếp, hoặc BROADCAST_KEY"""
+    if receiver is None:
+        return BROADCAST_KEY
+    return tuple(sorted((sender, receiver)))
+
+
+def message_row_to_dict(row) -> dict:
+    """Chuyển row messages thành dict trả về cho client (kèm file_id/filename nếu là file)"""
+    msg_dict = dict(row)
+    # Extract file_id từ file_path nếu có
+    if msg_dict.get('file_path'):
+        file_path = msg_dict['file_path']
+        # Format: uploads/{file_id}_{filename}
+        path_obj = Path(file_path)
+        filename = os.path.basename(file_path)
+        if '_' in filename:
+            file_id = filename.split('_', 1)[0]
+            msg_dict['file_id'] = file_id
+            # Extract filename từ file_path
+            if len(filename.split('_', 1)) > 1:
+                original_filename = filename.split('_', 1)[1]
+                msg_dict['filename'] = original_filename
+            # Lấy file_size từ file nếu file tồn tại
+            if path_obj.exists():
+                msg_dict['file_size'] = path_obj.stat().st_size
+    return msg_dict
+
+
+def _estimate_size(message: dict) -> int:
+    return _MESSAGE_OVERHEAD + sum(len(v) for v in message.values() if isinstance(v, str))
+
+
+class _Entry:
+    """Các message mới nhất của một conversation (cũ -> mới)"""
+    __slots__ = ("messages", "complete", "last_id", "size")
+
+    def __init__(self, capacity: int):
+        self.messages = deque(maxlen=capacity)
+        self.complete = False  # True nếu đang giữ toàn bộ message của conversation
+        self.last_id = 0
+        self.size = 0
+
+
+class MessageCache:
+    """
+    LRU theo conversation, mỗi conversation giữ per_conversation message mới nhất
+    Ghi từ process khác (REST/WebSocket chạy riêng) được phát hiện qua PRAGMA data_version
+    và bắt kịp bằng một range read id > high_water
+    """
+
+    def __init__(self, db: Database, per_conversation: int = DEFAULT_PER_CONVERSATION,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db = db
+        self.per_conversation = per_conversation
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.catch_up_rows = 0
+        self.resets = 0
+
+        # Connection riêng: data_version chỉ đổi khi connection KHÁC commit
+        self._conn = sqlite3.connect(db.db_path)
+        self._conn.row_factory = sqlite3.Row
+        self._data_version = self._read_data_version()
+        row = self._conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        self._high_water = row[0] or 0
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def add(self, row: dict):
+        """Write path: thêm message vừa lưu vào conversation đang được cache"""
+        if row.get('id') != self._high_water + 1:
+            # Có message khác được ghi xen giữa (process khác): đọc bù theo thứ tự id
+            self._catch_up()
+            return
+        self._apply(row)
+
+    def _apply(self, row: dict):
+        self._high_water = row['id']
+        entry = self._entries.get(conversation_key(row['sender_username'], row.get('receiver_username')))
+        if entry is not None:
+            self._append(entry, message_row_to_dict(row))
+
+    def _append(self, entry: _Entry, message: dict):
+        if message['id'] <= entry.last_id:
+            return  # Đã có (write path và catch-up cùng thấy một message)
+        if len(entry.messages) == entry.messages.maxlen:
+            dropped = _estimate_size(entry.messages[0])
+            entry.size -= dropped
+            self._bytes -= dropped
+            entry.complete = False
+        size = _estimate_size(message)
+        entry.messages.append(message)
+        entry.last_id = message['id']
+        entry.size += size
+        self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def _sync(self):
+        """Bắt kịp nếu có connection khác commit kể từ lần kiểm tra trước"""
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._catch_up()
+
+    def _catch_up(self):
+        """
+        Áp dụng các message có id > high_water (range read trên khóa chính)
+        Process khác ghi quá nhiều (vượt CATCH_UP_MAX_BATCHES batch): xóa cache và bắt đầu lại từ MAX(id)
+        """
+        latest = self._conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+        if latest - self._high_water > CATCH_UP_BATCH * CATCH_UP_MAX_BATCHES:
+            self._entries.clear()
+            self._bytes = 0
+            self._high_water = latest
+            self.resets += 1
+            return
+        while True:
+            rows = self._conn.execute(
+                "SELECT * FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                (self._high_water, CATCH_UP_BATCH)
+            ).fetchall()
+            for row in rows:
+                self._apply(dict(row))
+            self.catch_up_rows += len(rows)
+            if len(rows) < CATCH_UP_BATCH:
+                return
+
+    def _load(self, key: Tuple) -> _Entry:
+        """Đọc per_conversation message mới nhất của conversation từ database"""
+        if key == BROADCAST_KEY:
+            rows = self._conn.execute(
+                "SELECT * FROM messages WHERE receiver_username IS NULL ORDER BY id DESC LIMIT ?",
+                (self.per_conversation,)
+            ).fetchall()
+        else:
+            a, b = key
+            rows = self._conn.execute(
+                """SELECT * FROM messages
+                   WHERE (sender_username = ? AND receiver_username = ?)
+                      OR (sender_username = ? AND receiver_username = ?)
+                   ORDER BY id DESC LIMIT ?""",
+                (a, b, b, a, self.per_conversation)
+            ).fetchall()
+        entry = _Entry(self.per_conversation)
+        for row in reversed(rows):
+            message = message_row_to_dict(row)
+            entry.messages.append(message)
+            entry.size += _estimate_size(message)
+        entry.last_id = entry.messages[-1]['id'] if entry.messages else 0
+        entry.complete = len(rows) < self.per_conversation
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._evict()
+        return entry
+
+    def get_page(self, username: str, receiver: Optional[str], limit: int, offset: int) -> Optional[List[dict]]:
+        """
+        Trang message (mới -> cũ) nếu nằm trong phần được cache
+        Returns: None nếu trang vượt quá phần cache (caller đọc database)
+        """
+        if offset < 0 or limit < 0 or offset + limit > self.per_conversation:
+            self.misses += 1
+            return None
+        self._sync()
+        key = conversation_key(username, receiver or None)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = self._load(key)
+        elif not entry.complete and offset + limit > len(entry.messages):
+            self.misses += 1
+            return None
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        end = len(entry.messages) - offset
+        if end <= 0:
+            return []
+        start = max(0, end - limit)
+        return [entry.messages[i] for i in range(end - 1, start - 1, -1)]
+
+    def latest(self, username: str, peer: str) -> Optional[dict]:
+        """Message mới nhất của conversation nếu đang được cache (không đọc database)"""
+        self._sync()
+        entry = self._entries.get(conversation_key(username, peer))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.messages[-1] if entry.messages else None
+
+    def snapshot(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self._entries),
+            "messages": sum(len(e.messages) for e in self._entries.values()),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "catch_up_rows": self.catch_up_rows,
+            "resets": self.resets,
+        }
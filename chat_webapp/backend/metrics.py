@@ -0,0 +1,313 @@
+"""
+Metrics (counter, gauge, histogram) xuất ra text exposition format của Prometheus qua GET /metrics
+Metric khai báo ở đầu module dùng nó, trên REGISTRY chung của process
+(REST và WebSocket server chạy hai process nên mỗi process có /metrics riêng)
+"""
+import functools
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+# Bucket mặc định cho latency (giây)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Bucket cho số người nhận một lần fan-out
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    """Cơ sở cho counter/gauge/histogram: children theo tuple giá trị label"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Child cho bộ giá trị label (nên giữ lại child ở hot path thay vì gọi lại)"""
+        child = self._children.get(values)  # Label thường đã là str: bỏ qua bước chuyển đổi
+        if child is not None:
+            return child
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: cần {len(self.labelnames)} label, nhận {len(key)}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key: tuple, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    """Gauge; set_function(fn) để đọc giá trị lúc export (vd. số session)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._children[()].dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def render(self) -> List[str]:
+        if self._function is not None:
+            self._children[()].set(self._function())
+        return super().render()
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Không cộng dồn; cộng dồn lúc export
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """with histogram.labels(...).time(): ..."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self) -> _Timer:
+        return self._children[()].time()
+
+    def _render_child(self, key: tuple, child: _HistogramChild) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập metric của process; render() ra text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing  # Module import lại / nhiều server trong một process
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]):
+        """collector() trả về các dòng exposition đã format (metric lấy từ stats có sẵn)"""
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Iterable[str]]):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def sample_lines(name: str, kind: str, documentation: str, samples: Dict[str, float],
+                 label: str = None) -> List[str]:
+    """Format metric từ dict (dùng trong collector): {label_value: value}, hoặc {"": value} nếu không có label"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for key, value in samples.items():
+        labels = _format_labels((label,), (key,)) if label else ""
+        lines.append(f"{name}{labels} {_format_value(float(value))}")
+    return lines
+
+
+def histogram_lines(name: str, documentation: str, bounds: Iterable[float], counts: List[int],
+                    total: float) -> List[str]:
+    """Format histogram từ số đếm không cộng dồn theo bucket (bucket cuối là +Inf)"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    cumulative = 0
+    for bound, count in zip(tuple(bounds) + (math.inf,), counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{_format_value(float(bound))}"}} {cumulative}')
+    lines.append(f"{name}_sum {_format_value(float(total))}")
+    lines.append(f"{name}_count {cumulative}")
+    return lines
+
+
+def observe_query(method):
+    """Decorator cho method Database: latency theo statement (tên method)"""
+    child = DB_QUERY_SECONDS.labels(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+    return wrapper
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """GET /metrics"""
+    return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+
+# ---------- Metric dùng chung cho cả hai server ----------
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "chat_db_query_duration_seconds", "Latency của từng statement Database (theo method)", ["statement"]
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "chat_http_request_duration_seconds", "Latency REST request theo route", ["method", "route"]
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    "chat_http_requests_total", "Số REST request theo route và status", ["method", "route", "status"]
+)
+MESSAGES_IN = REGISTRY.counter("chat_messages_in_total", "Message nhận từ client theo type", ["type"])
+MESSAGES_OUT = REGISTRY.counter("chat_messages_out_total", "Message gửi tới client theo type", ["type"])
+FANOUT_RECIPIENTS = REGISTRY.histogram(
+    "chat_fanout_recipients", "Số client nhận mỗi lần fan-out", ["kind"], buckets=FANOUT_BUCKETS
+)
+FANOUT_SECONDS = REGISTRY.histogram("chat_fanout_duration_seconds", "Thời gian mỗi lần fan-out", ["kind"])
+FILE_BYTES = REGISTRY.counter("chat_file_bytes_total", "Bytes file đã truyền", ["direction"])
+SESSIONS = REGISTRY.gauge("chat_sessions", "Số connection (WebSocket + TCP) đang mở")
+AUTHENTICATED_USERS = REGISTRY.gauge("chat_authenticated_users", "Số user đã xác thực đang online")
@@ -2,11 +2,16 @@
 Protocol định nghĩa format message giữa client và server
 """
 import json
+import logging
+import struct
 from enum import Enum
 from typing import Dict, Any, Optional
 
+logger = logging.getLogger(__name__)
+
 class MessageType(Enum):
     """Các loại message"""
+    AUTH = "AUTH"
     REGISTER = "REGISTER"
     LOGIN = "LOGIN"
     LOGOUT = "LOGOUT"
@@ -22,31 +27,392 @@ class MessageType(Enum):
     USER_ONLINE = "user_online"
     USER_OFFLINE = "user_offline"
     ONLINE_USERS = "online_users"
+    BATCH = "BATCH"
+    RESYNC = "RESYNC"
+    DELIVERY_ACK = "DELIVERY_ACK"
+    MARK_READ = "MARK_READ"
+    READ_RECEIPT = "READ_RECEIPT"
+    SYNC = "SYNC"
+
+
+# Các chuỗi lặp lại nhiều trong frame (key và giá trị "type").
+# Binary codec mã hóa chúng thành 3 bytes thay vì nguyên chuỗi.
+# CHỈ được thêm vào cuối danh sách - frontend/src/services/codec.js dùng cùng bảng này.
+INTERNED_STRINGS = (
+    "type", "data", "success", "message", "sender", "receiver",
+    "username", "users", "status", "action", "token", "email",
+    "transfer_id", "chunk_index", "received_size", "is_last",
+    "filename", "file_id", "file_size", "message_type", "size",
+    "online", "offline", "private", "broadcast", "file", "text",
+    "AUTH", "REGISTER", "LOGIN", "LOGOUT", "CHAT", "FILE_REQUEST",
+    "FILE_DATA", "FILE_ACK", "BROADCAST", "ERROR", "SUCCESS",
+    "USER_LIST", "PRIVATE_MESSAGE", "user_online", "user_offline",
+    "online_users", "BATCH", "messages", "seq", "id", "RESYNC",
+    "DELIVERY_ACK", "ids", "MARK_READ", "READ_RECEIPT", "peer",
+    "message_id", "last_read_id", "unread_count", "reader",
+    "SYNC", "stream", "last_seq",
+)
+
+# Ext type (MessagePack fixext 1) dùng cho chuỗi đã intern
+_EXT_INTERNED = 0x01
+
+
+class JsonCodec:
+    """Codec mặc định: JSON text (tương thích với client cũ)"""
+    name = "chatchit.json"
+    binary = False
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data) -> Any:
+        # Decode thẳng từ memoryview sang str, không tạo bản sao bytes trung gian
+        if isinstance(data, memoryview):
+            return json.loads(str(data, 'utf-8'))
+        return json.loads(data)
+
+
+class BinaryCodec:
+    """
+    Codec nhị phân gọn kiểu MessagePack
+    Tương thích định dạng MessagePack (nil, bool, int, float64, str, bin, array, map),
+    thêm ext type 0x01 cho các chuỗi trong INTERNED_STRINGS.
+    """
+    name = "chatchit.msgpack"
+    binary = True
+
+    def __init__(self, interned=INTERNED_STRINGS):
+        self.interned = tuple(interned)
+        self._intern_index = {s: i for i, s in enumerate(self.interned)}
+
+    def dumps(self, obj: Any) -> bytes:
+        out = bytearray()
+        self._pack(obj, out)
+        return bytes(out)
+
+    def loads(self, data) -> Any:
+        view = memoryview(data)
+        try:
+            obj, offset = self._unpack(view, 0)
+        except (IndexError, struct.error) as e:
+            # Payload bị cắt cụt: báo cùng loại lỗi với dữ liệu sai định dạng
+            raise ValueError(f"Message bị cắt cụt: {e}") from e
+        if offset != len(view):
+            raise ValueError(f"Dữ liệu thừa sau message: {len(view) - offset} bytes")
+        return obj
+
+    def _pack(self, obj: Any, out: bytearray):
+        if obj is None:
+            out.append(0xc0)
+        elif obj is True:
+            out.append(0xc3)
+        elif obj is False:
+            out.append(0xc2)
+        elif isinstance(obj, str):
+            index = self._intern_index.get(obj)
+            if index is not None:
+                out += bytes((0xd4, _EXT_INTERNED, index))
+                return
+            raw = obj.encode('utf-8')
+            n = len(raw)
+            if n < 32:
+                out.append(0xa0 | n)
+            elif n < 0x100:
+                out += bytes((0xd9, n))
+            elif n < 0x10000:
+                out += struct.pack('>BH', 0xda, n)
+            else:
+                out += struct.pack('>BI', 0xdb, n)
+            out += raw
+        elif isinstance(obj, int):
+            if 0 <= obj < 0x80:
+                out.append(obj)
+            elif -32 <= obj < 0:
+                out.append(obj & 0xff)
+            elif obj >= 0:
+                if obj < 0x100:
+                    out += bytes((0xcc, obj))
+                elif obj < 0x10000:
+                    out += struct.pack('>BH', 0xcd, obj)
+                elif obj < 0x100000000:
+                    out += struct.pack('>BI', 0xce, obj)
+                else:
+                    out += struct.pack('>BQ', 0xcf, obj)
+            else:
+                if obj >= -0x80:
+                    out += struct.pack('>Bb', 0xd0, obj)
+                elif obj >= -0x8000:
+                    out += struct.pack('>Bh', 0xd1, obj)
+                elif obj >= -0x80000000:
+                    out += struct.pack('>Bi', 0xd2, obj)
+                else:
+                    out += struct.pack('>Bq', 0xd3, obj)
+        elif isinstance(obj, float):
+            out += struct.pack('>Bd', 0xcb, obj)
+        elif isinstance(obj, dict):
+            n = len(obj)
+            if n < 16:
+                out.append(0x80 | n)
+            elif n < 0x10000:
+                out += struct.pack('>BH', 0xde, n)
+            else:
+                out += struct.pack('>BI', 0xdf, n)
+            for key, value in obj.items():
+                self._pack(key, out)
+                self._pack(value, out)
+        elif isinstance(obj, (list, tuple)):
+            n = len(obj)
+            if n < 16:
+                out.append(0x90 | n)
+            elif n < 0x10000:
+                out += struct.pack('>BH', 0xdc, n)
+            else:
+                out += struct.pack('>BI', 0xdd, n)
+            for item in obj:
+                self._pack(item, out)
+        elif isinstance(obj, (bytes, bytearray, memoryview)):
+            n = len(obj)
+            if n < 0x100:
+                out += bytes((0xc4, n))
+            elif n < 0x10000:
+                out += struct.pack('>BH', 0xc5, n)
+            else:
+                out += struct.pack('>BI', 0xc6, n)
+            out += obj
+        else:
+            raise TypeError(f"Không encode được kiểu {type(obj).__name__}")
+
+    def _unpack(self, view: memoryview, offset: int):
+        b = view[offset]
+        offset += 1
+        if b < 0x80:
+            return b, offset
+        if b >= 0xe0:
+            return b - 0x100, offset
+        if 0xa0 <= b <= 0xbf:
+            n = b & 0x1f
+            return str(view[offset:offset + n], 'utf-8'), offset + n
+        if 0x80 <= b <= 0x8f:
+            return self._unpack_map(view, offset, b & 0x0f)
+        if 0x90 <= b <= 0x9f:
+            return self._unpack_array(view, offset, b & 0x0f)
+        if b == 0xc0:
+            return None, offset
+        if b == 0xc2:
+            return False, offset
+        if b == 0xc3:
+            return True, offset
+        if b == 0xd4:
+            ext_type, index = view[offset], view[offset + 1]
+            if ext_type != _EXT_INTERNED:
+                raise ValueError(f"Ext type không hỗ trợ: {ext_type}")
+            return self.interned[index], offset + 2
+        if b == 0xcc:
+            return view[offset], offset + 1
+        if b == 0xcd:
+            return struct.unpack_from('>H', view, offset)[0], offset + 2
+        if b == 0xce:
+            return struct.unpack_from('>I', view, offset)[0], offset + 4
+        if b == 0xcf:
+            return struct.unpack_from('>Q', view, offset)[0], offset + 8
+        if b == 0xd0:
+            return struct.unpack_from('>b', view, offset)[0], offset + 1
+        if b == 0xd1:
+            return struct.unpack_from('>h', view, offset)[0], offset + 2
+        if b == 0xd2:
+            return struct.unpack_from('>i', view, offset)[0], offset + 4
+        if b == 0xd3:
+            return struct.unpack_from('>q', view, offset)[0], offset + 8
+        if b == 0xca:
+            return struct.unpack_from('>f', view, offset)[0], offset + 4
+        if b == 0xcb:
+            return struct.unpack_from('>d', view, offset)[0], offset + 8
+        if b in (0xd9, 0xda, 0xdb):
+            size = {0xd9: 1, 0xda: 2, 0xdb: 4}[b]
+            n = int.from_bytes(view[offset:offset + size], 'big')
+            offset += size
+            return str(view[offset:offset + n], 'utf-8'), offset + n
+        if b in (0xc4, 0xc5, 0xc6):
+            size = {0xc4: 1, 0xc5: 2, 0xc6: 4}[b]
+            n = int.from_bytes(view[offset:offset + size], 'big')
+            offset += size
+            return bytes(view[offset:offset + n]), offset + n
+        if b in (0xdc, 0xdd):
+            size = 2 if b == 0xdc else 4
+            n = int.from_bytes(view[offset:offset + size], 'big')
+            return self._unpack_array(view, offset + size, n)
+        if b in (0xde, 0xdf):
+            size = 2 if b == 0xde else 4
+            n = int.from_bytes(view[offset:offset + size], 'big')
+            return self._unpack_map(view, offset + size, n)
+        raise ValueError(f"Byte định dạng không hỗ trợ: 0x{b:02x}")
+
+    def _unpack_map(self, view: memoryview, offset: int, n: int):
+        result = {}
+        for _ in range(n):
+            key, offset = self._unpack(view, offset)
+            value, offset = self._unpack(view, offset)
+            result[key] = value
+        return result, offset
+
+    def _unpack_array(self, view: memoryview, offset: int, n: int):
+        result = []
+        for _ in range(n):
+            item, offset = self._unpack(view, offset)
+            result.append(item)
+        return result, offset
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+
+CODECS = {codec.name: codec for codec in (JSON_CODEC, BINARY_CODEC)}
+
+# Thứ tự ưu tiên khi negotiate Sec-WebSocket-Protocol
+SUBPROTOCOLS = (BINARY_CODEC.name, JSON_CODEC.name)
+
+# Subprotocol mang JWT khi upgrade: "chatchit.auth.<token>" (không bao giờ được server chọn,
+# client phải offer kèm một subprotocol codec)
+AUTH_SUBPROTOCOL_PREFIX = "chatchit.auth."
+# Close code khi token gửi lúc upgrade không hợp lệ (browser không đọc được HTTP 401),
+# close reason là thông báo lỗi; client không reconnect với token cũ
+CLOSE_AUTH_FAILED = 4001
+
+
+def get_codec(name: Optional[str]):
+    """Lấy codec theo tên subprotocol, mặc định JSON cho client cũ"""
+    return CODECS.get(name, JSON_CODEC)
+
+
+# Giới hạn mặc định cho một frame length-prefixed
+DEFAULT_MAX_FRAME_SIZE = 4 * 1024 * 1024
+FRAME_HEADER_SIZE = 4
+
+
+class FrameTooLargeError(ValueError):
+    """Frame khai báo length vượt quá max_frame_size"""
+
+
+class FrameDecodeError(ValueError):
+    """
+    Payload của một hoặc nhiều frame không decode được (frame lỗi đã bị bỏ qua)
+    messages: các message hợp lệ trong lần feed; errors: số frame lỗi
+    """
+
+
+class FrameDecoder:
+    """
+    Decoder tăng dần cho luồng bytes [length: 4 bytes][payload]
+    Nhận các chunk bất kỳ (frame có thể bị cắt qua nhiều lần đọc),
+    trả về các message hoàn chỉnh. Parse trên memoryview, không copy từng frame.
+    """
+    
+    # Chỉ dồn buffer khi phần đã xử lý đủ lớn để tránh memmove mỗi lần feed
+    COMPACT_THRESHOLD = 64 * 1024
+    
+    def __init__(self, codec=JSON_CODEC, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+                 with_sizes: bool = False):
+        self.codec = codec
+        self.max_frame_size = max_frame_size
+        self.with_sizes = with_sizes  # True: trả về (message, payload_size)
+        self._buffer = bytearray()
+        self._offset = 0  # Vị trí đầu frame chưa xử lý trong buffer
+    
+    @property
+    def buffered(self) -> int:
+        """Số bytes đang chờ đủ frame"""
+        return len(self._buffer) - self._offset
+    
+    def feed(self, chunk) -> list:
+        """
+        Đưa thêm bytes vào decoder
+        Returns: danh sách message hoàn chỉnh (có thể rỗng),
+                 hoặc (message, payload_size) nếu with_sizes=True
+        Raises: FrameTooLargeError (luồng không dùng tiếp được),
+                FrameDecodeError (frame lỗi bị bỏ qua, các frame phía sau vẫn được decode;
+                                  có thể feed tiếp)
+        """
+        buffer = self._buffer
+        buffer += chunk
+        messages = []
+        error = None
+        decode_errors = 0
+        end = len(buffer)
+        offset = self._offset
+        
+        view = memoryview(buffer)
+        try:
+            while end - offset >= FRAME_HEADER_SIZE:
+                length = int.from_bytes(view[offset:offset + FRAME_HEADER_SIZE], 'big')
+                if length > self.max_frame_size:
+                    error = FrameTooLargeError(
+                        f"Frame {length} bytes vượt quá giới hạn {self.max_frame_size} bytes"
+                    )
+                    break
+                start = offset + FRAME_HEADER_SIZE
+                if end - start < length:
+                    break
+                offset = start + length
+                try:
+                    message = self.codec.loads(view[start:offset])
+                    messages.append((message, length) if self.with_sizes else message)
+                except Exception as e:
+                    # Chỉ bỏ frame lỗi: các frame hoàn chỉnh phía sau không bị kẹt trong buffer
+                    decode_errors += 1
+                    if error is None:
+                        error = FrameDecodeError(f"Lỗi decode frame: {e}")
+        finally:
+            view.release()
+        
+        # Dồn buffer (không còn memoryview nào trỏ vào buffer lúc này)
+        if offset == end:
+            buffer.clear()
+            offset = 0
+        elif offset >= self.COMPACT_THRESHOLD:
+            del buffer[:offset]
+            offset = 0
+        self._offset = offset
+        
+        if error is not None:
+            # Message hợp lệ trong lần feed vẫn được giữ lại cho caller
+            error.messages = messages
+            error.errors = decode_errors
+            raise error
+        return messages
+    
+    def reset(self):
+        """Xóa dữ liệu đang chờ (dùng sau FrameTooLargeError)"""
+        self._buffer.clear()
+        self._offset = 0
+
 
 class Message:
     """Class để encode/decode messages"""
     
     @staticmethod
-    def encode(message_type: MessageType, data: Dict[str, Any]) -> bytes:
-        """
-        Encode message thành bytes để gửi qua socket
-        Format: [length: 4 bytes][json_data]
-        """
-        message = {
+    def build(message_type: MessageType, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Tạo message dạng dict {"type", "data"} (chưa encode)"""
+        return {
             "type": message_type.value,
             "data": data
         }
-        json_str = json.dumps(message, ensure_ascii=False)
-        json_bytes = json_str.encode('utf-8')
+    
+    @staticmethod
+    def encode(message_type: MessageType, data: Dict[str, Any], codec=JSON_CODEC) -> bytes:
+        """
+        Encode message thành bytes để gửi qua socket
+        Format: [length: 4 bytes][payload] (payload mặc định là JSON)
+        """
+        payload = codec.dumps(Message.build(message_type, data))
         
         # Thêm length prefix (4 bytes, big-endian)
-        length = len(json_bytes)
+        length = len(payload)
         length_bytes = length.to_bytes(4, byteorder='big')
         
-        return length_bytes + json_bytes
+        return length_bytes + payload
     
     @staticmethod
-    def decode(data: bytes) -> Optional[Dict[str, Any]]:
+    def decode(data: bytes, codec=JSON_CODEC) -> Optional[Dict[str, Any]]:
         """
         Decode message từ bytes
         Returns: {"type": MessageType, "data": {...}} hoặc None nếu lỗi
@@ -61,20 +427,18 @@ class Message:
             if len(data) < 4 + length:
                 return None
             
-            # Đọc JSON data
-            json_bytes = data[4:4+length]
-            json_str = json_bytes.decode('utf-8')
-            message = json.loads(json_str)
+            # Đọc payload trên memoryview (không copy slice)
+            message = codec.loads(memoryview(data)[4:4+length])
             
             return message
         except Exception as e:
-            print(f"Lỗi decode message: {e}")
+            logger.warning("Lỗi decode message: %s", e)
             return None
     
     @staticmethod
-    def create_response(message_type: MessageType, success: bool, 
-                       message: str, data: Dict[str, Any] = None) -> bytes:
-        """Tạo response message"""
+    def response(message_type: MessageType, success: bool,
+                 message: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Tạo response message dạng dict (handlers trả về dạng này)"""
         response_data = {
             "success": success,
             "message": message
@@ -82,5 +446,11 @@ class Message:
         if data:
             response_data.update(data)
         
-        return Message.encode(message_type, response_data)
-
+        return Message.build(message_type, response_data)
+    
+    @staticmethod
+    def create_response(message_type: MessageType, success: bool, 
+                       message: str, data: Dict[str, Any] = None) -> bytes:
+        """Tạo response message đã encode (cho transport length-prefixed)"""
+        response = Message.response(message_type, success, message, data)
+        return Message.encode(message_type, response["data"])
@@ -0,0 +1,182 @@
+"""
+Token bucket và rate limit theo user / theo connection
+Dùng chung cho WebSocket server (router), REST API (middleware) và admission control
+Mỗi process giữ bucket của riêng mình (REST và WebSocket chạy hai process)
+"""
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+
+# Các lớp rate limit: message chat, bytes file, request điều khiển khác
+RATE_CLASS_MESSAGE = "message"
+RATE_CLASS_FILE_BYTES = "file_bytes"
+RATE_CLASS_CONTROL = "control"
+RATE_CLASSES = (RATE_CLASS_MESSAGE, RATE_CLASS_FILE_BYTES, RATE_CLASS_CONTROL)
+
+# Phạm vi bucket
+SCOPE_USER = "user"
+SCOPE_CONNECTION = "connection"
+
+DEFAULT_MAX_BUCKETS = 100000
+
+
+class TokenBucket:
+    """Bucket đầy tối đa burst token, nạp lại rate token mỗi giây"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """Lấy amount token nếu đủ, không chờ"""
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Số giây tới khi đủ amount token"""
+        self._refill(time.monotonic())
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float('inf')
+
+
+class RateLimit:
+    """rate đơn vị/giây (message, bytes hoặc request), burst = dung lượng bucket"""
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+
+
+# Giới hạn mặc định cho mỗi connection; user (nhiều tab/connection) được gấp đôi
+DEFAULT_CONNECTION_LIMITS = {
+    RATE_CLASS_MESSAGE: RateLimit(10, 30),
+    RATE_CLASS_FILE_BYTES: RateLimit(2 * 1024 * 1024, 8 * 1024 * 1024),
+    RATE_CLASS_CONTROL: RateLimit(20, 60),
+}
+DEFAULT_USER_LIMITS = {
+    RATE_CLASS_MESSAGE: RateLimit(20, 60),
+    RATE_CLASS_FILE_BYTES: RateLimit(4 * 1024 * 1024, 16 * 1024 * 1024),
+    RATE_CLASS_CONTROL: RateLimit(40, 120),
+}
+
+
+class RateLimitStats:
+    """Số request được cho qua / bị chặn theo lớp và phạm vi"""
+
+    def __init__(self):
+        self.allowed: Dict[str, int] = {rate_class: 0 for rate_class in RATE_CLASSES}
+        self.throttled: Dict[str, int] = {}  # {"<class>:<scope>": số lần}
+
+    def snapshot(self) -> Dict:
+        return {"allowed": dict(self.allowed), "throttled": dict(self.throttled)}
+
+
+class RateLimiter:
+    """
+    Token bucket theo (phạm vi, key, lớp): key là username hoặc id connection
+    Request chỉ được trừ token khi mọi bucket liên quan đều đủ
+    Số bucket giới hạn theo LRU (bucket ít dùng gần như luôn đầy nên bỏ đi không đổi hành vi)
+    """
+
+    def __init__(self, per_connection: Dict[str, RateLimit] = None, per_user: Dict[str, RateLimit] = None,
+                 enabled: bool = True, max_buckets: int = DEFAULT_MAX_BUCKETS):
+        self.per_connection = DEFAULT_CONNECTION_LIMITS if per_connection is None else per_connection
+        self.per_user = DEFAULT_USER_LIMITS if per_user is None else per_user
+        self.enabled = enabled
+        self.max_buckets = max_buckets
+        self.buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+        self.stats = RateLimitStats()
+
+    def _bucket(self, scope: str, key: str, rate_class: str, limit: RateLimit) -> TokenBucket:
+        bucket_key = (scope, key, rate_class)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = TokenBucket(limit.rate, limit.burst)
+            self.buckets[bucket_key] = bucket
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(bucket_key)
+        return bucket
+
+    def check(self, rate_class: str, cost: float = 1.0, username: Optional[str] = None,
+              connection: Optional[str] = None) -> Optional[float]:
+        """
+        Trừ cost token của lớp rate_class
+        Returns: None nếu được phép, ngược lại số giây nên chờ trước khi thử lại
+        """
+        if not self.enabled:
+            return None
+        buckets = []
+        for scope, key, limits in ((SCOPE_CONNECTION, connection, self.per_connection),
+                                   (SCOPE_USER, username, self.per_user)):
+            limit = limits.get(rate_class)
+            if key is None or limit is None:
+                continue
+            bucket = self._bucket(scope, key, rate_class, limit)
+            # Request lớn hơn burst (vd. chunk file) chỉ cần bucket đầy
+            amount = min(cost, bucket.burst)
+            wait = bucket.wait_time(amount)
+            if wait > 0:
+                name = f"{rate_class}:{scope}"
+                self.stats.throttled[name] = self.stats.throttled.get(name, 0) + 1
+                return wait
+            buckets.append((bucket, amount))
+
+        for bucket, amount in buckets:
+            bucket.tokens -= amount  # wait_time() vừa nạp lại token
+        allowed = self.stats.allowed
+        allowed[rate_class] = allowed.get(rate_class, 0) + 1
+        return None
+
+    def forget_connection(self, connection: str):
+        """Bỏ bucket của connection đã đóng"""
+        for rate_class in self.per_connection:
+            self.buckets.pop((SCOPE_CONNECTION, connection, rate_class), None)
+
+    def snapshot(self) -> Dict:
+        return {"enabled": self.enabled, "buckets": len(self.buckets), **self.stats.snapshot()}
+
+
+def rate_limit_middleware(limiter: RateLimiter, classify: Callable[[web.Request], Optional[str]],
+                          user_key: str = "username"):
+    """
+    Middleware REST: classify(request) trả về lớp rate limit (None = không giới hạn)
+    Bucket theo user (request[user_key] do auth_middleware gán); request chưa đăng nhập
+    dùng bucket theo địa chỉ client (nhiều user sau cùng proxy không dùng chung bucket)
+    Vượt giới hạn: 429 + Retry-After
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        rate_class = classify(request)
+        if rate_class is not None:
+            cost = 1.0
+            if rate_class == RATE_CLASS_FILE_BYTES:
+                cost = float(request.content_length or 0)
+            username = request.get(user_key)
+            wait = limiter.check(rate_class, cost, username, None if username else request.remote)
+            if wait is not None:
+                return web.json_response(
+                    {'success': False, 'message': 'Gửi quá nhanh, vui lòng thử lại sau',
+                     'retry_after_ms': int(wait * 1000)},
+                    status=429,
+                    headers={'Retry-After': str(max(1, int(wait + 0.999)))}
+                )
+        return await handler(request)
+    return middleware
@@ -4,64 +4,112 @@ Hỗ trợ các endpoints: đăng ký, đăng nhập, chat, file, tìm kiếm
 """
 import asyncio
 import json
+import logging
 import ssl
-import traceback
+import time
 from pathlib import Path
 from aiohttp import web
 from aiohttp.web_middlewares import normalize_path_middleware
-import jwt
-from datetime import datetime, timedelta
+from datetime import datetime
 
+from .auth import TokenVerifier, auth_middleware, generate_token, REQUEST_USER_KEY
 from .database import Database
-from .protocol import Message
 from .auth_handler import AuthHandler
 from .chat_handler import ChatHandler
 from .file_handler import FileHandler
+from .message_cache import MessageCache, message_row_to_dict
+from .loop_monitor import LoopMonitor, DB_TIMED_METHODS
+from .metrics import REGISTRY, HTTP_REQUEST_SECONDS, HTTP_REQUESTS, metrics_handler, sample_lines
+from .file_handler import FILE_BYTES_RECEIVED, FILE_BYTES_SENT
+from .rate_limit import RateLimiter, rate_limit_middleware, RATE_CLASS_MESSAGE, RATE_CLASS_FILE_BYTES, RATE_CLASS_CONTROL
+from . import log
+from .admin import AdminInterface, AdminSettings
+from .capture import CaptureSettings, CaptureWriter
 
-# JWT Secret (trong production nên dùng environment variable)
-JWT_SECRET = "your-secret-key-change-in-production"
-JWT_ALGORITHM = "HS256"
-JWT_EXPIRATION_HOURS = 24
+logger = logging.getLogger(__name__)
+# Access log tách riêng để chỉnh level độc lập (vd. --log-module backend.rest_api.access=warning)
+access_logger = logging.getLogger(__name__ + ".access")
+
+# Lớp rate limit theo route (method, path); route khác dùng RATE_CLASS_CONTROL
+REST_RATE_CLASSES = {
+    ('POST', '/api/chat/send'): RATE_CLASS_MESSAGE,
+    ('POST', '/api/files/upload'): RATE_CLASS_FILE_BYTES,
+}
 
 class RESTAPIServer:
     """RESTful API Server"""
     
     def __init__(self, host: str = '0.0.0.0', port: int = 8000,
-                 ssl_cert: str = None, ssl_key: str = None):
+                 ssl_cert: str = None, ssl_key: str = None, rate_limiter: RateLimiter = None,
+                 loop_monitor: LoopMonitor = None, admin: AdminSettings = None,
+                 capture: CaptureSettings = None):
         self.host = host
         self.port = port
         self.ssl_cert = ssl_cert
         self.ssl_key = ssl_key
         
+        # Loop lag, request/DB call chậm và stack khi loop bị chặn
+        self.loop_monitor = loop_monitor or LoopMonitor()
+        
         # Initialize components
         self.db = Database()
+        self.loop_monitor.instrument(self.db, "db", DB_TIMED_METHODS)
+        self.message_cache = MessageCache(self.db)
         self.auth_handler = AuthHandler(self.db)
-        self.chat_handler = ChatHandler(self.db, self.auth_handler)
+        self.chat_handler = ChatHandler(self.db, self.auth_handler, self.message_cache)
         self.file_handler = FileHandler(self.db, self.auth_handler)
+        self.token_verifier = TokenVerifier()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Profile, heap snapshot và state qua /admin/... (localhost hoặc admin token)
+        self.admin = AdminInterface(admin, self.admin_state)
+        # Ghi request ra file capture để replay (tắt khi không có path)
+        self.capture = CaptureWriter(capture)
         
         # Create aiohttp app
         # CORS middleware phải chạy đầu tiên để xử lý OPTIONS requests
         self.app = web.Application(middlewares=[
             self.cors_middleware,  # CORS middleware phải đứng đầu
+            self.admin.middleware(),
+            auth_middleware(self.token_verifier),  # Verify JWT một lần cho mỗi request
+            self.capture.middleware(),  # Sau auth để ghi username, trước rate limit để ghi cả request bị chặn
+            rate_limit_middleware(self.rate_limiter, self.rate_class),  # Sau auth để bucket theo user
             normalize_path_middleware(),
             self.logging_middleware,
             self.error_middleware
         ])
         
+        self.app.on_startup.append(self.on_startup)
+        self.app.on_cleanup.append(self.on_cleanup)
+        
         # Routes
         self.setup_routes()
     
+    async def on_startup(self, app: web.Application):
+        self.loop_monitor.start()
+        REGISTRY.add_collector(self.metric_lines)
+    
+    async def on_cleanup(self, app: web.Application):
+        self.loop_monitor.stop()
+        self.capture.close()
+        REGISTRY.remove_collector(self.metric_lines)
+    
+    def metric_lines(self):
+        """Metric lấy từ các bộ đếm có sẵn (collector của REGISTRY)"""
+        throttled = {name.replace(":", "_"): count for name, count in self.rate_limiter.stats.throttled.items()}
+        return self.loop_monitor.metric_lines() + sample_lines(
+            "chat_rate_limited_total", "counter", "Request bị rate limit theo lớp và phạm vi",
+            throttled, label="limit"
+        )
+    
     @web.middleware
     async def cors_middleware(self, request: web.Request, handler):
         """CORS middleware để xử lý preflight requests"""
         # Lấy origin từ request header
         origin = request.headers.get('Origin', '*')
         
-        print(f"[CORS] {request.method} {request.path_qs} - Origin: {origin}")
-        
         # Xử lý OPTIONS preflight request
         if request.method == 'OPTIONS':
-            print(f"[CORS] Handling OPTIONS preflight for {request.path_qs}")
+            logger.debug("CORS preflight", extra={"path": request.path, "origin": origin})
             response = web.Response(
                 status=200,
                 headers={
@@ -71,40 +119,51 @@ class RESTAPIServer:
                     'Access-Control-Max-Age': '3600',
                 }
             )
-            print(f"[CORS] OPTIONS response headers: {dict(response.headers)}")
             return response
         
-        # Xử lý các request khác
-        try:
-            response = await handler(request)
-        except Exception as e:
-            # Nếu có lỗi, vẫn cần thêm CORS headers
-            print(f"[CORS] Error in handler: {e}")
-            raise
+        # Xử lý các request khác (lỗi được log ở logging_middleware)
+        response = await handler(request)
         
         # Thêm CORS headers vào response
         cors_origin = origin if origin != '*' else '*'
         response.headers['Access-Control-Allow-Origin'] = cors_origin
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With'
-        
-        print(f"[CORS] Added headers to {request.method} {request.path_qs}: Origin={cors_origin}")
-        
         return response
     
+    @staticmethod
+    def rate_class(request: web.Request):
+        """Lớp rate limit của request (None = không giới hạn: preflight, health check)"""
+        if (request.method == 'OPTIONS' or request.path in ('/api/health', '/metrics')
+                or request.path.startswith(('/stats', '/admin'))):
+            return None
+        return REST_RATE_CLASSES.get((request.method, request.path.rstrip('/')), RATE_CLASS_CONTROL)
+    
     @web.middleware
     async def logging_middleware(self, request: web.Request, handler):
         """Middleware để log requests"""
-        start_time = datetime.utcnow()
+        start = time.perf_counter()
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource else 'unmatched'  # Label theo route, không theo path thật
+        step = f"http.{request.method} {route}"
+        status = 500
         try:
-            response = await handler(request)
-            duration = (datetime.utcnow() - start_time).total_seconds()
-            print(f"[{start_time.strftime('%Y-%m-%d %H:%M:%S')}] {request.method} {request.path_qs} - {response.status} ({duration:.3f}s)")
+            with self.loop_monitor.step(step), HTTP_REQUEST_SECONDS.labels(request.method, route).time():
+                response = await handler(request)
+            status = response.status
             return response
         except Exception as e:
-            duration = (datetime.utcnow() - start_time).total_seconds()
-            print(f"[{start_time.strftime('%Y-%m-%d %H:%M:%S')}] {request.method} {request.path_qs} - ERROR ({duration:.3f}s): {str(e)}")
+            if isinstance(e, web.HTTPException):
+                status = e.status
+            else:
+                access_logger.warning("%s %s lỗi: %s", request.method, request.path, e)
             raise
+        finally:
+            HTTP_REQUESTS.labels(request.method, route, status).inc()
+            if access_logger.isEnabledFor(logging.INFO):
+                access_logger.info("%s %s %s", request.method, request.path, status, extra={
+                    "route": route, "status": status, "duration_ms": log.elapsed_ms(start)
+                })
     
     @web.middleware
     async def error_middleware(self, request: web.Request, handler):
@@ -115,8 +174,7 @@ class RESTAPIServer:
         except web.HTTPException:
             raise
         except Exception as e:
-            print(f"Unhandled error in {request.method} {request.path_qs}:")
-            traceback.print_exc()
+            logger.exception("Unhandled error", extra={"method": request.method, "path": request.path})
             return web.json_response(
                 {'success': False, 'message': f'Lỗi server: {str(e)}'},
                 status=500
@@ -134,6 +192,11 @@ class RESTAPIServer:
         self.app.router.add_get('/api/chat/messages', self.get_messages)
         self.app.router.add_post('/api/chat/send', self.send_message)
         self.app.router.add_get('/api/chat/conversations', self.get_conversations)
+        self.app.router.add_post('/api/chat/read', self.mark_read)
+        self.app.router.add_get('/stats', self.stats_handler)
+        self.app.router.add_get('/stats/loop', self.loop_stats_handler)
+        self.app.router.add_get('/metrics', metrics_handler)
+        self.admin.setup(self.app)
         
         # User routes
         self.app.router.add_get('/api/users/search', self.search_users)
@@ -150,37 +213,9 @@ class RESTAPIServer:
         # Root endpoint
         self.app.router.add_get('/', self.root)
     
-    def generate_token(self, username: str) -> str:
-        """Tạo JWT token"""
-        payload = {
-            'username': username,
-            'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS),
-            'iat': datetime.utcnow()
-        }
-        return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
-    
-    def verify_token(self, token: str) -> dict:
-        """Verify JWT token"""
-        try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            return payload
-        except jwt.ExpiredSignatureError:
-            return None
-        except jwt.InvalidTokenError:
-            return None
-    
     async def get_current_user_from_request(self, request: web.Request) -> str:
-        """Lấy username từ JWT token trong request"""
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            return None
-        
-        token = auth_header[7:]  # Remove 'Bearer '
-        payload = self.verify_token(token)
-        if not payload:
-            return None
-        
-        return payload.get('username')
+        """Lấy username đã được auth_middleware xác thực cho request này"""
+        return request.get(REQUEST_USER_KEY)
     
     # Auth endpoints
     async def register(self, request: web.Request):
@@ -191,8 +226,6 @@ class RESTAPIServer:
             email = data.get('email', '').strip()
             password = data.get('password', '')
             
-            print(f"[REGISTER] Attempt: username={username}, email={email}")
-            
             if not username or not email or not password:
                 return web.json_response(
                     {'success': False, 'message': 'Username, email và password không được để trống'},
@@ -201,21 +234,17 @@ class RESTAPIServer:
             
             # Sử dụng auth_handler
             client_id = f"rest_{username}_{datetime.utcnow().timestamp()}"
-            response_bytes = await self.auth_handler.handle_register(client_id, {
+            response = await self.auth_handler.handle_register(client_id, {
                 'username': username,
                 'email': email,
                 'password': password
             })
-            
-            response = Message.decode(response_bytes)
-            print(f"[REGISTER] Response: {response}")
-            
             if response and response.get('data', {}).get('success'):
                 # Lấy username từ response
                 registered_username = response.get('data', {}).get('username', username)
                 # Tạo token
-                token = self.generate_token(registered_username)
-                print(f"[REGISTER] Success: username={registered_username}, email={email}")
+                token = generate_token(registered_username)
+                logger.info("Đăng ký thành công", extra={"username": registered_username})
                 return web.json_response({
                     'success': True,
                     'message': 'Đăng ký thành công',
@@ -224,20 +253,19 @@ class RESTAPIServer:
                 })
             else:
                 message = response.get('data', {}).get('message', 'Đăng ký thất bại') if response else 'Đăng ký thất bại'
-                print(f"[REGISTER] Failed: {message}")
+                logger.info("Đăng ký thất bại: %s", message, extra={"username": username})
                 return web.json_response(
                     {'success': False, 'message': message},
                     status=400
                 )
         except json.JSONDecodeError as e:
-            print(f"[REGISTER] JSON decode error: {e}")
+            logger.debug("Register: JSON không hợp lệ: %s", e)
             return web.json_response(
                 {'success': False, 'message': 'Invalid JSON format'},
                 status=400
             )
         except Exception as e:
-            print(f"[REGISTER] Exception: {e}")
-            traceback.print_exc()
+            logger.exception("Lỗi đăng ký")
             return web.json_response(
                 {'success': False, 'message': f'Lỗi server: {str(e)}'},
                 status=500
@@ -250,8 +278,6 @@ class RESTAPIServer:
             email = data.get('email', '').strip()
             password = data.get('password', '')
             
-            print(f"[LOGIN] Attempt: email={email}")
-            
             if not email or not password:
                 return web.json_response(
                     {'success': False, 'message': 'Email và password không được để trống'},
@@ -259,21 +285,16 @@ class RESTAPIServer:
                 )
             
             client_id = f"rest_{email}_{datetime.utcnow().timestamp()}"
-            response_bytes = await self.auth_handler.handle_login(client_id, {
+            response = await self.auth_handler.handle_login(client_id, {
                 'email': email,
                 'password': password
             })
-            
-            from .protocol import Message
-            response = Message.decode(response_bytes)
-            print(f"[LOGIN] Response: {response}")
-            
             if response and response.get('data', {}).get('success'):
                 # Lấy username từ response
                 username = response.get('data', {}).get('username', '')
                 # Tạo token
-                token = self.generate_token(username)
-                print(f"[LOGIN] Success: email={email}, username={username}")
+                token = generate_token(username)
+                logger.info("Đăng nhập thành công", extra={"username": username})
                 return web.json_response({
                     'success': True,
                     'message': 'Đăng nhập thành công',
@@ -282,20 +303,19 @@ class RESTAPIServer:
                 })
             else:
                 message = response.get('data', {}).get('message', 'Đăng nhập thất bại') if response else 'Đăng nhập thất bại'
-                print(f"[LOGIN] Failed: {message}")
+                logger.info("Đăng nhập thất bại: %s", message)
                 return web.json_response(
                     {'success': False, 'message': message},
                     status=401
                 )
         except json.JSONDecodeError as e:
-            print(f"[LOGIN] JSON decode error: {e}")
+            logger.debug("Login: JSON không hợp lệ: %s", e)
             return web.json_response(
                 {'success': False, 'message': 'Invalid JSON format'},
                 status=400
             )
         except Exception as e:
-            print(f"[LOGIN] Exception: {e}")
-            traceback.print_exc()
+            logger.exception("Lỗi đăng nhập")
             return web.json_response(
                 {'success': False, 'message': f'Lỗi server: {str(e)}'},
                 status=500
@@ -325,12 +345,8 @@ class RESTAPIServer:
                 status=401
             )
         
-        # Lấy thông tin user từ database
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT username, email, created_at FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        conn.close()
+        # Lấy thông tin user (qua cache UserDirectory)
+        user = self.db.get_user_profile(username)
         
         if user:
             return web.json_response({
@@ -348,19 +364,8 @@ class RESTAPIServer:
             )
     
     # Chat endpoints
-    async def get_messages(self, request: web.Request):
-        """GET /api/chat/messages?receiver=username&limit=50&offset=0"""
-        username = await self.get_current_user_from_request(request)
-        if not username:
-            return web.json_response(
-                {'success': False, 'message': 'Unauthorized'},
-                status=401
-            )
-        
-        receiver = request.query.get('receiver', '')
-        limit = int(request.query.get('limit', 50))
-        offset = int(request.query.get('offset', 0))
-        
+    def _query_messages(self, username: str, receiver: str, limit: int, offset: int) -> list:
+        """Đọc một trang message từ database (mới -> cũ)"""
         conn = self.db.get_connection()
         cursor = conn.cursor()
         
@@ -370,7 +375,7 @@ class RESTAPIServer:
                 SELECT * FROM messages 
                 WHERE (sender_username = ? AND receiver_username = ?) 
                    OR (sender_username = ? AND receiver_username = ?)
-                ORDER BY timestamp DESC
+                ORDER BY id DESC
                 LIMIT ? OFFSET ?
             """, (username, receiver, receiver, username, limit, offset))
         else:
@@ -378,34 +383,31 @@ class RESTAPIServer:
             cursor.execute("""
                 SELECT * FROM messages 
                 WHERE receiver_username IS NULL
-                ORDER BY timestamp DESC
+                ORDER BY id DESC
                 LIMIT ? OFFSET ?
             """, (limit, offset))
         
-        messages = []
-        for row in cursor.fetchall():
-            msg_dict = dict(row)
-            # Extract file_id từ file_path nếu có
-            if msg_dict.get('file_path'):
-                file_path = msg_dict['file_path']
-                # Format: uploads/{file_id}_{filename}
-                import os
-                from pathlib import Path
-                path_obj = Path(file_path)
-                filename = os.path.basename(file_path)
-                if '_' in filename:
-                    file_id = filename.split('_', 1)[0]
-                    msg_dict['file_id'] = file_id
-                    # Extract filename từ file_path
-                    if len(filename.split('_', 1)) > 1:
-                        original_filename = filename.split('_', 1)[1]
-                        msg_dict['filename'] = original_filename
-                    # Lấy file_size từ file nếu file tồn tại
-                    if path_obj.exists():
-                        msg_dict['file_size'] = path_obj.stat().st_size
-            messages.append(msg_dict)
-        
+        messages = [message_row_to_dict(row) for row in cursor.fetchall()]
         conn.close()
+        return messages
+    
+    async def get_messages(self, request: web.Request):
+        """GET /api/chat/messages?receiver=username&limit=50&offset=0"""
+        username = await self.get_current_user_from_request(request)
+        if not username:
+            return web.json_response(
+                {'success': False, 'message': 'Unauthorized'},
+                status=401
+            )
+        
+        receiver = request.query.get('receiver', '')
+        limit = int(request.query.get('limit', 50))
+        offset = int(request.query.get('offset', 0))
+        
+        # Trang đầu của conversation nóng được phục vụ từ cache
+        messages = self.message_cache.get_page(username, receiver, limit, offset)
+        if messages is None:
+            messages = self._query_messages(username, receiver, limit, offset)
         
         return web.json_response({
             'success': True,
@@ -431,9 +433,14 @@ class RESTAPIServer:
                     {'success': False, 'message': 'Message không được để trống'},
                     status=400
                 )
+            if receiver and not self.db.user_exists(receiver):
+                return web.json_response(
+                    {'success': False, 'message': f'User {receiver} không tồn tại'},
+                    status=404
+                )
             
-            # Lưu message
-            self.db.save_message(username, receiver if receiver else None, message_text)
+            # Lưu message kèm event log (client nhận khi reconnect WebSocket)
+            self.chat_handler.save_message(username, receiver if receiver else None, message_text)
             
             return web.json_response({
                 'success': True,
@@ -471,24 +478,34 @@ class RESTAPIServer:
             ORDER BY last_message_time DESC
         """, (username, username, username))
         
+        # Unread count duy trì sẵn trong conversation_reads, không phải đếm lại
+        read_states = self.db.get_read_states(username)
+        
         conversations = []
         for row in cursor.fetchall():
             other_user = row['other_user']
             if other_user:
-                # Lấy message cuối cùng
-                cursor.execute("""
-                    SELECT * FROM messages
-                    WHERE (sender_username = ? AND receiver_username = ?)
-                       OR (sender_username = ? AND receiver_username = ?)
-                    ORDER BY timestamp DESC
-                    LIMIT 1
-                """, (username, other_user, other_user, username))
-                last_msg = cursor.fetchone()
+                # Lấy message cuối cùng (từ cache nếu conversation đang được cache)
+                last_msg = self.message_cache.latest(username, other_user)
+                if last_msg is None:
+                    cursor.execute("""
+                        SELECT * FROM messages
+                        WHERE (sender_username = ? AND receiver_username = ?)
+                           OR (sender_username = ? AND receiver_username = ?)
+                        ORDER BY id DESC
+                        LIMIT 1
+                    """, (username, other_user, other_user, username))
+                    row_msg = cursor.fetchone()
+                    # Cùng dạng với message trong cache (kèm file_id/filename nếu là file)
+                    last_msg = message_row_to_dict(row_msg) if row_msg else None
                 
+                read_state = read_states.get(other_user, {})
                 conversations.append({
                     'username': other_user,
-                    'last_message': dict(last_msg) if last_msg else None,
-                    'last_message_time': row['last_message_time']
+                    'last_message': last_msg,
+                    'last_message_time': row['last_message_time'],
+                    'unread_count': read_state.get('unread_count', 0),
+                    'last_read_id': read_state.get('last_read_id', 0)
                 })
         
         conn.close()
@@ -498,6 +515,66 @@ class RESTAPIServer:
             'conversations': conversations
         })
     
+    def admin_state(self) -> dict:
+        """State cho GET /admin/state"""
+        return {
+            "sessions": len(self.auth_handler.sessions),
+            "authenticated_users": len(self.auth_handler.sessions.by_user),
+            "message_cache": self.message_cache.snapshot(),
+            "rate_limit": self.rate_limiter.snapshot(),
+            "logging": log.snapshot(),
+        }
+    
+    async def stats_handler(self, request: web.Request):
+        """GET /stats - hit rate và bộ nhớ của các cache"""
+        return web.json_response({
+            "message_cache": self.message_cache.snapshot(),
+            "user_directory": self.db.users.snapshot(),
+            "auth": self.token_verifier.snapshot(),
+            "rate_limit": self.rate_limiter.snapshot(),
+            "loop": self.loop_monitor.snapshot(),
+            "logging": log.snapshot(),
+            "capture": self.capture.snapshot()
+        })
+    
+    async def loop_stats_handler(self, request: web.Request):
+        """GET /stats/loop - loop lag, request chậm và stack sample khi loop bị chặn"""
+        return web.json_response(self.loop_monitor.snapshot(include_events=True))
+    
+    async def mark_read(self, request: web.Request):
+        """POST /api/chat/read - đánh dấu đã đọc conversation tới message_id"""
+        username = await self.get_current_user_from_request(request)
+        if not username:
+            return web.json_response(
+                {'success': False, 'message': 'Unauthorized'},
+                status=401
+            )
+        
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                data = {}
+            
+            # Dùng chung kiểm tra và gửi read receipt với MARK_READ qua WebSocket
+            response = (await self.chat_handler.handle_mark_read(None, username, data))["data"]
+            if not response['success']:
+                return web.json_response(
+                    {'success': False, 'message': response['message']},
+                    status=400
+                )
+            
+            return web.json_response({
+                'success': True,
+                'peer': response['peer'],
+                'last_read_id': response['last_read_id'],
+                'unread_count': response['unread_count']
+            })
+        except Exception as e:
+            return web.json_response(
+                {'success': False, 'message': f'Lỗi server: {str(e)}'},
+                status=500
+            )
+    
     # User endpoints
     async def search_users(self, request: web.Request):
         """GET /api/users/search?q=email_or_username"""
@@ -560,16 +637,12 @@ class RESTAPIServer:
         
         target_username = request.match_info['username']
         
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT username, email, created_at FROM users WHERE username = ?", (target_username,))
-        user = cursor.fetchone()
-        conn.close()
+        user = self.db.get_user_profile(target_username)
         
         if user:
             return web.json_response({
                 'success': True,
-                'user': dict(user)
+                'user': user
             })
         else:
             return web.json_response(
@@ -614,6 +687,7 @@ class RESTAPIServer:
             
             # Lấy file size
             file_size = len(file_content)
+            FILE_BYTES_RECEIVED.inc(file_size)
             
             # KHÔNG lưu vào database ở đây - sẽ lưu khi WebSocket message được gửi
             # để tránh duplicate messages
@@ -645,8 +719,10 @@ class RESTAPIServer:
         # Tìm file trong uploads
         uploads_dir = Path('uploads')
         for file_path in uploads_dir.glob(f"{file_id}_*"):
+            body = file_path.read_bytes()
+            FILE_BYTES_SENT.inc(len(body))
             return web.Response(
-                body=file_path.read_bytes(),
+                body=body,
                 headers={
                     'Content-Type': 'application/octet-stream',
                     'Content-Disposition': f'attachment; filename="{file_path.name}"'
@@ -714,10 +790,8 @@ class RESTAPIServer:
         """Khởi động server"""
         ssl_context = self.get_ssl_context()
         
-        if ssl_context:
-            print(f"REST API Server đang khởi động với SSL tại {self.host}:{self.port}")
-        else:
-            print(f"REST API Server đang khởi động không SSL tại {self.host}:{self.port}")
+        logger.info("REST API Server đang khởi động %s SSL tại %s:%s",
+                    "với" if ssl_context else "không", self.host, self.port)
         
         runner = web.AppRunner(self.app)
         await runner.setup()
@@ -731,11 +805,11 @@ class RESTAPIServer:
         
         await site.start()
         protocol = 'https' if ssl_context else 'http'
-        print(f"REST API Server đã sẵn sàng tại {protocol}://{self.host}:{self.port}")
+        logger.info("REST API Server đã sẵn sàng tại %s://%s:%s", protocol, self.host, self.port)
         
         try:
             await asyncio.Event().wait()
         except KeyboardInterrupt:
-            print("\nĐang dừng REST API server...")
+            logger.info("Đang dừng REST API server...")
             await runner.cleanup()
 
@@ -0,0 +1,130 @@
+"""
+Router dispatch message theo bảng (thay cho chuỗi if/elif theo msg_type)
+Dùng chung cho WebSocket, raw TCP và các transport khác
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .metrics import MESSAGES_IN
+from .protocol import Message, MessageType
+from .rate_limit import (  # noqa: F401 (re-export cho các module khai báo route)
+    RateLimiter, RATE_CLASS_MESSAGE, RATE_CLASS_FILE_BYTES, RATE_CLASS_CONTROL
+)
+
+# Giới hạn kích thước mặc định của một message inbound
+DEFAULT_MAX_MESSAGE_SIZE = 64 * 1024
+
+
+class MessageValidationError(ValueError):
+    """Message inbound không đúng format {"type": str, "data": dict}"""
+
+
+class IncomingMessage:
+    """Message inbound đã validate, tạo một lần tại ingress"""
+    __slots__ = ("type", "data", "client_id", "username", "size")
+
+    def __init__(self, type: str, data: dict, client_id: str,
+                 username: Optional[str] = None, size: int = 0):
+        self.type = type
+        self.data = data
+        self.client_id = client_id
+        self.username = username
+        self.size = size
+
+    @classmethod
+    def parse(cls, raw: Any, client_id: str, size: int = 0) -> "IncomingMessage":
+        """Validate message thô từ client"""
+        if not isinstance(raw, dict):
+            raise MessageValidationError("Message phải là object")
+        msg_type = raw.get('type')
+        if not isinstance(msg_type, str):
+            raise MessageValidationError("Thiếu trường type")
+        data = raw.get('data')
+        if data is None:
+            data = {}
+        elif not isinstance(data, dict):
+            raise MessageValidationError("Trường data phải là object")
+        return cls(msg_type, data, client_id, size=size)
+
+
+class Route:
+    """Khai báo một route: handler và các yêu cầu đi kèm"""
+    __slots__ = ("message_type", "handler", "require_auth", "rate_class", "max_size", "messages_in")
+
+    def __init__(self, message_type: MessageType, handler: Callable[..., Awaitable[Optional[dict]]],
+                 require_auth: bool = True, rate_class: str = RATE_CLASS_CONTROL,
+                 max_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+        self.message_type = message_type
+        self.handler = handler
+        self.require_auth = require_auth
+        self.rate_class = rate_class
+        self.max_size = max_size
+        self.messages_in = MESSAGES_IN.labels(message_type.value)
+
+
+class MessageRouter:
+    """
+    Registry handler theo MessageType
+    handler(msg: IncomingMessage, conn) -> dict | None (response gửi lại cho client)
+    """
+
+    def __init__(self, auth_handler=None, rate_limiter: RateLimiter = None, monitor=None):
+        self.auth_handler = auth_handler
+        self.rate_limiter = rate_limiter
+        self.monitor = monitor  # LoopMonitor: đo thời gian mỗi nhánh dispatch
+        self.routes: Dict[str, Route] = {}  # {message_type.value: Route}
+
+    def add_route(self, message_type: MessageType, handler: Callable, *,
+                  require_auth: bool = True, rate_class: str = RATE_CLASS_CONTROL,
+                  max_size: int = DEFAULT_MAX_MESSAGE_SIZE) -> Route:
+        """Đăng ký handler cho một loại message"""
+        route = Route(message_type, handler, require_auth, rate_class, max_size)
+        self.routes[message_type.value] = route
+        return route
+
+    def route(self, message_type: MessageType, **options):
+        """Decorator tương đương add_route"""
+        def decorator(handler):
+            self.add_route(message_type, handler, **options)
+            return handler
+        return decorator
+
+    async def dispatch(self, client_id: str, raw: Any, conn=None, size: int = 0) -> Optional[dict]:
+        """
+        Validate và chuyển message tới handler
+        Returns: response dict (hoặc None nếu handler không trả lời)
+        """
+        try:
+            msg = IncomingMessage.parse(raw, client_id, size)
+        except MessageValidationError as e:
+            return Message.response(MessageType.ERROR, False, str(e))
+
+        route = self.routes.get(msg.type)
+        if route is None:
+            return Message.response(MessageType.ERROR, False, f"Loại message không hợp lệ: {msg.type}")
+        route.messages_in.inc()
+
+        if size > route.max_size:
+            return Message.response(
+                MessageType.ERROR, False,
+                f"Message quá lớn ({size} bytes, tối đa {route.max_size} bytes)"
+            )
+
+        if self.auth_handler:
+            msg.username = self.auth_handler.get_username(client_id)
+        if route.require_auth and not msg.username:
+            return Message.response(MessageType.ERROR, False, "Bạn cần đăng nhập trước")
+
+        if self.rate_limiter:
+            # FILE_DATA tính theo bytes, các lớp khác theo số message
+            cost = size if route.rate_class == RATE_CLASS_FILE_BYTES else 1
+            wait = self.rate_limiter.check(route.rate_class, cost, msg.username, client_id)
+            if wait is not None:
+                return Message.response(
+                    MessageType.ERROR, False, "Gửi quá nhanh, vui lòng thử lại sau",
+                    {"rate_limited": True, "rate_class": route.rate_class, "retry_after_ms": int(wait * 1000)}
+                )
+
+        if self.monitor is None:
+            return await route.handler(msg, conn)
+        with self.monitor.step(f"dispatch.{msg.type}"):
+            return await route.handler(msg, conn)
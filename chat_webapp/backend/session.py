@@ -0,0 +1,126 @@
+"""
+Session: trạng thái của một connection (WebSocket hoặc raw TCP) trong một object __slots__
+SessionRegistry đăng ký session một lần và dùng chung cho server, AuthHandler, ChatHandler, FileHandler
+(thay cho các dict song song {client_id: ...} ở từng nơi)
+"""
+from typing import Dict, Iterator, List, Optional
+
+from .protocol import Message
+
+
+class Session:
+    """Một connection: transport, codec đã negotiate, user đã xác thực, batcher/compressor"""
+    __slots__ = ("client_id", "conn", "codec", "username", "batcher", "compressor", "server",
+                 "last_seen", "last_message", "ping_sent", "messages_in", "bytes_in")
+
+    def __init__(self, client_id: str, conn, codec, server=None):
+        self.client_id = client_id
+        self.conn = conn  # web.WebSocketResponse hoặc TCPConnection (None với session REST)
+        self.codec = codec
+        self.username: Optional[str] = None
+        self.batcher = None  # OutboundBatcher nếu client bật batching
+        self.compressor = None  # WebSocketCompressor (chỉ WebSocket)
+        self.server = server  # WebSocketChatServer gửi frame cho session
+        # Heartbeat (time.monotonic): frame nhận gần nhất, message ứng dụng gần nhất, ping đang chờ pong
+        self.last_seen = 0.0
+        self.last_message = 0.0
+        self.ping_sent: Optional[float] = None
+        # Lưu lượng inbound (admin: top talkers)
+        self.messages_in = 0
+        self.bytes_in = 0
+
+    async def send(self, message, counted: bool = True):
+        """
+        Gửi message (dict, hoặc bytes của Message.create_*) tới client
+        counted=False: vòng fan-out tự cộng metric messages out một lần cho cả vòng
+        """
+        if self.server is None:
+            return
+        if isinstance(message, bytes):
+            message = Message.decode(message)
+            if not message:
+                return
+        await self.server.send_ws(self, message, counted)
+
+
+class SessionRegistry:
+    """
+    Registry session theo client_id, kèm index username -> các session đã xác thực
+    để tìm connection của một user không phải duyệt toàn bộ clients
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, Session] = {}
+        self.by_user: Dict[str, List[Session]] = {}
+        self._counter = 0
+
+    def create(self, prefix: str, conn, codec, server=None) -> Session:
+        """Tạo và đăng ký session mới với client_id = {prefix}_{n}"""
+        client_id = f"{prefix}_{self._counter}"
+        self._counter += 1
+        session = Session(client_id, conn, codec, server)
+        self.sessions[client_id] = session
+        return session
+
+    def get(self, client_id: str) -> Optional[Session]:
+        return self.sessions.get(client_id)
+
+    def remove(self, client_id: str) -> Optional[Session]:
+        """Xóa session (và khỏi index username)"""
+        session = self.sessions.pop(client_id, None)
+        if session is not None:
+            self.deauthenticate(session)
+        return session
+
+    def authenticate(self, client_id: str, username: str) -> Session:
+        """
+        Gắn username cho session
+        client_id chưa có session (login qua REST) thì tạo session không có connection
+        """
+        session = self.sessions.get(client_id)
+        if session is None:
+            session = Session(client_id, None, None)
+            self.sessions[client_id] = session
+        if session.username == username:
+            return session
+        self.deauthenticate(session)
+        session.username = username
+        self.by_user.setdefault(username, []).append(session)
+        return session
+
+    def deauthenticate(self, session: Session) -> Optional[str]:
+        """Bỏ username của session, trả về username cũ"""
+        username = session.username
+        if username is None:
+            return None
+        session.username = None
+        user_sessions = self.by_user.get(username)
+        if user_sessions:
+            try:
+                user_sessions.remove(session)
+            except ValueError:
+                pass
+            if not user_sessions:
+                del self.by_user[username]
+        return username
+
+    def username(self, client_id: str) -> Optional[str]:
+        session = self.sessions.get(client_id)
+        return session.username if session is not None else None
+
+    def for_user(self, username: str) -> List[Session]:
+        """Các session đã xác thực của user (theo thứ tự đăng nhập)"""
+        return self.by_user.get(username, [])
+
+    def authenticated(self) -> Iterator[Session]:
+        """Các session đã xác thực (theo thứ tự kết nối)"""
+        return (session for session in list(self.sessions.values()) if session.username is not None)
+
+    def online_usernames(self) -> list:
+        return list(self.by_user)
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def __iter__(self) -> Iterator[Session]:
+        return iter(list(self.sessions.values()))
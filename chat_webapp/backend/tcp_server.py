@@ -0,0 +1,207 @@
+"""
+Raw TCP/TLS server cho bot và các hệ thống backend
+Dùng asyncio.Protocol với framing [length: 4 bytes][payload] của protocol.Message,
+chia sẻ handlers và routing với WebSocketChatServer
+"""
+import asyncio
+import logging
+import ssl
+import time
+from typing import Optional, Set
+
+from .protocol import (
+    FrameDecoder, FrameTooLargeError, FrameDecodeError,
+    JSON_CODEC, BINARY_CODEC, FRAME_HEADER_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TCPConnection(asyncio.Protocol):
+    """
+    Một connection raw TCP
+    Có send_json/send_bytes/close giống web.WebSocketResponse để
+    WebSocketChatServer gửi message mà không cần biết transport
+    """
+
+    # Số message chờ xử lý tối đa trước khi ngừng đọc socket
+    MAX_PENDING_MESSAGES = 256
+
+    def __init__(self, server: "TCPChatServer"):
+        self.server = server
+        self.chat_server = server.chat_server
+        self.transport: Optional[asyncio.Transport] = None
+        self.session = None  # Session đăng ký với WebSocketChatServer
+        self.client_id: Optional[str] = None
+        self.codec = None
+        self.decoder: Optional[FrameDecoder] = None
+        self._head = b''  # Bytes nhận được trước khi chọn codec
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.worker: Optional[asyncio.Task] = None
+        self.closed = False
+        self._reading_paused = False
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.server.connections.add(self)
+        self.worker = asyncio.ensure_future(self._process_messages())
+
+    def data_received(self, data: bytes):
+        if self.decoder is None:
+            # Chọn codec theo byte đầu tiên của payload frame đầu tiên:
+            # JSON object bắt đầu bằng '{', còn lại là binary codec
+            pending = self._head + data
+            if len(pending) <= FRAME_HEADER_SIZE:
+                self._head = pending
+                return
+            self.codec = JSON_CODEC if pending[FRAME_HEADER_SIZE] == ord('{') else BINARY_CODEC
+            self.decoder = FrameDecoder(codec=self.codec, max_frame_size=self.server.max_frame_size,
+                                        with_sizes=True)
+            self.session = self.chat_server.register_connection("tcp_client", self, self.codec)
+            self.client_id = self.session.client_id
+            peer = self.transport.get_extra_info('peername')
+            logger.info("TCP client kết nối", extra={"client_id": self.client_id, "peer": peer, "codec": self.codec.name})
+            data = pending
+            self._head = b''
+
+        self.session.last_seen = time.monotonic()
+        self.session.bytes_in += len(data)
+        try:
+            messages = self.decoder.feed(data)
+        except FrameDecodeError as e:
+            messages = e.messages
+            for _ in range(e.errors):
+                self._send_error("Invalid frame payload")
+        except FrameTooLargeError as e:
+            logger.warning("%s", e, extra={"client_id": self.client_id})
+            self._send_error(str(e))
+            self.transport.close()
+            return
+
+        if messages:
+            self.session.last_message = self.session.last_seen
+            self.session.messages_in += len(messages)
+        for message in messages:
+            self.queue.put_nowait(message)
+
+        # Flow control: ngừng đọc khi xử lý không kịp
+        if not self._reading_paused and self.queue.qsize() >= self.MAX_PENDING_MESSAGES:
+            self._reading_paused = True
+            self.transport.pause_reading()
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.closed = True
+        self._can_write.set()
+        self.server.connections.discard(self)
+        if self.worker:
+            self.worker.cancel()
+        if self.client_id:
+            self.server.track(asyncio.ensure_future(self.chat_server.disconnect_client(self.client_id)),
+                              self.client_id)
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    async def _process_messages(self):
+        """Xử lý tuần tự các message của connection (giữ đúng thứ tự)"""
+        while True:
+            message, size = await self.queue.get()
+            if self._reading_paused and self.queue.qsize() < self.MAX_PENDING_MESSAGES // 2:
+                self._reading_paused = False
+                self.transport.resume_reading()
+            try:
+                await self.chat_server.process_websocket_message(self.session, message, size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Lỗi xử lý message", extra={"client_id": self.client_id})
+                self._send_error(f"Server error: {str(e)}")
+
+    def _send_error(self, message: str):
+        codec = self.codec or JSON_CODEC
+        self._write(codec.dumps({
+            "type": "ERROR",
+            "data": {"success": False, "message": message}
+        }))
+
+    def _write(self, payload: bytes):
+        if self.closed or self.transport is None or self.transport.is_closing():
+            return
+        self.transport.write(len(payload).to_bytes(FRAME_HEADER_SIZE, 'big') + payload)
+
+    async def send_bytes(self, payload: bytes):
+        """Gửi payload đã encode (tự thêm length prefix)"""
+        await self._can_write.wait()
+        self._write(payload)
+
+    async def send_json(self, message: dict):
+        """Gửi message bằng JSON codec"""
+        await self.send_bytes(JSON_CODEC.dumps(message))
+
+    async def close(self):
+        if self.transport and not self.transport.is_closing():
+            self.transport.close()
+
+
+class TCPChatServer:
+    """Listener raw TCP (tùy chọn TLS) gắn vào một WebSocketChatServer"""
+
+    # Giây chờ các connection đóng xong khi stop()
+    STOP_TIMEOUT = 5.0
+
+    def __init__(self, chat_server, host: str = '0.0.0.0', port: int = 9000,
+                 ssl_context: ssl.SSLContext = None, max_frame_size: int = 1024 * 1024):
+        self.chat_server = chat_server
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.max_frame_size = max_frame_size
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: Set[TCPConnection] = set()
+        self._tasks: Set[asyncio.Task] = set()  # disconnect_client đang chạy
+
+    def track(self, task: asyncio.Task, client_id: str):
+        """Giữ reference tới task dọn connection tới khi xong, ghi log nếu lỗi"""
+        self._tasks.add(task)
+
+        def done(task: asyncio.Task):
+            self._tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error("Lỗi dọn TCP connection", exc_info=task.exception(),
+                             extra={"client_id": client_id})
+
+        task.add_done_callback(done)
+
+    async def start(self):
+        """Khởi động TCP listener"""
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(
+            lambda: TCPConnection(self),
+            self.host,
+            self.port,
+            ssl=self.ssl_context
+        )
+        scheme = 'tls' if self.ssl_context else 'tcp'
+        logger.info("TCP Server đã sẵn sàng tại %s://%s:%s", scheme, self.host, self.port)
+
+    async def stop(self):
+        """Ngừng nhận connection, đóng các connection đang mở và chờ dọn xong"""
+        if self.server:
+            self.server.close()
+        for connection in list(self.connections):
+            if connection.transport and not connection.transport.is_closing():
+                connection.transport.close()
+        if self.server:
+            await self.server.wait_closed()
+        # connection_lost (tạo task disconnect_client) chạy sau khi transport đóng xong
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.STOP_TIMEOUT
+        while self.connections and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -0,0 +1,104 @@
+"""
+Cache thư mục user: username -> profile và email -> username
+Chỉ cache kết quả tìm thấy (username/email không đổi sau khi đăng ký)
+nên user mới đăng ký ở process khác không bị cache âm che mất
+"""
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Số profile tối đa giữ trong bộ nhớ
+DEFAULT_MAX_USERS = 10000
+
+
+class UserDirectory:
+    """LRU profile user (username, email, created_at) dùng chung cho auth và profile endpoints"""
+
+    def __init__(self, db, max_entries: int = DEFAULT_MAX_USERS):
+        self.db = db
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, dict]" = OrderedDict()  # {username: profile}
+        self._emails: Dict[str, str] = {}  # {email: username}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def remember(self, profile: dict):
+        """Thêm/cập nhật profile (sau khi đọc database hoặc đăng ký)"""
+        username = profile['username']
+        old = self._profiles.pop(username, None)
+        if old is not None and old['email'] != profile['email']:
+            self._emails.pop(old['email'], None)
+        self._profiles[username] = profile
+        self._emails[profile['email']] = username
+        while len(self._profiles) > self.max_entries:
+            _, evicted = self._profiles.popitem(last=False)
+            self._emails.pop(evicted['email'], None)
+            self.evictions += 1
+
+    def invalidate(self, username: str):
+        """Xóa profile khỏi cache (gọi khi thông tin user thay đổi)"""
+        profile = self._profiles.pop(username, None)
+        if profile is not None:
+            self._emails.pop(profile['email'], None)
+
+    def _load(self, column: str, value: str) -> Optional[dict]:
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT username, email, created_at FROM users WHERE {column} = ?", (value,))
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        profile = dict(row)
+        self.remember(profile)
+        return profile
+
+    def is_cached_username(self, username: str) -> bool:
+        """Chỉ kiểm tra cache (không đọc database)"""
+        if username in self._profiles:
+            self.hits += 1
+            return True
+        return False
+
+    def is_cached_email(self, email: str) -> bool:
+        """Chỉ kiểm tra cache (không đọc database)"""
+        if email in self._emails:
+            self.hits += 1
+            return True
+        return False
+
+    def get(self, username: str) -> Optional[dict]:
+        """Profile của user (bản sao), None nếu không tồn tại"""
+        profile = self._profiles.get(username)
+        if profile is not None:
+            self.hits += 1
+            self._profiles.move_to_end(username)
+            return dict(profile)
+        self.misses += 1
+        profile = self._load('username', username)
+        return dict(profile) if profile else None
+
+    def exists(self, username: str) -> bool:
+        return self.get(username) is not None
+
+    def username_for_email(self, email: str) -> Optional[str]:
+        """Username đăng ký với email, None nếu không tồn tại"""
+        username = self._emails.get(email)
+        if username is not None:
+            self.hits += 1
+            self._profiles.move_to_end(username)
+            return username
+        self.misses += 1
+        profile = self._load('email', email)
+        return profile['username'] if profile else None
+
+    def snapshot(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._profiles),
+            "max_users": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -4,47 +4,144 @@ Sử dụng aiohttp WebSocket để tương thích với browser
 """
 import asyncio
 import json
+import logging
+import math
 import ssl
-import jwt
-from typing import Dict, Set, Callable
+import time
+from functools import partial
+from typing import Optional, Tuple
 from pathlib import Path
 from aiohttp import web
 
-from .database import Database
-from .protocol import Message, MessageType
+from .auth import TokenVerifier, auth_middleware, bearer_token
+from .database import Database, BROADCAST_STREAM, EVENT_RETENTION, PENDING_DELIVERY_LIMIT
+from .protocol import (
+    Message, MessageType, SUBPROTOCOLS, AUTH_SUBPROTOCOL_PREFIX, JSON_CODEC, get_codec, CLOSE_AUTH_FAILED
+)
 from .auth_handler import AuthHandler
 from .chat_handler import ChatHandler
 from .file_handler import FileHandler
+from .session import Session, SessionRegistry
+from .heartbeat import HeartbeatMonitor, HeartbeatSettings
+from .admission import AdmissionController, AdmissionSettings, CLOSE_TRY_AGAIN_LATER
+from .tcp_server import TCPChatServer, TCPConnection
+from .batching import OutboundBatcher, BatchStats
+from .compression import (
+    CompressionSettings, CompressionStats, WebSocketCompressor, create_websocket_response
+)
+from .router import (
+    MessageRouter, IncomingMessage, RATE_CLASS_MESSAGE, RATE_CLASS_FILE_BYTES
+)
+from .rate_limit import RateLimiter
+from .loop_monitor import LoopMonitor, DB_TIMED_METHODS
+from .metrics import (
+    REGISTRY, MESSAGES_OUT, SESSIONS, AUTHENTICATED_USERS, metrics_handler, sample_lines
+)
+from . import log
+from .admin import AdminInterface, AdminSettings
+from .capture import CaptureSettings, CaptureWriter
+
+logger = logging.getLogger(__name__)
+
+# FILE_DATA chứa chunk base64 nên được phép lớn hơn các message khác
+FILE_DATA_MAX_SIZE = 1024 * 1024
+
+# Số event tối đa replay cho mỗi stream khi reconnect; lệch nhiều hơn thì client phải resync
+# (database chỉ giữ chừng ấy event mỗi stream)
+EVENT_REPLAY_LIMIT = EVENT_RETENTION
+
+# Số message chờ giao đọc/gửi mỗi lần khi drain (một frame BATCH mỗi lần)
+PENDING_DRAIN_BATCH = 200
+# Số batch tối đa gửi trong handshake; còn nữa thì gửi RESYNC để client tải lại qua REST
+PENDING_DRAIN_MAX_BATCHES = PENDING_DELIVERY_LIMIT // PENDING_DRAIN_BATCH
+# Số id tối đa trong một DELIVERY_ACK
+MAX_ACK_IDS = 1000
+
+def handshake_token(request: web.Request) -> Optional[str]:
+    """
+    Token gửi lúc upgrade: query ?token=, subprotocol chatchit.auth.<token>
+    (browser không set được header) hoặc header Authorization
+    """
+    token = request.query.get('token')
+    if token:
+        return token
+    for protocol in request.headers.get('Sec-WebSocket-Protocol', '').split(','):
+        protocol = protocol.strip()
+        if protocol.startswith(AUTH_SUBPROTOCOL_PREFIX):
+            return protocol[len(AUTH_SUBPROTOCOL_PREFIX):]
+    return bearer_token(request)
+
+
+def handshake_options(request: web.Request) -> dict:
+    """Tham số AUTH gửi qua query khi xác thực lúc upgrade (last_seq, last_broadcast_seq, batch_ms)"""
+    options = {}
+    for name in ('last_seq', 'last_broadcast_seq'):
+        value = request.query.get(name, '')
+        if value.isdigit():
+            options[name] = int(value)
+    batch_ms = request.query.get('batch_ms', '')
+    if batch_ms.isdigit() and int(batch_ms) > 0:
+        options['batch'] = {"max_delay_ms": int(batch_ms)}
+    return options
 
-# JWT Secret (phải giống với REST API)
-JWT_SECRET = "your-secret-key-change-in-production"
-JWT_ALGORITHM = "HS256"
 
 class WebSocketChatServer:
     """WebSocket server cho frontend web"""
     
     def __init__(self, host: str = '0.0.0.0', port: int = 8080, 
-                 ssl_cert: str = None, ssl_key: str = None):
+                 ssl_cert: str = None, ssl_key: str = None, tcp_port: int = None,
+                 compression: CompressionSettings = None, heartbeat: HeartbeatSettings = None,
+                 admission: AdmissionSettings = None, rate_limiter: RateLimiter = None,
+                 loop_monitor: LoopMonitor = None, admin: AdminSettings = None,
+                 capture: CaptureSettings = None):
         self.host = host
         self.port = port
         self.ssl_cert = ssl_cert
         self.ssl_key = ssl_key
+        self.tcp_port = tcp_port  # Raw TCP listener (None = tắt)
+        self.tcp_server: Optional[TCPChatServer] = None
+        self.compression = compression or CompressionSettings()
+        self.compression_stats = CompressionStats()
+        
+        # Loop lag, bước chậm (DB, dispatch, fan-out) và stack khi loop bị chặn
+        self.loop_monitor = loop_monitor or LoopMonitor()
         
         # Initialize components (shared với TCP server)
         self.db = Database()
-        self.auth_handler = AuthHandler(self.db)
-        self.chat_handler = ChatHandler(self.db, self.auth_handler)
+        self.loop_monitor.instrument(self.db, "db", DB_TIMED_METHODS)
+        # Mỗi connection là một Session, đăng ký một lần và dùng chung cho mọi handler
+        self.sessions = SessionRegistry()
+        self.auth_handler = AuthHandler(self.db, self.sessions)
+        self.chat_handler = ChatHandler(self.db, self.auth_handler, monitor=self.loop_monitor)
         self.file_handler = FileHandler(self.db, self.auth_handler)
+        self.token_verifier = TokenVerifier()  # Cùng cơ chế verify với REST API
+        
+        self.batch_stats = BatchStats()
+        # Ping/pong và dọn connection chết bằng một timer wheel chung
+        self.heartbeat = HeartbeatMonitor(self, heartbeat)
+        # Giới hạn tốc độ nhận connection mới (reconnect storm sau deploy)
+        self.admission = AdmissionController(admission)
         
-        # WebSocket clients
-        self.ws_clients: Dict[str, web.WebSocketResponse] = {}  # {client_id: websocket}
-        self.send_to_client_callbacks: Dict[str, Callable] = {}  # {client_id: send_callback}
-        self.client_counter = 0
+        # Dispatch message theo bảng route
+        # Rate limit theo connection và theo user cho từng lớp route (message, file bytes, control)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Profile, heap snapshot và state qua /admin/... (localhost hoặc admin token)
+        self.admin = AdminInterface(admin, self.admin_state)
+        self.router = MessageRouter(self.auth_handler, self.rate_limiter, self.loop_monitor)
+        self.setup_routes()
+        # Ghi frame inbound ra file capture để replay (tắt khi không có path)
+        self.capture = CaptureWriter(capture)
         
         # Create aiohttp app
-        self.app = web.Application()
+        self.app = web.Application(middlewares=[self.admin.middleware(), auth_middleware(self.token_verifier)])
         self.app.router.add_get('/', self.websocket_handler)
         self.app.router.add_get('/ws', self.websocket_handler)
+        self.app.router.add_get('/stats', self.stats_handler)
+        self.app.router.add_get('/stats/loop', self.loop_stats_handler)
+        self.app.router.add_get('/metrics', metrics_handler)
+        self.admin.setup(self.app)
+        self.app.on_startup.append(self.on_startup)
+        self.app.on_cleanup.append(self.on_cleanup)
         
         # CORS middleware (cho phép frontend kết nối từ domain khác)
         self.setup_cors()
@@ -69,60 +166,81 @@ class WebSocketChatServer:
     
     async def websocket_handler(self, request: web.Request):
         """Xử lý WebSocket connection"""
-        ws = web.WebSocketResponse()
-        await ws.prepare(request)
-        
-        client_id = f"ws_client_{self.client_counter}"
-        self.client_counter += 1
-        
-        client_addr = request.remote
-        print(f"[{client_id}] WebSocket client kết nối từ {client_addr}")
-        
-        # Lưu WebSocket connection
-        self.ws_clients[client_id] = ws
+        # Admission control: giới hạn tốc độ nhận và số handshake đồng thời
+        retry_after = await self.admission.enter()
+        if retry_after is not None:
+            return await self.reject_connection(request, retry_after)
         
-        # Đăng ký callback để gửi message
-        async def send_to_client(data):
-            try:
-                # Nếu là dict (JSON), gửi trực tiếp
-                if isinstance(data, dict):
-                    await ws.send_json(data)
-                # Nếu là bytes, decode trước
-                elif isinstance(data, bytes):
-                    message = Message.decode(data)
-                    if message:
-                        await ws.send_json(message)
-                else:
-                    print(f"Lỗi: data type không hợp lệ: {type(data)}")
-            except Exception as e:
-                print(f"Lỗi gửi WebSocket message: {e}")
-                # Nếu decode lỗi, thử gửi trực tiếp JSON
-                try:
-                    await ws.send_json({"type": "ERROR", "data": {"message": "Lỗi xử lý message"}})
-                except:
-                    pass
-        
-        # Lưu callback để đăng ký sau khi authenticate
-        self.send_to_client_callbacks[client_id] = send_to_client
+        session = None
+        try:
+            # Token gửi kèm lúc upgrade thì xác thực ngay, không cần frame AUTH
+            username = None
+            token = handshake_token(request)
+            if token is not None:
+                username, error = self.verify_user(token)
+                if error:
+                    return await self.reject_auth(request, error)
+            
+            # Client mới có thể chọn codec nhị phân qua Sec-WebSocket-Protocol,
+            # client cũ không gửi header này sẽ dùng JSON
+            # Heartbeat tự quản lý ping/pong (không để aiohttp tạo timer cho mỗi socket)
+            ws = create_websocket_response(self.compression, protocols=SUBPROTOCOLS,
+                                           autoping=not self.heartbeat.settings.enabled)
+            await ws.prepare(request)
+            
+            codec = get_codec(ws.ws_protocol)
+            session = self.register_connection("ws_client", ws, codec)
+            session.compressor = WebSocketCompressor(ws, self.compression, self.compression_stats)
+            client_id = session.client_id
+            logger.info("WebSocket client kết nối",
+                        extra={"client_id": client_id, "remote": request.remote, "codec": codec.name})
+            if self.capture.enabled:
+                self.capture.ws_open(client_id, request, codec.name, username)
+        finally:
+            # Chưa đăng ký được session (từ chối/lỗi): trả slot ngay
+            if session is None:
+                self.admission.leave()
         
         try:
+            # Trong try/finally để client ngắt giữa lúc gửi SUCCESS/replay vẫn được dọn khỏi registry
+            try:
+                if username:
+                    await self.complete_auth(session, username, handshake_options(request))
+            finally:
+                # Giữ slot tới hết broadcast presence, replay và drain pending
+                self.admission.leave()
             async for msg in ws:
-                if msg.type == web.WSMsgType.TEXT:
+                session.last_seen = time.monotonic()
+                if msg.type == web.WSMsgType.PING:
+                    await ws.pong(msg.data)
+                elif msg.type in (web.WSMsgType.TEXT, web.WSMsgType.BINARY):
+                    session.last_message = session.last_seen
+                    session.messages_in += 1
+                    session.bytes_in += len(msg.data)
                     try:
-                        # Parse JSON message từ frontend
-                        data = json.loads(msg.data)
-                        await self.process_websocket_message(client_id, data, ws)
-                    except json.JSONDecodeError:
-                        await ws.send_json({
+                        # Parse message từ frontend (text luôn là JSON, binary theo codec)
+                        if msg.type == web.WSMsgType.BINARY:
+                            data = codec.loads(msg.data)
+                        else:
+                            data = json.loads(msg.data)
+                    except (ValueError, TypeError, IndexError, KeyError):
+                        if self.capture.enabled:
+                            self.capture.ws_frame(client_id, msg.data, None)
+                        await self.send_ws(session, {
                             "type": "ERROR",
                             "data": {
                                 "success": False,
-                                "message": "Invalid JSON format"
+                                "message": f"Invalid {'binary' if msg.type == web.WSMsgType.BINARY else 'JSON'} format"
                             }
                         })
+                        continue
+                    if self.capture.enabled:
+                        self.capture.ws_frame(client_id, msg.data, data)
+                    try:
+                        await self.process_websocket_message(session, data, len(msg.data))
                     except Exception as e:
-                        print(f"[{client_id}] Lỗi xử lý message: {e}")
-                        await ws.send_json({
+                        logger.exception("Lỗi xử lý message", extra={"client_id": client_id})
+                        await self.send_ws(session, {
                             "type": "ERROR",
                             "data": {
                                 "success": False,
@@ -130,232 +248,407 @@ class WebSocketChatServer:
                             }
                         })
                 elif msg.type == web.WSMsgType.ERROR:
-                    print(f"[{client_id}] WebSocket error: {ws.exception()}")
+                    logger.warning("WebSocket error: %s", ws.exception(), extra={"client_id": client_id})
                     break
         except Exception as e:
-            print(f"[{client_id}] Lỗi WebSocket: {e}")
+            logger.warning("Lỗi WebSocket: %s", e, extra={"client_id": client_id})
         finally:
             # Cleanup
+            if self.capture.enabled:
+                self.capture.ws_close(client_id)
             await self.disconnect_client(client_id)
         
         return ws
     
-    def verify_token(self, token: str) -> dict:
-        """Verify JWT token"""
-        try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            return payload
-        except jwt.ExpiredSignatureError:
-            return None
-        except jwt.InvalidTokenError:
-            return None
+    async def reject_connection(self, request: web.Request, retry_after: float):
+        """
+        Từ chối connection kèm retry delay: browser không đọc được HTTP status khi upgrade thất bại
+        nên request có Origin được upgrade rồi đóng ngay với close code 1013,
+        client khác nhận HTTP 503 + Retry-After
+        """
+        retry_ms = int(retry_after * 1000)
+        if request.headers.get('Origin'):
+            ws = create_websocket_response(None, protocols=SUBPROTOCOLS, compress=False)
+            await ws.prepare(request)
+            await ws.close(code=CLOSE_TRY_AGAIN_LATER,
+                           message=json.dumps({"retry_after_ms": retry_ms}).encode('utf-8'))
+            return ws
+        raise web.HTTPServiceUnavailable(
+            headers={'Retry-After': str(max(1, math.ceil(retry_after)))},
+            text=json.dumps({"success": False, "message": "Server đang quá tải", "retry_after_ms": retry_ms}),
+            content_type='application/json'
+        )
     
-    async def process_websocket_message(self, client_id: str, message: dict, ws: web.WebSocketResponse):
-        """Xử lý message từ WebSocket client"""
-        msg_type = message.get('type')
-        data = message.get('data', {})
-        
-        # Convert WebSocket message format sang internal format và xử lý
-        response = None
-        
-        # Xử lý AUTH - xác thực JWT token từ frontend
-        if msg_type == "AUTH":
-            token = data.get('token', '')
-            if not token:
-                response = {
-                    "type": "ERROR",
-                    "data": {
-                        "success": False,
-                        "message": "Token không được cung cấp"
-                    }
-                }
+    async def reject_auth(self, request: web.Request, error: str):
+        """
+        Token lúc upgrade không hợp lệ: browser không đọc được HTTP 401 (chỉ thấy close 1006)
+        nên request có Origin được upgrade rồi đóng với CLOSE_AUTH_FAILED kèm thông báo lỗi,
+        client khác nhận HTTP 401
+        """
+        if request.headers.get('Origin'):
+            ws = create_websocket_response(None, protocols=SUBPROTOCOLS, compress=False)
+            await ws.prepare(request)
+            await ws.close(code=CLOSE_AUTH_FAILED, message=error.encode('utf-8'))
+            return ws
+        raise web.HTTPUnauthorized(text=error)
+    
+    def register_connection(self, prefix: str, conn, codec) -> Session:
+        """
+        Đăng ký một connection mới (WebSocket hoặc raw TCP)
+        conn chỉ cần có send_json/send_bytes/close giống web.WebSocketResponse
+        Returns: Session (client_id = session.client_id)
+        """
+        session = self.sessions.create(prefix, conn, codec, self)
+        self.heartbeat.track(session)
+        return session
+    
+    async def send_ws(self, session: Session, message: dict, counted: bool = True):
+        """Gửi message đến client (qua batcher nếu client đã bật batching)"""
+        if counted:
+            MESSAGES_OUT.labels(message.get("type")).inc()
+        batcher = session.batcher
+        if batcher:
+            await batcher.send(message)
+        else:
+            await self.write_frame(session, message)
+    
+    async def write_frame(self, session: Session, message: dict):
+        """Ghi một frame bằng codec đã negotiate (nén theo ngưỡng nếu là WebSocket)"""
+        codec = session.codec or JSON_CODEC
+        compressor = session.compressor
+        if compressor is None:
+            # Raw TCP hoặc connection không có điều khiển nén
+            if codec.binary:
+                await session.conn.send_bytes(codec.dumps(message))
             else:
-                payload = self.verify_token(token)
-                if payload:
-                    username = payload.get('username')
-                    if username:
-                        # Đăng nhập user vào auth_handler
-                        # Tạo một login request giả để authenticate
-                        login_data = {'username': username, 'password': ''}  # Password không cần vì đã verify token
-                        # Kiểm tra user có tồn tại trong DB không
-                        conn = self.db.get_connection()
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-                        user = cursor.fetchone()
-                        conn.close()
-                        
-                        if user:
-                            # Authenticate user
-                            self.auth_handler.authenticated_users[client_id] = username
-                            
-                            # Đăng ký client sau khi authenticate thành công
-                            send_to_client = self.send_to_client_callbacks.get(client_id)
-                            if send_to_client:
-                                await self.chat_handler.register_client(client_id, send_to_client)
-                                self.file_handler.register_client(client_id, send_to_client)
-                            
-                            # Gửi danh sách online users cho user mới (bao gồm cả user hiện tại)
-                            # Đợi một chút để đảm bảo user đã được thêm vào danh sách
-                            import asyncio
-                            await asyncio.sleep(0.1)  # Đợi 100ms để đảm bảo register_client đã hoàn thành
-                            online_users = self.chat_handler.get_online_users()
-                            online_users_msg = {
-                                "type": "online_users",
-                                "data": {
-                                    "users": online_users
-                                }
-                            }
-                            await ws.send_json(online_users_msg)
-                            
-                            response = {
-                                "type": "SUCCESS",
-                                "data": {
-                                    "success": True,
-                                    "message": "Xác thực thành công",
-                                    "username": username
-                                }
-                            }
-                            print(f"[{client_id}] User {username} đã xác thực qua JWT token")
-                        else:
-                            response = {
-                                "type": "ERROR",
-                                "data": {
-                                    "success": False,
-                                    "message": "User không tồn tại"
-                                }
-                            }
-                    else:
-                        response = {
-                            "type": "ERROR",
-                            "data": {
-                                "success": False,
-                                "message": "Token không hợp lệ"
-                            }
-                        }
-                else:
-                    response = {
-                        "type": "ERROR",
-                        "data": {
-                            "success": False,
-                            "message": "Token không hợp lệ hoặc đã hết hạn"
-                        }
+                await session.conn.send_json(message)
+        else:
+            await compressor.send(codec.dumps(message), binary=codec.binary)
+    
+    async def stats_handler(self, request: web.Request):
+        """GET /stats - bộ đếm batching, nén và cache user"""
+        return web.json_response({
+            "connections": len(self.sessions),
+            "batching": self.batch_stats.snapshot(),
+            "compression": self.compression_stats.snapshot(),
+            "user_directory": self.db.users.snapshot(),
+            "auth": self.token_verifier.snapshot(),
+            "heartbeat": {**self.heartbeat.stats.snapshot(), "tracked": len(self.heartbeat.wheel)},
+            "admission": self.admission.snapshot(),
+            "rate_limit": self.rate_limiter.snapshot(),
+            "loop": self.loop_monitor.snapshot(),
+            "logging": log.snapshot(),
+            "capture": self.capture.snapshot()
+        })
+    
+    def admin_state(self, top: int = 10) -> dict:
+        """State cho GET /admin/state: session, queue, file transfer dang dở, top talkers"""
+        sessions = list(self.sessions)
+        transports = {}
+        for session in sessions:
+            transport = session.client_id.rsplit('_', 1)[0]
+            transports[transport] = transports.get(transport, 0) + 1
+        batchers = [session.batcher for session in sessions if session.batcher]
+        tcp_queues = [session.conn.queue.qsize() for session in sessions if isinstance(session.conn, TCPConnection)]
+        transfers = self.file_handler.file_transfers
+        talkers = sorted(sessions, key=lambda session: session.messages_in, reverse=True)[:top]
+        return {
+            "sessions": len(sessions),
+            "authenticated_users": len(self.sessions.by_user),
+            "transports": transports,
+            "queues": {
+                "batchers": len(batchers),
+                "batched_messages": sum(len(batcher) for batcher in batchers),
+                "tcp_pending_messages": sum(tcp_queues),
+                "tcp_max_pending": max(tcp_queues, default=0),
+                "handshakes_in_progress": self.admission.in_progress,
+                "heartbeat_tracked": len(self.heartbeat.wheel),
+            },
+            "file_transfers": {
+                "active": len(transfers),
+                "buffered_bytes": sum(transfer["received_size"] for transfer in transfers.values()),
+                "transfers": [
+                    {
+                        "transfer_id": transfer_id,
+                        "sender": transfer["sender_username"],
+                        "receiver": transfer["receiver_username"],
+                        "filename": transfer["filename"],
+                        "size": transfer["size"],
+                        "received_size": transfer["received_size"],
+                        "chunks": len(transfer["chunks"]),
                     }
+                    for transfer_id, transfer in list(transfers.items())[:top]
+                ],
+            },
+            "top_talkers": [
+                {"client_id": session.client_id, "username": session.username,
+                 "messages_in": session.messages_in, "bytes_in": session.bytes_in}
+                for session in talkers
+            ],
+            "rate_limit": self.rate_limiter.snapshot(),
+            "logging": log.snapshot(),
+        }
+    
+    async def loop_stats_handler(self, request: web.Request):
+        """GET /stats/loop - loop lag, bước chậm và stack sample khi loop bị chặn"""
+        return web.json_response(self.loop_monitor.snapshot(include_events=True))
+    
+    def metric_lines(self):
+        """Metric lấy từ các bộ đếm có sẵn (collector của REGISTRY)"""
+        throttled = {name.replace(":", "_"): count for name, count in self.rate_limiter.stats.throttled.items()}
+        heartbeat = self.heartbeat.stats
+        admission = self.admission.stats
+        return (
+            self.loop_monitor.metric_lines()
+            + sample_lines("chat_admission_total", "counter", "Kết quả admission control của WebSocket upgrade", {
+                "accepted": admission.accepted,
+                "rejected_rate": admission.rejected_rate,
+                "rejected_busy": admission.rejected_busy,
+            }, label="result")
+            + sample_lines("chat_rate_limited_total", "counter", "Message bị rate limit theo lớp và phạm vi",
+                           throttled, label="limit")
+            + sample_lines("chat_heartbeat_reaped_total", "counter", "Connection bị đóng do heartbeat", {
+                "dead": heartbeat.reaped_dead,
+                "idle": heartbeat.reaped_idle,
+            }, label="reason")
+        )
+    
+    def setup_routes(self):
+        """Đăng ký handler cho từng loại message"""
+        self.router.add_route(MessageType.AUTH, self.handle_auth, require_auth=False)
+        self.router.add_route(MessageType.REGISTER, self.handle_register, require_auth=False)
+        self.router.add_route(MessageType.LOGIN, self.handle_login, require_auth=False)
+        self.router.add_route(MessageType.LOGOUT, self.handle_logout, require_auth=False)
+        self.router.add_route(MessageType.CHAT, self.handle_chat, rate_class=RATE_CLASS_MESSAGE)
+        self.router.add_route(MessageType.FILE_REQUEST, self.handle_file_request)
+        self.router.add_route(MessageType.FILE_DATA, self.handle_file_data,
+                              rate_class=RATE_CLASS_FILE_BYTES, max_size=FILE_DATA_MAX_SIZE)
+        self.router.add_route(MessageType.USER_LIST, self.handle_user_list)
+        self.router.add_route(MessageType.DELIVERY_ACK, self.handle_delivery_ack)
+        self.router.add_route(MessageType.MARK_READ, self.handle_mark_read)
+        self.router.add_route(MessageType.SYNC, self.handle_sync)
+    
+    async def process_websocket_message(self, session: Session, message: dict, size: int = 0):
+        """Xử lý message từ client (WebSocket hoặc raw TCP)"""
+        response = await self.router.dispatch(session.client_id, message, session, size)
         
-        elif msg_type == MessageType.REGISTER.value:
-            response_bytes = await self.auth_handler.handle_register(client_id, data)
-            response = Message.decode(response_bytes)
+        # Gửi response
+        if response:
+            await self.send_ws(session, response)
+    
+    def verify_user(self, token: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Verify token (cache TokenVerifier) và kiểm tra user (cache UserDirectory)
+        Returns: (username, None) nếu hợp lệ, (None, lỗi) nếu không
+        """
+        if not token:
+            return None, "Token không được cung cấp"
+        payload = self.token_verifier.verify(token)
+        if not payload:
+            return None, "Token không hợp lệ hoặc đã hết hạn"
+        username = payload.get('username')
+        if not username:
+            return None, "Token không hợp lệ"
+        if not self.db.user_exists(username):
+            return None, "User không tồn tại"
+        return username, None
+    
+    async def handle_auth(self, msg: IncomingMessage, session: Session) -> Optional[dict]:
+        """AUTH - xác thực JWT token từ frontend (khi chưa gửi token lúc upgrade)"""
+        if msg.username:
+            return Message.response(MessageType.ERROR, False, "Connection đã được xác thực")
+        username, error = self.verify_user(msg.data.get('token', ''))
+        if error:
+            return Message.response(MessageType.ERROR, False, error)
+        await self.complete_auth(session, username, msg.data)
+        return None
+    
+    async def complete_auth(self, session: Session, username: str, options: dict):
+        """
+        Đăng ký session đã xác thực và gửi trạng thái ban đầu trong một bước:
+        online_users, SUCCESS, rồi replay/giao message còn thiếu
+        options: last_seq, last_broadcast_seq, batch (giống data của AUTH)
+        """
+        client_id = session.client_id
+        # Authenticate user
+        self.sessions.authenticate(client_id, username)
         
-        elif msg_type == MessageType.LOGIN.value:
-            response_bytes = await self.auth_handler.handle_login(client_id, data)
-            response = Message.decode(response_bytes)
-            if response and response.get('data', {}).get('success'):
-                username = response['data'].get('username')
-                if username:
-                    # Lưu username mapping
-                    pass
+        # Client yêu cầu gom message outbound thành frame BATCH
+        batch_settings = None
+        if options.get('batch'):
+            session.batcher = OutboundBatcher.from_request(
+                options['batch'],
+                partial(self.write_frame, session),
+                self.batch_stats
+            )
+            batch_settings = session.batcher.settings()
         
-        elif msg_type == MessageType.LOGOUT.value:
-            response_bytes = await self.auth_handler.handle_logout(client_id)
-            response = Message.decode(response_bytes)
+        # Thông báo online sau khi authenticate thành công
+        await self.chat_handler.register_client(client_id)
         
-        elif msg_type == MessageType.CHAT.value:
-            if not self.auth_handler.is_authenticated(client_id):
-                response = {
-                    "type": "ERROR",
-                    "data": {
-                        "success": False,
-                        "message": "Bạn cần đăng nhập trước"
-                    }
-                }
-            else:
-                username = self.auth_handler.get_username(client_id)
-                response_bytes = await self.chat_handler.handle_chat(client_id, username, data)
-                response = Message.decode(response_bytes)
+        # Gửi danh sách online users cho user mới (bao gồm cả user hiện tại)
+        online_users = self.chat_handler.get_online_users()
+        await self.send_ws(session, Message.build(MessageType.ONLINE_USERS, {"users": online_users}))
         
-        elif msg_type == MessageType.FILE_REQUEST.value:
-            if not self.auth_handler.is_authenticated(client_id):
-                response = {
-                    "type": "ERROR",
-                    "data": {
-                        "success": False,
-                        "message": "Bạn cần đăng nhập trước"
-                    }
-                }
-            else:
-                username = self.auth_handler.get_username(client_id)
-                response_bytes = await self.file_handler.handle_file_request(client_id, username, data)
-                response = Message.decode(response_bytes)
+        logger.info("User đã xác thực qua JWT token", extra={"client_id": client_id, "username": username})
+        seqs = self.db.get_last_seqs([username, BROADCAST_STREAM])
+        response_data = {
+            "username": username,
+            "seq": seqs[username],
+            "broadcast_seq": seqs[BROADCAST_STREAM]
+        }
+        if batch_settings:
+            response_data["batch"] = batch_settings
+        await self.send_ws(session, Message.response(
+            MessageType.SUCCESS, True, "Xác thực thành công", response_data
+        ))
         
-        elif msg_type == MessageType.FILE_DATA.value:
-            if not self.auth_handler.is_authenticated(client_id):
-                response = {
-                    "type": "ERROR",
-                    "data": {
-                        "success": False,
-                        "message": "Bạn cần đăng nhập trước"
-                    }
-                }
-            else:
-                transfer_id = data.get('transfer_id', '')
-                response_bytes = await self.file_handler.handle_file_data(client_id, transfer_id, data)
-                response = Message.decode(response_bytes)
+        # Client reconnect gửi kèm seq đã nhận: replay phần còn thiếu sau SUCCESS
+        resumed = await self.replay_events(session, username, options.get('last_seq'),
+                                           response_data["seq"])
+        await self.replay_events(session, BROADCAST_STREAM, options.get('last_broadcast_seq'),
+                                 response_data["broadcast_seq"])
         
-        elif msg_type == "USER_LIST":
-            if not self.auth_handler.is_authenticated(client_id):
-                response = {
-                    "type": "ERROR",
-                    "data": {
-                        "success": False,
-                        "message": "Bạn cần đăng nhập trước"
-                    }
-                }
-            else:
-                users = self.auth_handler.get_all_users()
-                response = {
-                    "type": "USER_LIST",
-                    "data": {
-                        "success": True,
-                        "message": "Danh sách users",
-                        "users": users
-                    }
-                }
+        # Không resume được theo seq (login mới/RESYNC): giao các private message chưa được xác nhận
+        if not resumed:
+            await self.drain_pending_deliveries(session, username, response_data["seq"])
+    
+    async def replay_events(self, session: Session, stream: str, last_seq, current_seq: int) -> bool:
+        """
+        Gửi lại các event có seq > last_seq của một stream
+        Gửi RESYNC nếu khoảng thiếu vượt EVENT_REPLAY_LIMIT hoặc log không còn đủ event
+        Returns: True nếu client đã có đủ event của stream
+        """
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool):
+            return False
+        if last_seq >= current_seq:
+            return True
+        kind = "broadcast" if stream == BROADCAST_STREAM else "user"
         
-        else:
-            response = {
-                "type": "ERROR",
-                "data": {
-                    "success": False,
-                    "message": f"Loại message không hợp lệ: {msg_type}"
-                }
-            }
+        events = []
+        if current_seq - last_seq <= EVENT_REPLAY_LIMIT and last_seq >= 0:
+            events = self.db.get_events_since(stream, last_seq, EVENT_REPLAY_LIMIT)
         
-        # Gửi response
-        if response:
-            await ws.send_json(response)
+        if not events or events[0]["data"].get("seq") != last_seq + 1:
+            await self.send_ws(session, Message.build(MessageType.RESYNC, {
+                "stream": kind,
+                "last_seq": last_seq,
+                "seq": current_seq
+            }))
+            return False
+        
+        for event in events:
+            await self.send_ws(session, event)
+        return True
+    
+    async def drain_pending_deliveries(self, session: Session, username: str, current_seq: int):
+        """
+        Gửi hàng chờ giao của user theo từng batch lớn, tối đa PENDING_DRAIN_MAX_BATCHES batch;
+        hàng chờ có thể còn nữa (hoặc đã bị cắt ở PENDING_DELIVERY_LIMIT) thì gửi RESYNC
+        Entry chỉ bị xóa khi client gửi DELIVERY_ACK
+        """
+        after_id = 0
+        for _ in range(PENDING_DRAIN_MAX_BATCHES):
+            pending = self.db.get_pending_deliveries(username, after_id, PENDING_DRAIN_BATCH)
+            if not pending:
+                return
+            # Ghi thẳng (không qua batcher) vì đã là một frame BATCH
+            await self.write_frame(session, Message.build(MessageType.BATCH, {"messages": pending}))
+            if len(pending) < PENDING_DRAIN_BATCH:
+                return
+            after_id = pending[-1]["data"]["id"]
+        await self.send_ws(session, Message.build(MessageType.RESYNC, {
+            "stream": "user",
+            "last_seq": None,
+            "seq": current_seq
+        }))
+    
+    async def handle_register(self, msg: IncomingMessage, session: Session) -> dict:
+        return await self.auth_handler.handle_register(msg.client_id, msg.data)
+    
+    async def handle_login(self, msg: IncomingMessage, session: Session) -> dict:
+        return await self.auth_handler.handle_login(msg.client_id, msg.data)
+    
+    async def handle_logout(self, msg: IncomingMessage, session: Session) -> dict:
+        return await self.auth_handler.handle_logout(msg.client_id)
+    
+    async def handle_chat(self, msg: IncomingMessage, session: Session) -> dict:
+        return await self.chat_handler.handle_chat(msg.client_id, msg.username, msg.data)
+    
+    async def handle_file_request(self, msg: IncomingMessage, session: Session) -> dict:
+        return await self.file_handler.handle_file_request(msg.client_id, msg.username, msg.data)
+    
+    async def handle_file_data(self, msg: IncomingMessage, session: Session) -> dict:
+        transfer_id = msg.data.get('transfer_id', '')
+        return await self.file_handler.handle_file_data(msg.client_id, transfer_id, msg.data)
+    
+    async def handle_user_list(self, msg: IncomingMessage, session: Session) -> dict:
+        users = self.auth_handler.get_all_users()
+        return Message.response(MessageType.USER_LIST, True, "Danh sách users", {"users": users})
+    
+    async def handle_mark_read(self, msg: IncomingMessage, session: Session) -> dict:
+        return await self.chat_handler.handle_mark_read(msg.client_id, msg.username, msg.data)
+    
+    async def handle_sync(self, msg: IncomingMessage, session: Session) -> Optional[dict]:
+        """
+        SYNC - client thấy seq nhảy cóc (event do process khác ghi vào log, vd. REST API,
+        không được đẩy real-time): replay stream từ last_seq, hoặc RESYNC nếu không đủ
+        """
+        stream = msg.data.get('stream', 'user')
+        last_seq = msg.data.get('last_seq')
+        if stream not in ('user', 'broadcast'):
+            return Message.response(MessageType.ERROR, False, "stream phải là user hoặc broadcast")
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool) or last_seq < 0:
+            return Message.response(MessageType.ERROR, False, "last_seq không hợp lệ")
+        name = msg.username if stream == 'user' else BROADCAST_STREAM
+        current_seq = self.db.get_last_seqs([name])[name]
+        await self.replay_events(session, name, last_seq, current_seq)
+        return None
+    
+    async def handle_delivery_ack(self, msg: IncomingMessage, session: Session) -> Optional[dict]:
+        """DELIVERY_ACK - client xác nhận đã nhận các private message (theo id)"""
+        ids = msg.data.get('ids')
+        if not isinstance(ids, list) or len(ids) > MAX_ACK_IDS:
+            return Message.response(MessageType.ERROR, False, f"ids phải là danh sách tối đa {MAX_ACK_IDS} id")
+        message_ids = [i for i in ids if isinstance(i, int) and not isinstance(i, bool)]
+        self.db.ack_deliveries(msg.username, message_ids)
+        return None
     
     async def disconnect_client(self, client_id: str):
         """Xử lý khi client disconnect"""
-        if client_id in self.ws_clients:
-            username = self.auth_handler.get_username(client_id) if self.auth_handler.is_authenticated(client_id) else None
-            print(f"[{client_id}] WebSocket client {username or 'unknown'} đã ngắt kết nối")
-            
-            # Unregister từ handlers (phải làm trước khi logout để broadcast offline status)
-            if self.auth_handler.is_authenticated(client_id):
-                await self.chat_handler.unregister_client(client_id)
-                self.file_handler.unregister_client(client_id)
-                await self.auth_handler.handle_logout(client_id)
-            
-            # Đóng WebSocket
-            try:
-                ws = self.ws_clients[client_id]
-                await ws.close()
-            except:
-                pass
-            
-            # Xóa khỏi clients và callbacks
-            del self.ws_clients[client_id]
-            if hasattr(self, 'send_to_client_callbacks') and client_id in self.send_to_client_callbacks:
-                del self.send_to_client_callbacks[client_id]
+        session = self.sessions.get(client_id)
+        if session is None:
+            return
+        logger.info("WebSocket client đã ngắt kết nối", extra={"client_id": client_id, "username": session.username})
+        
+        # Broadcast offline status trước khi bỏ session
+        if session.username:
+            await self.chat_handler.unregister_client(client_id)
+        self.file_handler.unregister_client(client_id)
+        self.sessions.remove(client_id)
+        self.heartbeat.untrack(session)
+        self.rate_limiter.forget_connection(client_id)
+        
+        # Đóng connection
+        try:
+            await session.conn.close()
+        except:
+            pass
+        if session.batcher:
+            session.batcher.close()
+    
+    async def on_startup(self, app: web.Application):
+        self.heartbeat.start()
+        self.loop_monitor.start()
+        SESSIONS.set_function(lambda: len(self.sessions))
+        AUTHENTICATED_USERS.set_function(lambda: len(self.sessions.by_user))
+        REGISTRY.add_collector(self.metric_lines)
+    
+    async def on_cleanup(self, app: web.Application):
+        self.heartbeat.stop()
+        self.loop_monitor.stop()
+        self.capture.close()
+        REGISTRY.remove_collector(self.metric_lines)
     
     def get_ssl_context(self):
         """Tạo SSL context nếu có certificate"""
@@ -373,10 +666,8 @@ class WebSocketChatServer:
         """Khởi động WebSocket server"""
         ssl_context = self.get_ssl_context()
         
-        if ssl_context:
-            print(f"WebSocket Server đang khởi động với SSL tại {self.host}:{self.port}")
-        else:
-            print(f"WebSocket Server đang khởi động không SSL tại {self.host}:{self.port}")
+        logger.info("WebSocket Server đang khởi động %s SSL tại %s:%s",
+                    "với" if ssl_context else "không", self.host, self.port)
         
         runner = web.AppRunner(self.app)
         await runner.setup()
@@ -389,12 +680,19 @@ class WebSocketChatServer:
         )
         
         await site.start()
-        print(f"WebSocket Server đã sẵn sàng. Kết nối tại ws://{self.host}:{self.port}/ws")
+        logger.info("WebSocket Server đã sẵn sàng. Kết nối tại ws://%s:%s/ws", self.host, self.port)
+        
+        # Raw TCP listener dùng chung handlers với WebSocket
+        if self.tcp_port:
+            self.tcp_server = TCPChatServer(self, self.host, self.tcp_port, ssl_context=ssl_context)
+            await self.tcp_server.start()
         
         # Chạy forever
         try:
             await asyncio.Event().wait()
-        except KeyboardInterrupt:
-            print("\nĐang dừng WebSocket server...")
+        finally:
+            logger.info("Đang dừng WebSocket server...")
+            if self.tcp_server:
+                await self.tcp_server.stop()
             await runner.cleanup()
 
@@ -0,0 +1,79 @@
+"""
+Benchmark chi phí xác thực cho mỗi request
+So sánh verify JWT mỗi lần (cách cũ) với TokenVerifier có cache và auth_middleware
+Chạy: python benchmarks/bench_auth.py [--iterations N]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import jwt
+from aiohttp.test_utils import make_mocked_request
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.auth import (
+    JWT_SECRET, JWT_ALGORITHM, TokenVerifier, auth_middleware, generate_token, REQUEST_USER_KEY
+)
+
+
+def measure(label: str, fn, iterations: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    per_call = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{label:<45} {per_call:>8.2f} µs/request")
+
+
+async def measure_async(label: str, coro_factory, iterations: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await coro_factory()
+    per_call = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{label:<45} {per_call:>8.2f} µs/request")
+
+
+async def run(iterations: int):
+    token = generate_token("bench")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Cách cũ: parse header + verify chữ ký HMAC ở mỗi handler
+    def legacy():
+        auth_header = headers.get('Authorization', '')
+        payload = jwt.decode(auth_header[7:], JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        return payload.get('username')
+
+    verifier = TokenVerifier()
+    measure("jwt.decode mỗi request (cũ)", legacy, iterations)
+    measure("TokenVerifier.verify (cache hit)", lambda: verifier.verify(token), iterations)
+
+    cold = TokenVerifier(max_entries=1)
+    tokens = [generate_token(f"user{i}") for i in range(2)]
+    counter = [0]
+
+    def miss():
+        counter[0] += 1
+        cold.verify(tokens[counter[0] & 1])  # Cache 1 entry, luân phiên 2 token -> luôn miss
+    measure("TokenVerifier.verify (cache miss)", miss, iterations)
+
+    middleware = auth_middleware(verifier)
+    request = make_mocked_request('GET', '/api/auth/me', headers=headers)
+
+    async def handler(req):
+        return req[REQUEST_USER_KEY]
+
+    await measure_async("auth_middleware (cache hit)", lambda: middleware(request, handler), iterations)
+    print(verifier.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chi phí xác thực JWT')
+    parser.add_argument('--iterations', type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
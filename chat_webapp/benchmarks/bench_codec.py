@@ -0,0 +1,70 @@
+"""
+Benchmark codec: so sánh bytes trên dây và CPU mỗi message giữa JSON và binary codec
+Chạy: python benchmarks/bench_codec.py [--iterations N]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.protocol import JSON_CODEC, BINARY_CODEC
+
+# Các frame điển hình giữa server và frontend
+SAMPLE_FRAMES = {
+    "chat": {
+        "type": "PRIVATE_MESSAGE",
+        "data": {
+            "sender": "alice",
+            "receiver": "bob",
+            "message": "Chào bạn, tối nay đi ăn không?",
+            "type": "private"
+        }
+    },
+    "presence": {
+        "type": "user_online",
+        "data": {"username": "alice", "status": "online"}
+    },
+    "file_ack": {
+        "type": "FILE_ACK",
+        "data": {
+            "success": True,
+            "message": "Chunk đã được nhận",
+            "transfer_id": "6f1c2d7e-3b8a-4c55-9d0e-2a4b6c8d0e1f",
+            "chunk_index": 42,
+            "received_size": 2752512
+        }
+    },
+    "online_users": {
+        "type": "online_users",
+        "data": {"users": [f"user{i}" for i in range(50)]}
+    },
+}
+
+
+def bench(func, arg, iterations: int) -> float:
+    """Trả về thời gian trung bình (µs) mỗi lần gọi"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON vs binary codec')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'frame':<14}{'codec':<18}{'bytes':>7}{'encode µs':>12}{'decode µs':>12}")
+    for name, frame in SAMPLE_FRAMES.items():
+        for codec in (JSON_CODEC, BINARY_CODEC):
+            payload = codec.dumps(frame)
+            assert codec.loads(payload) == frame
+            encode_us = bench(codec.dumps, frame, args.iterations)
+            decode_us = bench(codec.loads, payload, args.iterations)
+            print(f"{name:<14}{codec.name:<18}{len(payload):>7}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
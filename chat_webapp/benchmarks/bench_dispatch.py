@@ -0,0 +1,75 @@
+"""
+Benchmark overhead dispatch mỗi message qua MessageRouter
+So sánh với cách cũ: handler trả về bytes rồi Message.decode lại thành dict
+Chạy: python benchmarks/bench_dispatch.py [--iterations N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.protocol import Message, MessageType, JSON_CODEC
+from backend.rate_limit import RateLimiter, RateLimit, RATE_CLASS_CONTROL
+from common import NullConnection, unthrottled_server
+
+
+async def measure(label: str, coro_factory, iterations: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await coro_factory()
+    per_call = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{label:<40} {per_call:>8.2f} µs/message")
+
+
+async def run(iterations: int):
+    server = unthrottled_server()
+    conn = NullConnection()
+    session = server.register_connection("bench", conn, JSON_CODEC)
+    server.sessions.authenticate(session.client_id, "bench")
+    anon = server.register_connection("bench", conn, JSON_CODEC)
+
+    user_list = {"type": "USER_LIST", "data": {}}
+    unknown = {"type": "NOPE", "data": {}}
+
+    await measure("dispatch USER_LIST (authenticated)",
+                  lambda: server.process_websocket_message(session, user_list, 32), iterations)
+    await measure("dispatch USER_LIST (chưa đăng nhập)",
+                  lambda: server.process_websocket_message(anon, user_list, 32), iterations)
+    await measure("dispatch type không hợp lệ",
+                  lambda: server.process_websocket_message(session, unknown, 32), iterations)
+
+    # Chi phí kiểm tra rate limit (giới hạn đủ lớn để không bị chặn)
+    unlimited = {RATE_CLASS_CONTROL: RateLimit(1e12, 1e12)}
+    server.router.rate_limiter = RateLimiter(per_connection=unlimited, per_user=unlimited)
+    await measure("dispatch USER_LIST (có rate limit)",
+                  lambda: server.process_websocket_message(session, user_list, 32), iterations)
+    server.router.rate_limiter = None
+
+    # Chi phí round-trip bytes -> dict mà router đã loại bỏ cho mỗi response
+    async def legacy_round_trip():
+        Message.decode(Message.create_response(MessageType.USER_LIST, True, "Danh sách users", {"users": ["bench"]}))
+
+    async def dict_response():
+        Message.response(MessageType.USER_LIST, True, "Danh sách users", {"users": ["bench"]})
+
+    await measure("response cũ: create_response + decode", legacy_round_trip, iterations)
+    await measure("response mới: Message.response (dict)", dict_response, iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark overhead dispatch')
+    parser.add_argument('--iterations', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
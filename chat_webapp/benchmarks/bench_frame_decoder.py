@@ -0,0 +1,113 @@
+"""
+Fuzz + throughput cho FrameDecoder (luồng length-prefixed)
+Chạy: python benchmarks/bench_frame_decoder.py [--fuzz-rounds N] [--frames N]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.protocol import (
+    Message, MessageType, FrameDecoder, FrameTooLargeError, FrameDecodeError,
+    JSON_CODEC, BINARY_CODEC
+)
+
+
+def random_message(rng: random.Random) -> dict:
+    """Tạo message ngẫu nhiên với độ dài text thay đổi"""
+    text = "".join(rng.choice("abcxyzđươ ăâ😀") for _ in range(rng.randint(0, 2000)))
+    return {"sender": f"user{rng.randint(0, 999)}", "message": text, "seq": rng.randint(0, 2**40)}
+
+
+def split_randomly(rng: random.Random, stream: bytes):
+    """Cắt stream thành các chunk có kích thước ngẫu nhiên (kể cả 0 và 1 byte)"""
+    pos = 0
+    while pos < len(stream):
+        size = rng.choice((0, 1, 2, 3, 5, rng.randint(1, 64), rng.randint(1, 8192)))
+        yield stream[pos:pos + size]
+        pos += size
+
+
+def fuzz(rounds: int, seed: int):
+    """Kiểm tra decoder cho ra đúng các message bất kể cách cắt chunk"""
+    rng = random.Random(seed)
+    for round_no in range(rounds):
+        codec = rng.choice((JSON_CODEC, BINARY_CODEC))
+        expected = [random_message(rng) for _ in range(rng.randint(1, 30))]
+        stream = b"".join(Message.encode(MessageType.CHAT, m, codec=codec) for m in expected)
+
+        decoder = FrameDecoder(codec=codec)
+        got = []
+        for chunk in split_randomly(rng, stream):
+            got.extend(decoder.feed(chunk))
+        assert [m["data"] for m in got] == expected, f"round {round_no}: sai message"
+        assert decoder.buffered == 0, f"round {round_no}: còn {decoder.buffered} bytes"
+
+        # Frame lỗi ở giữa: bỏ qua frame đó, các frame sau vẫn decode được
+        bad = (5).to_bytes(4, 'big') + b"\xff\xfe{{{"
+        good = Message.encode(MessageType.CHAT, expected[0], codec=codec)
+        decoder = FrameDecoder(codec=codec)
+        try:
+            decoder.feed(good + bad + good + bad + good)
+            raise AssertionError("thiếu FrameDecodeError")
+        except FrameDecodeError as e:
+            assert [m["data"] for m in e.messages] == [expected[0]] * 3
+            assert e.errors == 2
+        assert decoder.buffered == 0, f"round {round_no}: frame sau frame lỗi bị kẹt"
+        assert [m["data"] for m in decoder.feed(good)] == [expected[0]]
+
+        # Frame quá lớn bị từ chối ngay khi đọc header
+        decoder = FrameDecoder(codec=codec, max_frame_size=1024)
+        try:
+            decoder.feed((1025).to_bytes(4, 'big') + b"x")
+            raise AssertionError("thiếu FrameTooLargeError")
+        except FrameTooLargeError:
+            pass
+
+        # Bytes rác ngẫu nhiên không được làm decoder crash ngoài các lỗi đã khai báo
+        decoder = FrameDecoder(codec=codec, max_frame_size=4096)
+        garbage = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 256)))
+        try:
+            decoder.feed(garbage)
+        except (FrameTooLargeError, FrameDecodeError):
+            pass
+    print(f"fuzz: {rounds} rounds OK (seed={seed})")
+
+
+def throughput(frames: int, chunk_size: int):
+    """Đo số message/s và MB/s khi feed stream theo chunk cố định"""
+    rng = random.Random(1)
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        payloads = [random_message(rng) for _ in range(256)]
+        encoded = [Message.encode(MessageType.CHAT, p, codec=codec) for p in payloads]
+        stream = b"".join(encoded[i % len(encoded)] for i in range(frames))
+        chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+        decoder = FrameDecoder(codec=codec)
+        count = 0
+        start = time.perf_counter()
+        for chunk in chunks:
+            count += len(decoder.feed(chunk))
+        elapsed = time.perf_counter() - start
+        assert count == frames
+        print(f"{codec.name:<18} {frames / elapsed:>10.0f} msg/s  "
+              f"{len(stream) / elapsed / 1e6:>7.1f} MB/s  (chunk={chunk_size})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz và đo throughput FrameDecoder')
+    parser.add_argument('--fuzz-rounds', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frames', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    args = parser.parse_args()
+
+    fuzz(args.fuzz_rounds, args.seed)
+    throughput(args.frames, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark độ trễ connect -> ready (nhận SUCCESS) của WebSocket
+So sánh xác thực bằng frame AUTH đầu tiên với token gửi lúc upgrade (subprotocol)
+Chạy: python benchmarks/bench_handshake.py [--clients N] [--concurrency N]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiohttp
+
+from backend.auth import generate_token
+from backend.protocol import AUTH_SUBPROTOCOL_PREFIX, JSON_CODEC
+from common import start_site, unthrottled_server
+
+
+async def wait_ready(ws):
+    async for msg in ws:
+        if msg.type != aiohttp.WSMsgType.TEXT:
+            break
+        if msg.json().get("type") == "SUCCESS":
+            return
+    raise RuntimeError("Connection đóng trước khi nhận SUCCESS")
+
+
+async def connect_auth_frame(session, url: str, token: str) -> float:
+    start = time.perf_counter()
+    async with session.ws_connect(url, protocols=(JSON_CODEC.name,)) as ws:
+        await ws.send_json({"type": "AUTH", "data": {"token": token}})
+        await wait_ready(ws)
+        return time.perf_counter() - start
+
+
+async def connect_handshake(session, url: str, token: str) -> float:
+    start = time.perf_counter()
+    protocols = (JSON_CODEC.name, AUTH_SUBPROTOCOL_PREFIX + token)
+    async with session.ws_connect(url, protocols=protocols) as ws:
+        await wait_ready(ws)
+        return time.perf_counter() - start
+
+
+async def run_mode(name: str, connect, url: str, token: str, clients: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def one():
+            async with semaphore:
+                return await connect(session, url, token)
+
+        start = time.perf_counter()
+        latencies = sorted(await asyncio.gather(*(one() for _ in range(clients))))
+        elapsed = time.perf_counter() - start
+
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{name:<22} p50 {p50:>7.2f} ms  p95 {p95:>7.2f} ms  "
+          f"{clients / elapsed:>8.0f} connections/s ({clients} clients, concurrency {concurrency})")
+
+
+async def run(args):
+    server = unthrottled_server(host='127.0.0.1', port=0)
+    runner, port = await start_site(server.app)
+
+    server.db.register_user("bench", "bench@bench.local", "password123")
+    token = generate_token("bench")
+    url = f"http://127.0.0.1:{port}/ws"
+
+    await run_mode("frame AUTH", connect_auth_frame, url, token, args.clients, args.concurrency)
+    await run_mode("token lúc upgrade", connect_handshake, url, token, args.clients, args.concurrency)
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark độ trễ handshake WebSocket')
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark overhead của metrics (/metrics) trên hot path
+- Chi phí từng thao tác: labels(), counter.inc, histogram.observe, timer
+- Đếm số thao tác metrics mỗi message (CHAT broadcast tới N client, CHAT private, USER_LIST)
+  rồi nhân với chi phí từng thao tác, so với thời gian xử lý message
+  (so sánh bật/tắt trực tiếp bị nhiễu bởi sqlite commit lớn hơn nhiều so với 1%)
+Mục tiêu: overhead < 1% trên đường CHAT (USER_LIST chỉ để tham khảo: gần như không làm gì
+nên chi phí cố định của metrics chiếm tỷ lệ lớn)
+Chạy: python benchmarks/bench_metrics.py [--iterations N] [--clients N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend import metrics
+from backend.metrics import REGISTRY, MESSAGES_OUT, FANOUT_SECONDS
+from backend.protocol import JSON_CODEC
+from common import NullConnection, unthrottled_server
+
+TARGET_OVERHEAD = 0.01
+
+# Các thao tác được đếm: (class, method)
+OPERATIONS = {
+    "labels": (metrics._Metric, "labels"),
+    "inc": (metrics._CounterChild, "inc"),
+    "observe": (metrics._HistogramChild, "observe"),
+    "timer": (metrics._Timer, "__enter__"),
+}
+
+
+def per_call(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def measure_primitives(iterations: int) -> dict:
+    """Chi phí riêng của từng thao tác (giây)"""
+    counter = MESSAGES_OUT.labels("BENCH")
+    histogram = FANOUT_SECONDS.labels("bench")
+
+    def timed():
+        with histogram.time():
+            pass
+
+    baseline = per_call(lambda: None, iterations)
+    inc = per_call(counter.inc, iterations)
+    labels_inc = per_call(lambda: MESSAGES_OUT.labels("BENCH").inc(), iterations) - baseline
+    observe = per_call(lambda: histogram.observe(0.003), iterations) - baseline
+    timer = per_call(timed, iterations) - baseline
+    costs = {
+        "labels": max(0.0, labels_inc - inc),
+        "inc": inc,
+        "observe": observe,
+        "timer": max(0.0, timer - observe),  # observe lúc thoát timer được đếm riêng
+    }
+    for name, cost in costs.items():
+        print(f"{name:<10} {cost * 1e9:>8.0f} ns")
+    return costs
+
+
+async def count_operations(coro_factory, iterations: int) -> Counter:
+    """Số lần gọi từng thao tác metrics mỗi message (bọc tạm các method)"""
+    counts = Counter()
+    originals = {}
+    for name, (cls, attr) in OPERATIONS.items():
+        original = originals[name] = getattr(cls, attr)
+
+        def counted(*args, _name=name, _original=original, **kwargs):
+            counts[_name] += 1
+            return _original(*args, **kwargs)
+        setattr(cls, attr, counted)
+    try:
+        for _ in range(iterations):
+            await coro_factory()
+    finally:
+        for name, (cls, attr) in OPERATIONS.items():
+            setattr(cls, attr, originals[name])
+    return Counter({name: count / iterations for name, count in counts.items()})
+
+
+async def measure(label: str, coro_factory, iterations: int, costs: dict, check: bool = True):
+    await coro_factory()  # Warm-up (tạo label lần đầu)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await coro_factory()
+    elapsed = (time.perf_counter() - start) / iterations
+
+    operations = await count_operations(coro_factory, iterations)
+    overhead = sum(costs[name] * count for name, count in operations.items())
+    ratio = overhead / elapsed
+    status = ("OK" if ratio < TARGET_OVERHEAD else "VƯỢT") if check else "tham khảo"
+    detail = " ".join(f"{name}={count:g}" for name, count in sorted(operations.items()))
+    print(f"{label:<30} {elapsed * 1e6:>8.1f} µs/message  metrics {overhead * 1e6:>5.2f} µs "
+          f"= {ratio:>6.2%} [{status}]  ({detail})")
+
+
+async def run(iterations: int, clients: int):
+    print("== Chi phí một thao tác ==")
+    costs = measure_primitives(iterations * 200)
+
+    server = unthrottled_server()
+    conn = NullConnection()
+    sender = server.register_connection("bench", conn, JSON_CODEC)
+    server.sessions.authenticate(sender.client_id, "sender")
+    for i in range(clients):
+        session = server.register_connection("bench", conn, JSON_CODEC)
+        server.sessions.authenticate(session.client_id, f"user{i}")
+
+    broadcast = {"type": "CHAT", "data": {"message": "xin chào mọi người"}}
+    private = {"type": "CHAT", "data": {"message": "xin chào", "receiver": "user0"}}
+    user_list = {"type": "USER_LIST", "data": {}}
+
+    print(f"\n== Hot path ({clients} client, {iterations} message) ==")
+    await measure(f"CHAT broadcast -> {clients} client",
+                  lambda: server.process_websocket_message(sender, broadcast, 64), iterations, costs)
+    await measure("CHAT private",
+                  lambda: server.process_websocket_message(sender, private, 64), iterations, costs)
+    await measure("USER_LIST",
+                  lambda: server.process_websocket_message(sender, user_list, 32), iterations, costs,
+                  check=False)
+
+    start = time.perf_counter()
+    text = REGISTRY.render()
+    print(f"\nrender /metrics: {len(text)} bytes, {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark overhead metrics')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.iterations, args.clients))
+
+
+if __name__ == "__main__":
+    main()
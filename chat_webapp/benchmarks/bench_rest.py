@@ -0,0 +1,196 @@
+"""
+Benchmark REST trên dataset tạo bởi gen_dataset.py
+- Endpoint: get_messages (trang đầu, trang sâu, broadcast), get_conversations, search_users
+  (prefix nhiều kết quả, username cụ thể, không khớp), get_user_info
+- Mỗi endpoint: p50/p99/p999/max độ trễ, request/s và số SQL statement mỗi request
+  (đếm bằng trace callback của sqlite3 trên mọi connection, chỉ khi server chạy trong process)
+- User/conversation được chọn từ dataset theo --seed (message ngẫu nhiên -> conversation hoạt động nhiều
+  được chọn nhiều hơn), nên cùng dataset và seed cho cùng chuỗi request
+Chạy: python benchmarks/gen_dataset.py --db bench.db
+      python benchmarks/bench_rest.py --db bench.db [--requests N] [--concurrency N] [--json out.json]
+      [--compare baseline.json] [--url http://127.0.0.1:8000 (server ngoài dùng cùng database)]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiohttp
+
+from backend.admin import AdminSettings
+from backend.auth import generate_token
+from backend.loop_monitor import LoopMonitor
+from backend.rate_limit import RateLimiter
+from backend.rest_api import RESTAPIServer
+from common import start_site
+from report import percentiles, print_comparison
+
+# (endpoint, username, path)
+Request = Tuple[str, str, str]
+
+
+class QueryCounter:
+    """Đếm SQL statement của mọi connection server mở (Database.get_connection và MessageCache)"""
+
+    def __init__(self, server: RESTAPIServer):
+        self.count = 0
+        original = server.db.get_connection
+
+        def get_connection():
+            conn = original()
+            conn.set_trace_callback(self.trace)
+            return conn
+        server.db.get_connection = get_connection
+        server.message_cache._conn.set_trace_callback(self.trace)
+
+    def trace(self, statement: str):
+        self.count += 1
+
+
+def sample_requests(db_path: str, rng: random.Random, samples: int) -> List[Request]:
+    """Chọn request từ dataset: conversation theo message ngẫu nhiên, user theo rowid ngẫu nhiên"""
+    conn = sqlite3.connect(db_path)
+    max_id = conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+    users = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY id")]
+    if not max_id or not users:
+        raise SystemExit(f"{db_path} chưa có dữ liệu (tạo bằng benchmarks/gen_dataset.py)")
+
+    pairs = []
+    while len(pairs) < samples:
+        row = conn.execute(
+            "SELECT sender_username, receiver_username FROM messages WHERE id >= ? AND receiver_username IS NOT NULL "
+            "ORDER BY id LIMIT 1", (rng.randint(1, max_id),)
+        ).fetchone()
+        if row:
+            pairs.append(row)
+    conn.close()
+
+    requests: List[Request] = []
+    for sender, receiver in pairs:
+        other = rng.choice(users)
+        requests += [
+            ("messages", sender, f"/api/chat/messages?receiver={receiver}&limit=50"),
+            ("messages_deep_page", sender, f"/api/chat/messages?receiver={receiver}&limit=50&offset=500"),
+            ("messages_broadcast", sender, "/api/chat/messages?limit=50"),
+            ("conversations", sender, "/api/chat/conversations"),
+            ("search_prefix", sender, f"/api/users/search?q={other[:-3]}"),
+            ("search_exact", sender, f"/api/users/search?q={other}"),
+            ("search_miss", sender, "/api/users/search?q=khong-ton-tai"),
+            ("user_info", sender, f"/api/users/{other}"),
+        ]
+    return requests
+
+
+async def run_endpoint(http: aiohttp.ClientSession, base_url: str, requests: List[Request], total: int,
+                       concurrency: int, tokens: Dict[str, str], counter: QueryCounter = None) -> dict:
+    latencies = []
+    statuses = {}
+    queue = iter(requests[i % len(requests)] for i in range(total))
+
+    async def worker():
+        for _, username, path in queue:
+            start = time.perf_counter()
+            async with http.get(base_url + path, headers={"Authorization": f"Bearer {tokens[username]}"}) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    queries_before = counter.count if counter else 0
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    result = percentiles(latencies)
+    result["requests_per_s"] = round(total / elapsed, 1)
+    if counter:
+        result["queries_per_request"] = round((counter.count - queries_before) / total, 2)
+    result["status"] = {str(status): count for status, count in sorted(statuses.items())}
+    return result
+
+
+async def run(args, db_path: str) -> dict:
+    rng = random.Random(args.seed)
+    requests = sample_requests(db_path, rng, args.samples)
+    tokens = {username: generate_token(username) for _, username, _ in requests}
+
+    runner = counter = None
+    base_url = args.url
+    if base_url is None:
+        # Server dùng chat_app.db trong thư mục làm việc: trỏ tới dataset
+        os.symlink(db_path, "chat_app.db")
+        server = RESTAPIServer(rate_limiter=RateLimiter(enabled=False), loop_monitor=LoopMonitor(enabled=False),
+                               admin=AdminSettings(enabled=False))
+        counter = QueryCounter(server)
+        runner, port = await start_site(server.app)
+        base_url = f"http://127.0.0.1:{port}"
+
+    endpoints: Dict[str, List[Request]] = {}
+    for request in requests:
+        endpoints.setdefault(request[0], []).append(request)
+
+    results = {}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        for name, endpoint_requests in endpoints.items():
+            await run_endpoint(http, base_url, endpoint_requests, args.warmup, args.concurrency, tokens)
+            results[name] = await run_endpoint(http, base_url, endpoint_requests, args.requests,
+                                               args.concurrency, tokens, counter)
+            stats = results[name]
+            queries = f"{stats['queries_per_request']:>6.2f} query/req" if counter else ""
+            print(f"{name:<20} p50 {stats['p50']:>8.2f}  p99 {stats['p99']:>8.2f}  p999 {stats['p999']:>8.2f} ms  "
+                  f"{stats['requests_per_s']:>8.1f} req/s  {queries}  {stats['status']}")
+
+    if runner is not None:
+        await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark REST endpoint trên dataset lớn')
+    parser.add_argument('--db', default='bench_dataset.db', help='Dataset tạo bởi gen_dataset.py')
+    parser.add_argument('--url', default=None, help='REST server có sẵn (mặc định chạy trong process)')
+    parser.add_argument('--requests', type=int, default=500, help='Số request đo mỗi endpoint')
+    parser.add_argument('--warmup', type=int, default=50, help='Số request warm-up mỗi endpoint')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--samples', type=int, default=100, help='Số conversation/user lấy mẫu từ dataset')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', dest='json_path', default=None, help='Ghi kết quả ra file JSON')
+    parser.add_argument('--compare', default=None, help='File JSON của lần chạy trước để so sánh')
+    args = parser.parse_args()
+
+    db_path = Path(args.db).resolve()
+    if not db_path.exists():
+        parser.error(f"{db_path} không tồn tại (tạo bằng benchmarks/gen_dataset.py)")
+    meta_path = db_path.with_suffix(".dataset.json")
+    dataset = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+    json_path = Path(args.json_path).resolve() if args.json_path else None
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = asyncio.run(run(args, str(db_path)))
+
+    report = {
+        "dataset": dataset,
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "samples": args.samples,
+                   "seed": args.seed, "in_process": args.url is None},
+        "results": results,
+    }
+    if baseline:
+        print_comparison(baseline, report)
+    if json_path:
+        json_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"\nĐã ghi {json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark bộ nhớ cho trạng thái mỗi connection
+So sánh cách cũ (5 dict song song {client_id: ...} + closure send_to_client mỗi connection)
+với Session __slots__ trong SessionRegistry. Không tính object websocket/compressor (giống nhau ở cả hai)
+Chạy: python benchmarks/bench_sessions.py [--sessions 10000 100000]
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.protocol import JSON_CODEC
+from backend.session import SessionRegistry
+from common import NullConnection
+
+
+def build_legacy(count: int, conn):
+    """Layout cũ: ws_clients, ws_codecs, send_to_client_callbacks, authenticated_users, ChatHandler/FileHandler.clients"""
+    ws_clients, ws_codecs, callbacks, authenticated_users = {}, {}, {}, {}
+    chat_clients, file_clients = {}, {}
+    for n in range(count):
+        client_id = f"ws_client_{n}"
+        ws_clients[client_id] = conn
+        ws_codecs[client_id] = JSON_CODEC
+
+        async def send_to_client(data, client_id=client_id, ws=conn):
+            pass
+        callbacks[client_id] = send_to_client
+        authenticated_users[client_id] = f"user{n}"
+        chat_clients[client_id] = send_to_client
+        file_clients[client_id] = send_to_client
+    return ws_clients, ws_codecs, callbacks, authenticated_users, chat_clients, file_clients
+
+
+def build_sessions(count: int, conn):
+    registry = SessionRegistry()
+    for n in range(count):
+        session = registry.create("ws_client", conn, JSON_CODEC)
+        registry.authenticate(session.client_id, f"user{n}")
+    return registry
+
+
+def measure(build, count: int, conn) -> float:
+    """Số byte cấp phát thêm cho mỗi connection (tracemalloc)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = build(count, conn)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del state
+    gc.collect()
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bộ nhớ mỗi connection')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    conn = NullConnection()
+    for count in args.sessions:
+        legacy = measure(build_legacy, count, conn)
+        sessions = measure(build_sessions, count, conn)
+        print(f"{count:>7} connections  dict song song {legacy:>7.0f} B/connection  "
+              f"Session {sessions:>7.0f} B/connection  ({(1 - sessions / legacy) * 100:.0f}% ít hơn)")
+
+
+if __name__ == "__main__":
+    main()
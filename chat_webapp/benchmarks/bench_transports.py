@@ -0,0 +1,124 @@
+"""
+Benchmark so sánh messages/s giữa WebSocket và raw TCP transport
+Khởi động WebSocketChatServer + TCP listener trong cùng process (thư mục tạm),
+mỗi client AUTH bằng JWT rồi gửi USER_LIST request/response liên tục.
+Chạy: python benchmarks/bench_transports.py [--clients N] [--requests N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiohttp
+import jwt
+
+from backend.protocol import FrameDecoder, JSON_CODEC, BINARY_CODEC
+from backend.tcp_server import TCPChatServer
+from backend.auth import JWT_SECRET, JWT_ALGORITHM
+from common import start_site, unthrottled_server
+
+USER_LIST = {"type": "USER_LIST", "data": {}}
+
+
+def make_token(username: str) -> str:
+    return jwt.encode({"username": username}, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+async def ws_client(url: str, token: str, requests: int, codec) -> int:
+    protocols = (codec.name,)
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url, protocols=protocols) as ws:
+            async def send(message):
+                if codec.binary:
+                    await ws.send_bytes(codec.dumps(message))
+                else:
+                    await ws.send_str(codec.dumps(message).decode('utf-8'))
+
+            async def receive():
+                msg = await ws.receive()
+                return codec.loads(msg.data) if codec.binary else codec.loads(msg.data.encode('utf-8'))
+
+            await send({"type": "AUTH", "data": {"token": token}})
+            while (await receive()).get("type") != "SUCCESS":
+                pass
+            for _ in range(requests):
+                await send(USER_LIST)
+                while (await receive()).get("type") != "USER_LIST":
+                    pass
+    return requests
+
+
+async def tcp_client(host: str, port: int, token: str, requests: int, codec) -> int:
+    reader, writer = await asyncio.open_connection(host, port)
+    decoder = FrameDecoder(codec=codec)
+    pending = []
+
+    def send(message):
+        payload = codec.dumps(message)
+        writer.write(len(payload).to_bytes(4, 'big') + payload)
+
+    async def receive():
+        while not pending:
+            pending.extend(decoder.feed(await reader.read(65536)))
+        return pending.pop(0)
+
+    send({"type": "AUTH", "data": {"token": token}})
+    while (await receive()).get("type") != "SUCCESS":
+        pass
+    for _ in range(requests):
+        send(USER_LIST)
+        while (await receive()).get("type") != "USER_LIST":
+            pass
+    writer.close()
+    return requests
+
+
+async def run(args):
+    server = unthrottled_server(host='127.0.0.1', port=0)
+    runner, ws_port = await start_site(server.app)
+    tcp_server = TCPChatServer(server, '127.0.0.1', 0)
+    await tcp_server.start()
+    tcp_port = tcp_server.server.sockets[0].getsockname()[1]
+
+    tokens = []
+    for i in range(args.clients):
+        username = f"bench{i}"
+        server.db.register_user(username, f"{username}@bench.local", "password123")
+        tokens.append(make_token(username))
+
+    url = f"http://127.0.0.1:{ws_port}/ws"
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        for name, factory in (
+            ("websocket", lambda t: ws_client(url, t, args.requests, codec)),
+            ("tcp", lambda t: tcp_client('127.0.0.1', tcp_port, t, args.requests, codec)),
+        ):
+            start = time.perf_counter()
+            done = await asyncio.gather(*(factory(t) for t in tokens))
+            elapsed = time.perf_counter() - start
+            total = sum(done)
+            print(f"{name:<10} {codec.name:<18} {total / elapsed:>10.0f} msg/s "
+                  f"({args.clients} clients x {args.requests} requests, {elapsed:.2f}s)")
+            await asyncio.sleep(0.2)
+
+    await tcp_server.stop()
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WebSocket vs raw TCP')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
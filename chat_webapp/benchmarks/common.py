@@ -0,0 +1,39 @@
+"""
+Tiện ích dùng chung cho các benchmark: connection giả và server chạy trong process
+(script benchmark đã thêm thư mục gốc vào sys.path trước khi import module này)
+"""
+from typing import Tuple
+
+from aiohttp import web
+
+from backend.admission import AdmissionSettings
+from backend.rate_limit import RateLimiter
+from backend.websocket_server import WebSocketChatServer
+
+
+class NullConnection:
+    """Connection giả, bỏ qua mọi message gửi đi"""
+
+    async def send_json(self, message):
+        pass
+
+    async def send_bytes(self, payload):
+        pass
+
+    async def close(self):
+        pass
+
+
+def unthrottled_server(**kwargs) -> WebSocketChatServer:
+    """WebSocketChatServer để đo throughput/độ trễ thuần: tắt rate limit và admission control"""
+    kwargs.setdefault("rate_limiter", RateLimiter(enabled=False))
+    kwargs.setdefault("admission", AdmissionSettings(enabled=False))
+    return WebSocketChatServer(**kwargs)
+
+
+async def start_site(app: web.Application) -> Tuple[web.AppRunner, int]:
+    """Chạy app trên 127.0.0.1 với port ngẫu nhiên; trả về (runner, port), caller gọi runner.cleanup()"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner, runner.addresses[0][1]
@@ -0,0 +1,179 @@
+"""
+Tạo dataset SQLite giống thực tế cho benchmark REST (get_messages, get_conversations, search_users, ...)
+- Ghi qua Database (create_users, save_messages) theo batch lớn, đủ cho hàng chục triệu message
+- Đồ thị conversation lệch: user phổ biến (theo rank, trọng số 1/rank^skew) được nhiều người chat cùng
+- Số message mỗi cặp theo phân phối mũ quanh --messages-per-pair; message được rải theo thời gian
+  (id tăng cùng timestamp), các conversation xen kẽ nhau như dữ liệu thật
+- Tỷ lệ broadcast và file đính kèm cấu hình được
+Cùng tham số và --seed cho cùng dataset; tham số và số lượng được ghi vào <db>.dataset.json
+Chạy: python benchmarks/gen_dataset.py --db bench.db [--users N] [--pairs-per-user N]
+      [--messages-per-pair N] [--skew S] [--attachment-ratio R] [--broadcast-ratio R] [--seed N]
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bcrypt
+
+from backend.database import Database
+
+USER_PREFIX = "user"
+PASSWORD = "password123"
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+WORDS = (
+    "xin chào bạn mình hôm nay ngày mai đi ăn cơm uống cà phê họp dự án code review deploy "
+    "lỗi sửa xong chưa ok cảm ơn nhé được không gửi file báo cáo tuần này tối nay gặp lúc mấy giờ"
+).split()
+ATTACHMENTS = ("report.pdf", "photo.jpg", "slides.pptx", "notes.txt", "data.csv", "archive.zip")
+
+
+def username(index: int) -> str:
+    return f"{USER_PREFIX}{index:07d}"
+
+
+def popularity_weights(users: int, skew: float) -> list:
+    """Trọng số tích lũy theo rank (user 0 phổ biến nhất), dùng cho random.choices/bisect"""
+    return list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(users)))
+
+
+def build_pairs(rng: random.Random, users: int, pairs_per_user: float, skew: float) -> list:
+    """Các cặp (a, b) đã chat với nhau: mỗi user chọn peer theo độ phổ biến"""
+    cumulative = popularity_weights(users, skew)
+    total = cumulative[-1]
+    pairs = set()
+    # Mỗi cặp được đếm cho cả hai user nên mỗi user chủ động chọn pairs_per_user / 2 peer
+    for a in range(users):
+        degree = max(1, round(rng.expovariate(2.0 / pairs_per_user)))
+        for _ in range(degree):
+            b = bisect(cumulative, rng.random() * total)
+            if b != a and b < users:
+                pairs.add((a, b) if a < b else (b, a))
+    return sorted(pairs)
+
+
+def message_text(rng: random.Random) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(2, 25)))
+
+
+def generate_messages(rng: random.Random, args, pairs: list, start: datetime):
+    """
+    Sinh (sender, receiver, message, message_type, file_path, timestamp) theo thứ tự thời gian
+    Mỗi message chọn một cặp theo trọng số (số message của cặp), nên các conversation xen kẽ
+    """
+    weights = [rng.expovariate(1.0 / args.messages_per_pair) for _ in pairs]
+    cumulative = list(itertools.accumulate(weights))
+    private_total = round(sum(weights))
+    total = round(private_total / (1 - args.broadcast_ratio)) if args.broadcast_ratio < 1 else private_total
+    broadcast_senders = popularity_weights(args.users, args.skew)
+    step = timedelta(days=args.days).total_seconds() / max(1, total)
+
+    for i in range(total):
+        timestamp = (start + timedelta(seconds=i * step)).strftime(TIMESTAMP_FORMAT)
+        if rng.random() < args.broadcast_ratio:
+            sender = username(bisect(broadcast_senders, rng.random() * broadcast_senders[-1]))
+            receiver = None
+        else:
+            a, b = pairs[min(len(pairs) - 1, bisect(cumulative, rng.random() * cumulative[-1]))]
+            if rng.random() < 0.5:
+                a, b = b, a
+            sender, receiver = username(a), username(b)
+        if rng.random() < args.attachment_ratio:
+            filename = rng.choice(ATTACHMENTS)
+            yield (sender, receiver, f"File: {filename}", 'file',
+                   f"uploads/{rng.getrandbits(64):016x}_{filename}", timestamp)
+        else:
+            yield sender, receiver, message_text(rng), 'text', None, timestamp
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def generate(args) -> dict:
+    rng = random.Random(args.seed)
+    db_path = Path(args.db)
+    if db_path.exists():
+        if not args.force:
+            raise SystemExit(f"{db_path} đã tồn tại (dùng --force để ghi đè)")
+        db_path.unlink()
+    db = Database(str(db_path))
+    start = datetime(2024, 1, 1)
+
+    started = time.perf_counter()
+    # Một hash bcrypt dùng chung: mọi user đăng nhập được bằng PASSWORD
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    users = 0
+    for batch in batched(((username(i), f"{username(i)}@example.com", password_hash,
+                           (start + timedelta(minutes=i)).strftime(TIMESTAMP_FORMAT))
+                          for i in range(args.users)), args.batch):
+        users += db.create_users(batch)
+    print(f"{users} user ({time.perf_counter() - started:.1f} s)")
+
+    pairs = build_pairs(rng, args.users, args.pairs_per_user, args.skew)
+    print(f"{len(pairs)} conversation")
+
+    messages = 0
+    for batch in batched(generate_messages(rng, args, pairs, start), args.batch):
+        messages += db.save_messages(batch)
+        elapsed = time.perf_counter() - started
+        print(f"\r{messages} message ({messages / elapsed:,.0f} row/s)", end="", flush=True)
+    print()
+
+    conn = db.get_connection()
+    counts = {
+        "users": users,
+        "conversations": len(pairs),
+        "messages": messages,
+        "broadcast_messages": conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE receiver_username IS NULL").fetchone()[0],
+        "file_messages": conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE message_type = 'file'").fetchone()[0],
+    }
+    conn.execute("ANALYZE")
+    conn.close()
+    return {
+        "params": {key: value for key, value in vars(args).items() if key not in ("db", "force")},
+        "counts": counts,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tạo dataset SQLite cho benchmark REST')
+    parser.add_argument('--db', default='bench_dataset.db', help='File database (default: bench_dataset.db)')
+    parser.add_argument('--force', action='store_true', help='Ghi đè file database đã có')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--pairs-per-user', type=float, default=10.0, help='Số conversation trung bình mỗi user')
+    parser.add_argument('--messages-per-pair', type=float, default=50.0, help='Số message trung bình mỗi conversation')
+    parser.add_argument('--skew', type=float, default=1.1, help='Độ lệch độ phổ biến (0 = đều)')
+    parser.add_argument('--attachment-ratio', type=float, default=0.02, help='Tỷ lệ message có file')
+    parser.add_argument('--broadcast-ratio', type=float, default=0.01, help='Tỷ lệ message broadcast')
+    parser.add_argument('--days', type=float, default=365.0, help='Khoảng thời gian rải message')
+    parser.add_argument('--batch', type=int, default=50000, help='Số row mỗi transaction')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if not 0 <= args.broadcast_ratio < 1 or not 0 <= args.attachment_ratio <= 1:
+        parser.error("--broadcast-ratio phải trong [0, 1), --attachment-ratio trong [0, 1]")
+
+    summary = generate(args)
+    meta_path = Path(args.db).with_suffix(".dataset.json")
+    meta_path.write_text(json.dumps(summary, indent=2))
+    print(f"{json.dumps(summary['counts'])} -> {args.db} ({summary['seconds']} s), {meta_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+"""
+Load test WebSocket: hàng nghìn client giả lập trên asyncio
+- Server chạy trong process (mặc định, tắt rate limit/admission) hoặc server có sẵn qua --url
+  (chạy trong process thì client và server chia CPU, RSS là của cả hai; số liệu chính xác hơn
+  khi chạy server riêng: python main_websocket.py --no-rate-limit ... rồi --url ws://127.0.0.1:8080/ws)
+- Mỗi client xác thực thật bằng JWT (frame AUTH, hoặc token lúc upgrade với --upgrade-auth)
+  rồi gửi theo tỷ lệ --mix: private, broadcast, presence (ngắt rồi kết nối lại), file (FILE_REQUEST + chunk)
+- Độ trễ giao end-to-end: timestamp gửi nằm trong nội dung message, client nhận tính hiệu số
+  (private giao lúc receiver offline được tính riêng: private_offline)
+- Báo cáo: throughput, p50/p99/p999 độ trễ giao, connect -> ready, RSS server; --json để so sánh các lần chạy
+Chạy: python benchmarks/load_ws.py [--clients N] [--duration S] [--rate R] [--mix private=70,broadcast=5,...]
+      [--url ws://host:port/ws] [--json out.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiohttp
+import bcrypt
+
+from backend.admin import process_state
+from backend.auth import generate_token
+from backend.database import Database
+from backend.protocol import AUTH_SUBPROTOCOL_PREFIX, JSON_CODEC
+from backend.websocket_server import MAX_ACK_IDS
+from common import start_site, unthrottled_server
+from report import percentiles, print_comparison
+
+DEFAULT_MIX = "private=70,broadcast=5,presence=5,file=20"
+ACTIONS = ("private", "broadcast", "presence", "file")
+LATENCY_TAG = "load"
+USER_PREFIX = "load"
+PASSWORD = "password123"
+RSS_INTERVAL = 1.0
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """"private=70,broadcast=5" -> {"private": 70.0, "broadcast": 5.0, ...} (action thiếu = 0)"""
+    weights = dict.fromkeys(ACTIONS, 0.0)
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in weights or not weight:
+            raise argparse.ArgumentTypeError(f"Cần dạng action=weight với action trong {ACTIONS}: {part}")
+        weights[name] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError("Tổng weight phải > 0")
+    return weights
+
+
+def seed_users(db: Database, usernames: List[str]):
+    """Tạo user cho client giả lập (WS kiểm tra user tồn tại khi xác thực), dùng chung một hash"""
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    db.create_users((username, f"{username}@load.local", password_hash, created_at) for username in usernames)
+
+
+class Recorder:
+    """Kết quả dùng chung của mọi client; chỉ ghi message gửi trong cửa sổ đo (sau warm-up)"""
+
+    def __init__(self):
+        self.window_start = float("inf")
+        self.window_end = float("inf")
+        self.sent = Counter()
+        self.delivered = Counter()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.connect: Dict[str, List[float]] = defaultdict(list)
+        self.errors = Counter()
+
+    def in_window(self, timestamp: float) -> bool:
+        return self.window_start <= timestamp < self.window_end
+
+
+class SimClient:
+    """Một client giả lập: kết nối, xác thực, đọc message và gửi theo mix"""
+
+    def __init__(self, index: int, args, http: aiohttp.ClientSession, recorder: Recorder):
+        self.username = f"{USER_PREFIX}{index}"
+        self.token = generate_token(self.username)
+        self.args = args
+        self.http = http
+        self.recorder = recorder
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self.reader: Optional[asyncio.Task] = None
+        self.ready: Optional[asyncio.Future] = None
+        self.file_request: Optional[asyncio.Future] = None
+        self.file_started = 0.0
+        self.connected_at = 0.0
+
+    async def connect(self, kind: str = "connect"):
+        """Kết nối và chờ SUCCESS của xác thực; ghi thời gian connect -> ready"""
+        start = time.perf_counter()
+        protocols = [JSON_CODEC.name]
+        if self.args.upgrade_auth:
+            protocols.append(AUTH_SUBPROTOCOL_PREFIX + self.token)
+        url = self.args.url + (f"?batch_ms={self.args.batch_ms}" if self.args.batch_ms else "")
+        self.ws = await self.http.ws_connect(url, protocols=protocols, max_msg_size=0)
+        self.ready = asyncio.get_running_loop().create_future()
+        self.reader = asyncio.create_task(self.read_loop(self.ws))
+        if not self.args.upgrade_auth:
+            auth = {"token": self.token}
+            if self.args.batch_ms:
+                auth["batch"] = {"max_delay_ms": self.args.batch_ms}
+            await self.ws.send_json({"type": "AUTH", "data": auth})
+        await asyncio.wait_for(self.ready, self.args.connect_timeout)
+        self.connected_at = time.perf_counter()
+        self.recorder.connect[kind].append(self.connected_at - start)
+
+    async def disconnect(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await self.reader
+        self.ws = self.reader = None
+
+    async def read_loop(self, ws):
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                now = time.perf_counter()
+                message = json.loads(msg.data)
+                messages = message["data"]["messages"] if message["type"] == "BATCH" else (message,)
+                ack_ids = []
+                for item in messages:
+                    self.on_message(item, now, ack_ids)
+                for i in range(0, len(ack_ids), MAX_ACK_IDS):
+                    await ws.send_json({"type": "DELIVERY_ACK", "data": {"ids": ack_ids[i:i + MAX_ACK_IDS]}})
+        except (aiohttp.ClientError, ConnectionResetError):
+            self.recorder.errors["connection"] += 1
+        finally:
+            if self.ready is not None and not self.ready.done():
+                self.ready.set_exception(RuntimeError("Connection đóng trước khi nhận SUCCESS"))
+            if self.file_request is not None and not self.file_request.done():
+                self.file_request.cancel()
+
+    def on_message(self, message: dict, now: float, ack_ids: list):
+        kind = message.get("type")
+        data = message.get("data") or {}
+        if kind == "PRIVATE_MESSAGE":
+            if "id" in data:
+                ack_ids.append(data["id"])
+            if data.get("receiver") == self.username and data.get("sender") != self.username:
+                self.record_delivery("private", data.get("message", ""), now)
+        elif kind == "BROADCAST":
+            self.record_delivery("broadcast", data.get("message", ""), now)
+        elif kind == "SUCCESS":
+            action = data.get("action")
+            if action is None and self.ready is not None and not self.ready.done():
+                self.ready.set_result(None)
+            elif action == "file_request" and self.file_request is not None and not self.file_request.done():
+                self.file_request.set_result(data["transfer_id"])
+            elif action == "file_complete" and self.recorder.in_window(self.file_started):
+                self.recorder.delivered["file"] += 1
+                self.recorder.latencies["file"].append(now - self.file_started)
+        elif kind == "ERROR":
+            self.recorder.errors[data.get("message", "error")] += 1
+            if self.ready is not None and not self.ready.done():
+                self.ready.set_exception(RuntimeError(data.get("message", "ERROR")))
+            if self.file_request is not None and not self.file_request.done():
+                self.file_request.cancel()
+
+    def record_delivery(self, kind: str, text: str, now: float):
+        tag, _, sent_at = text.partition(" ")
+        if tag != LATENCY_TAG:
+            return
+        sent_at = float(sent_at)
+        if not self.recorder.in_window(sent_at):
+            return
+        if kind == "private" and sent_at < self.connected_at:
+            kind = "private_offline"  # Gửi lúc receiver offline, giao khi kết nối lại
+        self.recorder.delivered[kind] += 1
+        self.recorder.latencies[kind].append(now - sent_at)
+
+    async def send_chat(self, kind: str, receiver: str = None):
+        sent_at = time.perf_counter()
+        data = {"message": f"{LATENCY_TAG} {sent_at:.6f}"}
+        if receiver:
+            data["receiver"] = receiver
+        await self.ws.send_json({"type": "CHAT", "data": data})
+        if self.recorder.in_window(sent_at):
+            self.recorder.sent[kind] += 1
+
+    async def send_file(self, receiver: str):
+        """FILE_REQUEST, chờ transfer_id rồi gửi các chunk (không chờ FILE_ACK)"""
+        chunk = base64.b64encode(os.urandom(self.args.file_chunk_size)).decode()
+        chunks = self.args.file_chunks
+        self.file_started = time.perf_counter()
+        self.file_request = asyncio.get_running_loop().create_future()
+        await self.ws.send_json({"type": "FILE_REQUEST", "data": {
+            "filename": "load.bin", "size": self.args.file_chunk_size * chunks, "receiver": receiver}})
+        try:
+            transfer_id = await asyncio.wait_for(self.file_request, self.args.connect_timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            self.recorder.errors["file_request"] += 1
+            return
+        for index in range(chunks):
+            await self.ws.send_json({"type": "FILE_DATA", "data": {
+                "transfer_id": transfer_id, "data": chunk, "chunk_index": index, "is_last": index == chunks - 1}})
+        if self.recorder.in_window(self.file_started):
+            self.recorder.sent["file"] += 1
+
+    async def drive(self, peers: List[str], weights: Dict[str, float], until: float):
+        """Gửi theo phân phối Poisson (trung bình --rate action/giây) tới khi hết thời gian"""
+        actions, action_weights = list(weights), list(weights.values())
+        while True:
+            delay = random.expovariate(self.args.rate)
+            if time.perf_counter() + delay >= until:
+                return
+            await asyncio.sleep(delay)
+            action = random.choices(actions, action_weights)[0]
+            try:
+                if action == "presence":
+                    await self.disconnect()
+                    await asyncio.sleep(self.args.churn_pause)
+                    await self.connect("reconnect")
+                elif self.ws is None or self.ws.closed:
+                    await self.connect("reconnect")
+                elif action == "broadcast":
+                    await self.send_chat("broadcast")
+                else:
+                    receiver = random.choice(peers)
+                    while receiver == self.username and len(peers) > 1:
+                        receiver = random.choice(peers)
+                    if action == "private":
+                        await self.send_chat("private", receiver)
+                    else:
+                        await self.send_file(receiver)
+            except (aiohttp.ClientError, ConnectionResetError, RuntimeError, asyncio.TimeoutError) as e:
+                self.recorder.errors[type(e).__name__] += 1
+
+
+class RssSampler:
+    """Lấy RSS server mỗi giây: trong process đọc /proc, server ngoài qua GET /admin/state"""
+
+    def __init__(self, args, http: aiohttp.ClientSession, in_process: bool):
+        self.http = http
+        self.in_process = in_process
+        self.admin_url = args.url.replace("ws://", "http://").replace("wss://", "https://").rsplit("/", 1)[0] \
+            + "/admin/state"
+        self.headers = {"X-Admin-Token": args.admin_token} if args.admin_token else {}
+        self.samples: List[int] = []
+        self.task: Optional[asyncio.Task] = None
+
+    async def sample(self) -> Optional[int]:
+        if self.in_process:
+            return process_state()["rss_kb"]
+        try:
+            async with self.http.get(self.admin_url, headers=self.headers) as response:
+                if response.status != 200:
+                    return None
+                return (await response.json())["process"]["rss_kb"]
+        except aiohttp.ClientError:
+            return None
+
+    async def run(self):
+        while True:
+            rss_kb = await self.sample()
+            if rss_kb is not None:
+                self.samples.append(rss_kb)
+            await asyncio.sleep(RSS_INTERVAL)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> dict:
+        self.task.cancel()
+        rss_kb = await self.sample()
+        if rss_kb is not None:
+            self.samples.append(rss_kb)
+        if not self.samples:
+            return {"available": False}
+        return {"available": True, "start_kb": self.samples[0], "end_kb": self.samples[-1],
+                "peak_kb": max(self.samples), "includes_clients": self.in_process}
+
+
+async def connect_all(clients: List[SimClient], concurrency: int, recorder: Recorder):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(client: SimClient):
+        async with semaphore:
+            try:
+                await client.connect()
+            except (aiohttp.ClientError, RuntimeError, asyncio.TimeoutError, OSError) as e:
+                recorder.errors[f"connect:{type(e).__name__}"] += 1
+
+    await asyncio.gather(*(one(client) for client in clients))
+
+
+async def run_load(args) -> dict:
+    in_process = args.url is None
+    usernames = [f"{USER_PREFIX}{i}" for i in range(args.clients)]
+    runner = None
+    if args.db:
+        seed_users(Database(args.db), usernames)
+    if in_process:
+        server = unthrottled_server(host='127.0.0.1', port=0)
+        runner, port = await start_site(server.app)
+        args.url = f"ws://127.0.0.1:{port}/ws"
+        seed_users(server.db, usernames)
+
+    recorder = Recorder()
+    weights = parse_mix(args.mix)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        rss = RssSampler(args, http, in_process)
+        rss.start()
+        clients = [SimClient(i, args, http, recorder) for i in range(args.clients)]
+        peers = usernames
+
+        start = time.perf_counter()
+        await connect_all(clients, args.connect_concurrency, recorder)
+        ramp = time.perf_counter() - start
+        connected = sum(1 for client in clients if client.ws is not None and not client.ws.closed)
+        print(f"Đã kết nối {connected}/{args.clients} client trong {ramp:.2f} s ({args.url})")
+
+        now = time.perf_counter()
+        recorder.window_start = now + args.warmup
+        recorder.window_end = recorder.window_start + args.duration
+        await asyncio.gather(*(client.drive(peers, weights, recorder.window_end) for client in clients))
+        await asyncio.sleep(args.drain)  # Chờ message còn đang trên đường giao
+
+        rss_kb = await rss.stop()
+        await asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True)
+
+    if runner is not None:
+        await runner.cleanup()
+
+    sent = dict(recorder.sent)
+    delivered = dict(recorder.delivered)
+    return {
+        "config": {
+            "clients": args.clients, "duration": args.duration, "warmup": args.warmup, "rate": args.rate,
+            "mix": weights, "batch_ms": args.batch_ms, "upgrade_auth": args.upgrade_auth,
+            "file_chunk_size": args.file_chunk_size, "file_chunks": args.file_chunks,
+            "in_process": in_process,
+        },
+        "results": {
+            "connected": connected,
+            "ramp_seconds": round(ramp, 3),
+            "sent": sent,
+            "delivered": delivered,
+            "throughput": {
+                "sent_per_s": round(sum(sent.values()) / args.duration, 1),
+                "delivered_per_s": round(sum(delivered.values()) / args.duration, 1),
+            },
+            "latency_ms": {kind: percentiles(values) for kind, values in sorted(recorder.latencies.items())},
+            "connect_ms": {kind: percentiles(values) for kind, values in sorted(recorder.connect.items())},
+            "errors": dict(recorder.errors),
+            "rss": rss_kb,
+        },
+    }
+
+
+def print_report(report: dict):
+    results = report["results"]
+    throughput = results["throughput"]
+    print(f"\nGửi: {results['sent']}  ({throughput['sent_per_s']}/s)")
+    print(f"Nhận: {results['delivered']}  ({throughput['delivered_per_s']}/s)")
+    for title, group in (("Độ trễ giao", results["latency_ms"]), ("Connect -> ready", results["connect_ms"])):
+        print(f"\n== {title} (ms) ==")
+        for kind, stats in group.items():
+            if stats["count"]:
+                print(f"{kind:<16} n={stats['count']:<8} p50 {stats['p50']:>8.2f}  p99 {stats['p99']:>8.2f}  "
+                      f"p999 {stats['p999']:>8.2f}  max {stats['max']:>8.2f}")
+    rss = results["rss"]
+    if rss.get("available"):
+        note = " (gồm cả client, server chạy trong process)" if rss["includes_clients"] else ""
+        print(f"\nRSS: {rss['start_kb'] / 1024:.1f} -> {rss['end_kb'] / 1024:.1f} MB, "
+              f"peak {rss['peak_kb'] / 1024:.1f} MB{note}")
+    if results["errors"]:
+        print(f"Lỗi: {results['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test WebSocket với client giả lập')
+    parser.add_argument('--url', default=None, help='ws://host:port/ws của server có sẵn (mặc định chạy trong process)')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--connect-timeout', type=float, default=30.0)
+    parser.add_argument('--duration', type=float, default=30.0, help='Thời gian đo (giây)')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Bỏ qua kết quả các giây đầu')
+    parser.add_argument('--drain', type=float, default=2.0, help='Chờ message đang giao sau khi dừng gửi')
+    parser.add_argument('--rate', type=float, default=0.5, help='Số action trung bình mỗi giây mỗi client')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Tỷ lệ action (mặc định {DEFAULT_MIX})')
+    parser.add_argument('--churn-pause', type=float, default=0.1, help='Thời gian offline khi presence churn')
+    parser.add_argument('--file-chunk-size', type=int, default=16 * 1024)
+    parser.add_argument('--file-chunks', type=int, default=4)
+    parser.add_argument('--batch-ms', type=int, default=0, help='Bật batching outbound cho client')
+    parser.add_argument('--upgrade-auth', action='store_true', help='Gửi token lúc upgrade thay vì frame AUTH')
+    parser.add_argument('--db', default=None,
+                        help='Database của server ngoài (--url) để tạo user load0..loadN-1')
+    parser.add_argument('--admin-token', default=os.environ.get("CHAT_ADMIN_TOKEN"),
+                        help='Token cho /admin/state (lấy RSS của server ngoài)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', dest='json_path', default=None, help='Ghi kết quả ra file JSON')
+    parser.add_argument('--compare', default=None, help='File JSON của lần chạy trước để so sánh')
+    args = parser.parse_args()
+    parse_mix(args.mix)
+    random.seed(args.seed)
+
+    # Đường dẫn file trước khi chdir vào thư mục tạm
+    json_path = Path(args.json_path).resolve() if args.json_path else None
+    if args.db:
+        args.db = str(Path(args.db).resolve())
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        report = asyncio.run(run_load(args))
+
+    print_report(report)
+    if baseline:
+        print_comparison(baseline, report)
+    if json_path:
+        json_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"\nĐã ghi {json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+Microbenchmark các đoạn code nóng, so sánh với baseline lưu trong repo (benchmarks/baselines.json)
+- protocol: Message.encode/decode (JSON và binary codec), create_response
+- router: dispatch một message qua MessageRouter
+- fan-out của ChatHandler: broadcast/presence tới 10/100/1000 client, private
+- Database: save_message, save_message_with_events (từng message) so với save_messages (batch)
+- auth: bcrypt verify, JWT verify (không cache và TokenVerifier cache hit)
+- FileHandler.handle_file_data: nhận một chunk 16 KiB
+Mỗi case chạy --rounds vòng (tắt gc như timeit), so sánh theo vòng nhanh nhất (ít nhiễu nhất).
+Baseline từ máy khác được quy đổi theo case "calibration" (vòng lặp Python thuần);
+case chậm hơn baseline quá --threshold bị đánh dấu REGRESSION (--fail-on-regression: exit code 1)
+Chạy: python benchmarks/microbench.py [--filter fanout,db] [--rounds N] [--json out.json]
+      python benchmarks/microbench.py --save-baseline   (cập nhật baselines.json sau khi tối ưu có chủ đích)
+"""
+import argparse
+import asyncio
+import base64
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bcrypt
+import jwt
+
+from backend.auth import JWT_SECRET, JWT_ALGORITHM, TokenVerifier, generate_token
+from backend.database import BROADCAST_STREAM
+from backend.protocol import Message, MessageType, JSON_CODEC, BINARY_CODEC
+from common import NullConnection, unthrottled_server
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines.json"
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_ROUNDS = 15
+FANOUT_CLIENTS = (10, 100, 1000)
+CHUNK_SIZE = 16 * 1024
+SAVE_BATCH = 100
+# Commit sqlite (fsync) dao động theo disk nhiều hơn các case chỉ dùng CPU
+IO_THRESHOLD = 0.50
+
+PRIVATE_DATA = {
+    "sender": "alice",
+    "receiver": "bob",
+    "message": "Chào bạn, tối nay đi ăn không?",
+    "type": "private",
+    "id": 123456,
+    "seq": 42,
+    "timestamp": "2024-01-01 12:00:00",
+}
+
+
+class Case:
+    """
+    Một microbenchmark: func được gọi number lần mỗi vòng, mỗi lần gọi là ops thao tác
+    setup (nếu có) chạy ngay trước khi đo case; threshold: ngưỡng regression riêng (case I/O)
+    """
+    __slots__ = ("name", "func", "is_async", "number", "ops", "setup", "threshold")
+
+    def __init__(self, name: str, func: Callable, number: int, is_async: bool = False, ops: int = 1,
+                 setup: Callable = None, threshold: float = None):
+        self.name = name
+        self.func = func
+        self.number = number
+        self.is_async = is_async
+        self.ops = ops
+        self.setup = setup
+        self.threshold = threshold
+
+
+def calibration():
+    total = 0
+    for i in range(1000):
+        total += i * i
+    return total
+
+
+async def build_cases(scale: float) -> List[Case]:
+    """Tạo các case (server, database tạm trong thư mục làm việc hiện tại)"""
+    def n(count: int) -> int:
+        return max(1, int(count * scale))
+
+    cases = [Case("calibration", calibration, n(2000))]
+
+    # ---------- protocol ----------
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        encoded = Message.encode(MessageType.PRIVATE_MESSAGE, PRIVATE_DATA, codec)
+        label = codec.name.rsplit(".", 1)[-1]
+        cases.append(Case(f"protocol.encode[{label}]",
+                          lambda codec=codec: Message.encode(MessageType.PRIVATE_MESSAGE, PRIVATE_DATA, codec),
+                          n(20000)))
+        cases.append(Case(f"protocol.decode[{label}]",
+                          lambda encoded=encoded, codec=codec: Message.decode(encoded, codec), n(20000)))
+    cases.append(Case("protocol.create_response",
+                      lambda: Message.create_response(MessageType.SUCCESS, True, "Message đã được gửi",
+                                                      {"action": "chat", "receiver": "bob"}),
+                      n(20000)))
+
+    # ---------- router và fan-out ----------
+    server = unthrottled_server()
+    conn = NullConnection()
+    sender = server.register_connection("bench", conn, JSON_CODEC)
+    server.sessions.authenticate(sender.client_id, "sender")
+    receiver = server.register_connection("bench", conn, JSON_CODEC)
+    server.sessions.authenticate(receiver.client_id, "receiver")
+    fanout_sessions = []
+
+    def resize(clients: int):
+        """Thêm/bớt session đã xác thực cho đúng số client (sender và receiver luôn có)"""
+        def setup():
+            while len(server.sessions) < clients:
+                session = server.register_connection("bench", conn, JSON_CODEC)
+                server.sessions.authenticate(session.client_id, f"user{len(fanout_sessions)}")
+                fanout_sessions.append(session)
+            while len(server.sessions) > clients and fanout_sessions:
+                server.sessions.remove(fanout_sessions.pop().client_id)
+        return setup
+
+    user_list = {"type": "USER_LIST", "data": {}}
+    cases.append(Case("router.dispatch[USER_LIST]",
+                      lambda: server.process_websocket_message(sender, user_list, 32), n(20000), is_async=True,
+                      setup=resize(2)))
+
+    chat = server.chat_handler
+    private_event = Message.build(MessageType.PRIVATE_MESSAGE, PRIVATE_DATA)
+    private_events = {"receiver": private_event, "sender": private_event}
+    cases.append(Case("fanout.private",
+                      lambda: chat._send_private_message("sender", "receiver", private_events),
+                      n(20000), is_async=True, setup=resize(2)))
+
+    broadcast_event = Message.build(MessageType.BROADCAST, {"sender": "sender", "message": "xin chào", "seq": 1})
+
+    for clients in FANOUT_CLIENTS:
+        number = n(200000 // clients)
+        cases.append(Case(f"fanout.broadcast[{clients}]",
+                          lambda: chat._broadcast_message(broadcast_event, exclude_id=sender.client_id),
+                          number, is_async=True, setup=resize(clients)))
+        cases.append(Case(f"fanout.presence[{clients}]",
+                          lambda: chat._broadcast_user_status("sender", True, exclude_id=sender.client_id),
+                          number, is_async=True, setup=resize(clients)))
+
+    # ---------- database ----------
+    db = server.db
+    event = Message.build(MessageType.PRIVATE_MESSAGE, PRIVATE_DATA)
+    timestamp = "2024-01-01 12:00:00"
+    batch = [("alice", "bob", "xin chào", "text", None, timestamp)] * SAVE_BATCH
+    cases.append(Case("db.save_message", lambda: db.save_message("alice", "bob", "xin chào"), n(300),
+                      threshold=IO_THRESHOLD))
+    cases.append(Case("db.save_message_with_events",
+                      lambda: db.save_message_with_events("alice", "bob", "xin chào", event, ["bob", "alice"],
+                                                          pending_for="bob"),
+                      n(300), threshold=IO_THRESHOLD))
+    cases.append(Case(f"db.save_messages[batch={SAVE_BATCH}]", lambda: db.save_messages(batch), n(30),
+                      ops=SAVE_BATCH, threshold=IO_THRESHOLD))
+    cases.append(Case("db.save_message_with_events[broadcast]",
+                      lambda: db.save_message_with_events("alice", None, "xin chào", event, [BROADCAST_STREAM]),
+                      n(300), threshold=IO_THRESHOLD))
+
+    # ---------- auth ----------
+    password_hash = bcrypt.hashpw(b"password123", bcrypt.gensalt())
+    cases.append(Case("auth.bcrypt_verify", lambda: bcrypt.checkpw(b"password123", password_hash), 1))
+    token = generate_token("bench")
+    verifier = TokenVerifier()
+    cases.append(Case("auth.jwt_decode", lambda: jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]),
+                      n(5000)))
+    cases.append(Case("auth.token_verifier[hit]", lambda: verifier.verify(token), n(50000)))
+
+    # ---------- file ----------
+    file_handler = server.file_handler
+    response = await file_handler.handle_file_request(sender.client_id, "sender", {
+        "filename": "bench.bin", "size": CHUNK_SIZE * 1000})
+    transfer_id = response["data"]["transfer_id"]
+    transfer = file_handler.file_transfers[transfer_id]
+    chunk = {"transfer_id": transfer_id, "data": base64.b64encode(os.urandom(CHUNK_SIZE)).decode(),
+             "chunk_index": 0, "is_last": False}
+
+    async def ingest_chunk():
+        await file_handler.handle_file_data(sender.client_id, transfer_id, chunk)
+        transfer["chunks"].clear()  # Không giữ dữ liệu giữa các lần gọi (chỉ đo ingest)
+    cases.append(Case(f"file.handle_file_data[{CHUNK_SIZE // 1024}KiB]", ingest_chunk, n(5000), is_async=True))
+    return cases
+
+
+async def run_case(case: Case, rounds: int) -> dict:
+    """Thời gian mỗi thao tác (giây) qua các vòng: median, min và độ lệch tương đối"""
+    func, number = case.func, case.number
+    if case.setup is not None:
+        case.setup()
+    if case.is_async:
+        await func()  # Warm-up
+    else:
+        func()
+    times = []
+    for _ in range(rounds):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            if case.is_async:
+                for _ in range(number):
+                    await func()
+            else:
+                for _ in range(number):
+                    func()
+            elapsed = time.perf_counter() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+        times.append(elapsed / (number * case.ops))
+    median = statistics.median(times)
+    result = {
+        "median_ns": round(median * 1e9, 1),
+        "min_ns": round(min(times) * 1e9, 1),
+        "spread": round((max(times) - min(times)) / median, 3) if median else 0.0,
+        "number": number,
+        "ops": case.ops,
+    }
+    if case.threshold is not None:
+        result["threshold"] = case.threshold
+    return result
+
+
+async def run(args, baseline: dict = None) -> dict:
+    cases = await build_cases(args.scale)
+    selected = [case for case in cases
+                if case.name == "calibration" or not args.filter
+                or any(part in case.name for part in args.filter.split(","))]
+    results = {}
+    for case in selected:
+        result = results[case.name] = await run_case(case, args.rounds)
+        print(f"{case.name:<42} min {result['min_ns'] / 1000:>12.3f}  median {result['median_ns'] / 1000:>12.3f} µs/op"
+              f"  ±{result['spread']:.0%}")
+
+    # Đo lại case có vẻ regression (nhiễu từ process khác thường chỉ làm chậm một lần chạy)
+    by_name = {case.name: case for case in selected}
+    for _ in range(args.confirm if baseline else 0):
+        regressions = compare(baseline, results, args.threshold, not args.no_normalize, verbose=False)
+        if not regressions:
+            break
+        print(f"Đo lại: {', '.join(regressions)}")
+        for name in regressions:
+            result = await run_case(by_name[name], args.rounds)
+            if result["min_ns"] < results[name]["min_ns"]:
+                results[name] = result
+    return results
+
+
+def machine_info() -> dict:
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare(baseline: dict, results: dict, threshold: float, normalize: bool, verbose: bool = True) -> List[str]:
+    """So sánh với baseline (in bảng nếu verbose), trả về tên các case bị regression"""
+    base_results = baseline["results"]
+    scale = 1.0
+    if (normalize and baseline.get("machine") != machine_info()
+            and "calibration" in base_results and "calibration" in results):
+        # Baseline tạo trên máy khác: quy đổi theo tỷ lệ calibration (cùng máy thì không, tránh thêm nhiễu)
+        scale = results["calibration"]["min_ns"] / base_results["calibration"]["min_ns"]
+    if verbose:
+        print(f"\n== So với baseline ({baseline.get('machine', {}).get('processor', '?')}, "
+              f"hệ số máy {scale:.2f}, ngưỡng ±{threshold:.0%}) ==")
+    regressions = []
+    for name, result in results.items():
+        if name == "calibration":
+            continue
+        base = base_results.get(name)
+        if base is None:
+            if verbose:
+                print(f"{name:<42} {'':>12} -> {result['min_ns'] / 1000:>10.3f} µs  MỚI")
+            continue
+        # So sánh lần chạy nhanh nhất (ít bị nhiễu bởi process khác nhất, như timeit)
+        expected = base["min_ns"] * scale
+        change = result["min_ns"] / expected - 1
+        limit = max(threshold, result.get("threshold", 0))
+        if change > limit:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif change < -limit:
+            status = "nhanh hơn"
+        else:
+            status = "OK"
+        if verbose:
+            print(f"{name:<42} {expected / 1000:>12.3f} -> {result['min_ns'] / 1000:>10.3f} µs  "
+                  f"{change:+7.1%}  {status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark và so sánh với baseline')
+    parser.add_argument('--filter', default=None, help='Chỉ chạy case có tên chứa một trong các chuỗi (phân cách ",")')
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument('--scale', type=float, default=1.0, help='Hệ số số lần gọi mỗi vòng')
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--save-baseline', action='store_true', help='Ghi kết quả làm baseline mới')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Chậm hơn baseline quá tỷ lệ này là regression (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--confirm', type=int, default=2, help='Số lần đo lại case có vẻ regression (default: 2)')
+    parser.add_argument('--no-normalize', action='store_true', help='So sánh thời gian tuyệt đối')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit code 1 nếu có regression')
+    parser.add_argument('--json', dest='json_path', default=None, help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    baseline_path = Path(args.baseline).resolve()
+    json_path = Path(args.json_path).resolve() if args.json_path else None
+    baseline = None
+    if not args.save_baseline and baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = asyncio.run(run(args, baseline))
+
+    report = {"machine": machine_info(), "rounds": args.rounds, "scale": args.scale, "results": results}
+    regressions = []
+    if args.save_baseline:
+        if args.filter and baseline_path.exists():
+            # Chỉ cập nhật các case đã chạy, giữ nguyên phần còn lại
+            saved = json.loads(baseline_path.read_text())
+            saved["results"].update(results)
+            report["results"] = saved["results"]
+        baseline_path.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+        print(f"\nĐã ghi baseline {baseline_path}")
+    elif baseline:
+        regressions = compare(baseline, results, args.threshold, not args.no_normalize)
+        print(f"\n{len(regressions)} regression" + (f": {', '.join(regressions)}" if regressions else ""))
+    else:
+        print(f"\nChưa có baseline {baseline_path} (tạo bằng --save-baseline)")
+
+    if json_path:
+        json_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"Đã ghi {json_path}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
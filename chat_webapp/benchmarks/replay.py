@@ -0,0 +1,601 @@
+"""
+Replay traffic đã capture (server chạy với --capture PATH) vào server local
+- Mỗi WebSocket session được kết nối lại với cùng codec, tham số handshake và các frame theo đúng thứ tự,
+  REST request được gửi lại với cùng method/path/body
+- Tốc độ: --speed 1 (như lúc capture), --speed N (nhanh gấp N), --speed 0 (nhanh nhất có thể;
+  session vẫn chờ SUCCESS của AUTH và transfer_id của FILE_REQUEST trước khi gửi tiếp)
+- Token được tạo mới theo username trong capture; transfer_id của FILE_DATA được thay bằng id server mới trả về
+- Scrub PII: --scrub-users (username/email -> hash ổn định), --scrub-text (nội dung message -> cùng độ dài),
+  --scrub-files (tên file -> hash, chunk -> byte 0 cùng kích thước); --write-scrubbed OUT chỉ ghi capture đã scrub
+- Báo cáo: số frame/request, response theo loại, lỗi, độ trễ REST, độ lệch so với lịch (lag) và tốc độ đạt được
+Giới hạn: id trong DB gốc (DELIVERY_ACK, MARK_READ) không khớp DB replay nên chỉ tạo tải, không có tác dụng;
+LOGIN/REGISTER được gửi với password PASSWORD vì capture không giữ password
+Chạy: python benchmarks/replay.py --capture ws.bin [rest.bin] [--speed N] [--scrub-users] [--scrub-text] [--scrub-files]
+      [--ws-url ws://127.0.0.1:8080/ws --rest-url http://127.0.0.1:8000 --db chat_app.db]
+      [--json out.json] [--compare baseline.json] [--write-scrubbed scrubbed.bin]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from base64 import b64decode, b64encode
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiohttp
+import bcrypt
+from yarl import URL
+
+from backend.auth import generate_token
+from backend.capture import (
+    CaptureFile, CaptureRecord, read_capture, encode_record,
+    KIND_WS_OPEN, KIND_WS_TEXT, KIND_WS_BINARY, KIND_WS_CLOSE, KIND_HTTP, KIND_WS_REDACTED
+)
+from backend.database import Database
+from backend.protocol import AUTH_SUBPROTOCOL_PREFIX, BINARY_CODEC, get_codec
+from backend.rate_limit import RateLimiter
+from backend.rest_api import RESTAPIServer
+from backend.admin import AdminSettings
+from common import start_site, unthrottled_server
+from report import percentiles, print_comparison
+
+PASSWORD = "password123"
+RESPONSE_TIMEOUT = 5.0
+TOP_ERRORS = 10
+# Field chứa username trong data của message/body REST
+USER_FIELDS = ("receiver", "sender", "username", "peer", "reader")
+# Query chứa username trong REST path
+USER_QUERY = ("receiver", "peer", "q")
+USERS_PATH = "/api/users/"
+USERS_PATH_RESERVED = ("search", "online")
+
+
+class Scrubber:
+    """Thay PII trong message/request; cùng --salt cho cùng kết quả nên các capture scrub riêng vẫn khớp nhau"""
+
+    def __init__(self, users: bool = False, text: bool = False, files: bool = False, salt: str = ""):
+        self.users = users
+        self.text = text
+        self.files = files
+        self.salt = salt
+        self._names: Dict[str, str] = {}
+
+    @property
+    def active(self) -> bool:
+        return self.users or self.text or self.files
+
+    def _hash(self, value: str, length: int = 12) -> str:
+        return hashlib.sha256((self.salt + value).encode("utf-8")).hexdigest()[:length]
+
+    def user(self, name):
+        if not self.users or not isinstance(name, str) or not name:
+            return name
+        scrubbed = self._names.get(name)
+        if scrubbed is None:
+            scrubbed = self._names[name] = "u" + self._hash(name)
+        return scrubbed
+
+    def data(self, data: dict) -> bool:
+        """Scrub data của một message (tại chỗ); trả về True nếu có thay đổi"""
+        changed = False
+        if self.users:
+            for key in USER_FIELDS:
+                if isinstance(data.get(key), str):
+                    data[key] = self.user(data[key])
+                    changed = True
+            if isinstance(data.get("email"), str):
+                data["email"] = f"e{self._hash(data['email'])}@scrubbed.local"
+                changed = True
+        if self.text and isinstance(data.get("message"), str):
+            data["message"] = "x" * len(data["message"])
+            changed = True
+        if self.files:
+            if isinstance(data.get("filename"), str):
+                data["filename"] = f"file_{self._hash(data['filename'], 8)}{Path(data['filename']).suffix}"
+                changed = True
+            if isinstance(data.get("data"), str) and "transfer_id" in data:
+                try:
+                    data["data"] = b64encode(bytes(len(b64decode(data["data"])))).decode("ascii")
+                    changed = True
+                except ValueError:
+                    pass
+        return changed
+
+    def message(self, message) -> bool:
+        data = message.get("data") if isinstance(message, dict) else None
+        return isinstance(data, dict) and self.data(data)
+
+    def http(self, entry: dict):
+        entry["username"] = self.user(entry.get("username"))
+        url = URL(entry["path"])
+        path = url.path
+        if self.users and path.startswith(USERS_PATH) and path[len(USERS_PATH):] not in USERS_PATH_RESERVED:
+            path = USERS_PATH + self.user(path[len(USERS_PATH):])
+        query = {key: self.user(value) if key in USER_QUERY else value for key, value in url.query.items()}
+        entry["path"] = str(URL.build(path=path, query=query))
+        if entry.get("body") and entry.get("content_type") == "application/json":
+            try:
+                body = json.loads(b64decode(entry["body"]))
+            except ValueError:
+                return
+            if isinstance(body, dict) and self.data(body):
+                entry["body"] = b64encode(json.dumps(body).encode("utf-8")).decode("ascii")
+
+
+def decode_frame(record: CaptureRecord, codec):
+    """Message của frame TEXT/BINARY (None nếu frame lỗi, như server nhận)"""
+    try:
+        if record.kind == KIND_WS_BINARY:
+            return codec.loads(record.payload)
+        return json.loads(record.payload)
+    except (ValueError, TypeError, IndexError, KeyError):
+        return None
+
+
+def scrub_record(record: CaptureRecord, scrubber: Scrubber, codecs: Dict) -> CaptureRecord:
+    """Bản scrub của một record (record gốc nếu không đổi); codecs: codec theo session, cập nhật từ KIND_WS_OPEN"""
+    kind = record.kind
+    if kind == KIND_WS_OPEN:
+        entry = record.json()
+        codecs[record.session_id] = get_codec(entry.get("codec"))
+        if not scrubber.users or not entry.get("username"):
+            return record
+        entry["username"] = scrubber.user(entry["username"])
+        payload = json.dumps(entry).encode("utf-8")
+    elif kind in (KIND_WS_TEXT, KIND_WS_BINARY):
+        codec = codecs.get(record.session_id, BINARY_CODEC)
+        message = decode_frame(record, codec)
+        if not scrubber.message(message):
+            return record
+        payload = codec.dumps(message) if kind == KIND_WS_BINARY else json.dumps(message).encode("utf-8")
+    elif kind == KIND_WS_REDACTED:
+        message = record.json()
+        message["username"] = scrubber.user(message.get("username"))
+        scrubber.message(message)
+        payload = json.dumps(message).encode("utf-8")
+    elif kind == KIND_HTTP:
+        entry = record.json()
+        scrubber.http(entry)
+        payload = json.dumps(entry).encode("utf-8")
+    else:
+        return record
+    return CaptureRecord(record.timestamp, kind, record.session_id, payload)
+
+
+class Frame:
+    """Frame sẽ gửi lại: raw giữ nguyên byte gốc, message dùng khi phải sửa (token, transfer_id)"""
+    __slots__ = ("timestamp", "kind", "raw", "message")
+
+    def __init__(self, timestamp: float, kind: int, raw, message):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.raw = raw
+        self.message = message
+
+
+class ReplaySession:
+    """Một WebSocket session trong capture: từ KIND_WS_OPEN đến KIND_WS_CLOSE"""
+
+    def __init__(self, session_id: str, opened: float, entry: dict):
+        self.session_id = session_id
+        self.opened = opened
+        self.closed: Optional[float] = None
+        self.codec = get_codec(entry.get("codec"))
+        self.username = entry.get("username")
+        self.query = entry.get("query") or {}
+        self.frames: List[Frame] = []
+
+
+class Capture:
+    """
+    Các capture đã đọc (và scrub): session WebSocket, REST request và username cần có trong DB
+    Nhiều file (vd. của WebSocket server và REST server) được replay trên cùng một timeline
+    """
+
+    def __init__(self, paths: List[str], scrubber: Scrubber):
+        self.sessions: List[ReplaySession] = []
+        self.http: List[tuple] = []  # (timestamp, entry)
+        self.usernames = set()
+        self.incomplete = 0  # Frame của session không có KIND_WS_OPEN (file đã bị xoay mất)
+        self.first = self.last = None
+        for path in paths:
+            self.load(path, scrubber)
+
+    def load(self, path, scrubber: Scrubber):
+        open_sessions: Dict[str, ReplaySession] = {}
+        codecs: Dict = {}
+        for record in read_capture(path):
+            if scrubber.active:
+                record = scrub_record(record, scrubber, codecs)
+            if self.first is None or record.timestamp < self.first:
+                self.first = record.timestamp
+            if self.last is None or record.timestamp > self.last:
+                self.last = record.timestamp
+            kind = record.kind
+            if kind == KIND_HTTP:
+                entry = record.json()
+                self.http.append((record.timestamp, entry))
+                self.add_user(entry.get("username"))
+                continue
+            if kind == KIND_WS_OPEN:
+                session = open_sessions[record.session_id] = ReplaySession(
+                    record.session_id, record.timestamp, record.json())
+                self.sessions.append(session)
+                self.add_user(session.username)
+                continue
+            session = open_sessions.get(record.session_id)
+            if session is None:
+                self.incomplete += 1
+            elif kind == KIND_WS_CLOSE:
+                session.closed = record.timestamp
+                del open_sessions[record.session_id]
+            elif kind == KIND_WS_REDACTED:
+                message = record.json()
+                self.add_user(message.get("username"))
+                session.frames.append(Frame(record.timestamp, kind, None, message))
+            else:
+                raw = record.payload if kind == KIND_WS_BINARY else record.payload.decode("utf-8")
+                message = decode_frame(record, session.codec)
+                if isinstance(message, dict) and isinstance(message.get("data"), dict):
+                    self.add_user(message["data"].get("receiver"))
+                session.frames.append(Frame(record.timestamp, kind, raw, message))
+
+    def add_user(self, username):
+        if isinstance(username, str) and username:
+            self.usernames.add(username)
+
+    @property
+    def span(self) -> float:
+        return (self.last - self.first) if self.first is not None else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "frames": sum(len(session.frames) for session in self.sessions),
+            "http_requests": len(self.http),
+            "users": len(self.usernames),
+            "incomplete_frames": self.incomplete,
+            "span_seconds": round(self.span, 3),
+        }
+
+
+class Stats:
+    def __init__(self):
+        self.frames_sent = 0
+        self.responses = Counter()
+        self.errors = Counter()
+        self.http_status = Counter()
+        self.http_latencies: List[float] = []
+        self.http_skipped = 0
+        self.lag: List[float] = []
+
+
+class Clock:
+    """Lịch replay: timestamp trong capture -> thời điểm gửi theo --speed (0 = không chờ)"""
+
+    def __init__(self, first: float, speed: float):
+        self.first = first
+        self.speed = speed
+        self.start = time.perf_counter()
+
+    async def wait(self, timestamp: float, stats: Stats):
+        if self.speed <= 0:
+            return
+        target = self.start + (timestamp - self.first) / self.speed
+        delay = target - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.lag.append(max(0.0, time.perf_counter() - target))
+
+
+class ReplayClient:
+    """Chạy lại một session: connect, gửi frame theo lịch, đếm response"""
+
+    def __init__(self, session: ReplaySession, url: str, http: aiohttp.ClientSession, clock: Clock, stats: Stats,
+                 drain: float):
+        self.session = session
+        self.drain = drain
+        self.url = url
+        self.http = http
+        self.clock = clock
+        self.stats = stats
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self.ready: Optional[asyncio.Future] = None
+        self.transfer_ids: asyncio.Queue = asyncio.Queue()
+        self.transfers: Dict[str, str] = {}
+
+    async def run(self):
+        session = self.session
+        protocols = [session.codec.name]
+        if session.username:
+            protocols.append(AUTH_SUBPROTOCOL_PREFIX + generate_token(session.username))
+        url = self.url + (f"?{urlencode(session.query)}" if session.query else "")
+        try:
+            self.ws = await self.http.ws_connect(url, protocols=protocols, max_msg_size=0)
+        except (aiohttp.ClientError, OSError) as e:
+            self.stats.errors[f"connect: {e}"] += 1
+            return
+        reader = asyncio.create_task(self.read_loop())
+        try:
+            for frame in session.frames:
+                await self.clock.wait(frame.timestamp, self.stats)
+                if self.ws.closed:
+                    break
+                await self.send(frame)
+            if self.clock.speed <= 0:
+                await asyncio.sleep(self.drain)  # Chờ response của các frame cuối
+            elif session.closed is not None:
+                await self.clock.wait(session.closed, self.stats)
+        except (aiohttp.ClientError, ConnectionResetError) as e:
+            self.stats.errors[f"send: {e}"] += 1
+        finally:
+            await self.ws.close()
+            await reader
+
+    async def send(self, frame: Frame):
+        message = frame.message
+        if frame.kind == KIND_WS_REDACTED:
+            await self.send_redacted(message)
+        elif isinstance(message, dict) and message.get("type") == "FILE_DATA" and isinstance(message.get("data"), dict):
+            original = message["data"].get("transfer_id")
+            if original not in self.transfers:
+                try:
+                    self.transfers[original] = await asyncio.wait_for(self.transfer_ids.get(), RESPONSE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.transfers[original] = original
+                    self.stats.errors["không nhận được transfer_id"] += 1
+            await self.send_message({**message, "data": {**message["data"], "transfer_id": self.transfers[original]}},
+                                    frame.kind == KIND_WS_BINARY)
+        elif frame.kind == KIND_WS_BINARY:
+            await self.ws.send_bytes(frame.raw)
+        else:
+            await self.ws.send_str(frame.raw)
+        self.stats.frames_sent += 1
+
+    async def send_redacted(self, message: dict):
+        """AUTH với token mới (chờ SUCCESS), LOGIN/REGISTER với password PASSWORD"""
+        data = dict(message.get("data") or {})
+        if message["type"] == "AUTH":
+            username = message.get("username") or ""
+            data["token"] = generate_token(username)
+            self.ready = asyncio.get_running_loop().create_future()
+        else:
+            data["password"] = PASSWORD
+        await self.send_message({"type": message["type"], "data": data}, self.session.codec.binary)
+        if self.ready is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.ready), RESPONSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.stats.errors["AUTH timeout"] += 1
+            self.ready = None
+
+    async def send_message(self, message: dict, binary: bool):
+        if binary:
+            await self.ws.send_bytes(self.session.codec.dumps(message))
+        else:
+            await self.ws.send_str(json.dumps(message))
+
+    async def read_loop(self):
+        codec = self.session.codec
+        try:
+            async for msg in self.ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    message = json.loads(msg.data)
+                elif msg.type == aiohttp.WSMsgType.BINARY:
+                    message = codec.loads(msg.data)
+                else:
+                    break
+                messages = message["data"]["messages"] if message.get("type") == "BATCH" else (message,)
+                for item in messages:
+                    self.on_message(item)
+        except (aiohttp.ClientError, ConnectionResetError):
+            self.stats.errors["connection"] += 1
+
+    def on_message(self, message: dict):
+        kind = message.get("type")
+        data = message.get("data") or {}
+        self.stats.responses[kind] += 1
+        if kind == "SUCCESS":
+            if data.get("action") == "file_request":
+                self.transfer_ids.put_nowait(data["transfer_id"])
+            elif "broadcast_seq" in data and self.ready is not None and not self.ready.done():
+                self.ready.set_result(None)
+        elif kind == "ERROR":
+            self.stats.errors[data.get("message", "error")] += 1
+            if self.ready is not None and not self.ready.done():
+                self.ready.set_result(None)
+
+
+async def replay_http(http: aiohttp.ClientSession, base_url: str, entry: dict, stats: Stats):
+    if "body_size" in entry:
+        # Body không được capture (multipart/quá lớn)
+        stats.http_skipped += 1
+        return
+    headers = {}
+    if entry.get("username"):
+        headers["Authorization"] = f"Bearer {generate_token(entry['username'])}"
+    if entry.get("content_type"):
+        headers["Content-Type"] = entry["content_type"]
+    body = b64decode(entry["body"]) if entry.get("body") else None
+    if body is not None and entry.get("content_type") == "application/json" and entry["path"].startswith("/api/auth/"):
+        try:
+            data = json.loads(body)
+            data["password"] = PASSWORD
+            body = json.dumps(data).encode("utf-8")
+        except (ValueError, TypeError):
+            pass
+    start = time.perf_counter()
+    try:
+        async with http.request(entry["method"], base_url + entry["path"], data=body, headers=headers) as response:
+            await response.read()
+        stats.http_status[response.status] += 1
+    except (aiohttp.ClientError, OSError) as e:
+        stats.errors[f"http: {e}"] += 1
+        return
+    stats.http_latencies.append(time.perf_counter() - start)
+
+
+def seed_users(db: Database, usernames):
+    """Tạo user có trong capture (WS kiểm tra user tồn tại khi xác thực), dùng chung một hash"""
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    return db.create_users((username, f"{username}@replay.local", password_hash, created_at)
+                           for username in sorted(usernames))
+
+
+async def run_replay(args, capture: Capture) -> dict:
+    in_process = args.ws_url is None and args.rest_url is None
+    runners = []
+    if args.db:
+        seed_users(Database(args.db), capture.usernames)
+    if in_process:
+        # Hai server dùng chung chat_app.db trong thư mục tạm
+        ws_server = unthrottled_server(host='127.0.0.1', port=0, admin=AdminSettings(enabled=False))
+        rest_server = RESTAPIServer(rate_limiter=RateLimiter(enabled=False), admin=AdminSettings(enabled=False))
+        seed_users(ws_server.db, capture.usernames)
+        ports = []
+        for server in (ws_server, rest_server):
+            runner, port = await start_site(server.app)
+            runners.append(runner)
+            ports.append(port)
+        args.ws_url = f"ws://127.0.0.1:{ports[0]}/ws"
+        args.rest_url = f"http://127.0.0.1:{ports[1]}"
+
+    stats = Stats()
+    # Lịch khởi động: session theo thời điểm mở, REST request theo timestamp
+    starts = sorted([(session.opened, 0, i) for i, session in enumerate(capture.sessions)]
+                    + [(timestamp, 1, i) for i, (timestamp, _) in enumerate(capture.http)])
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        clock = Clock(capture.first or 0.0, args.speed)
+        tasks = []
+        for timestamp, kind, index in starts:
+            url = args.ws_url if kind == 0 else args.rest_url
+            if not url:
+                continue
+            await clock.wait(timestamp, stats)
+            if kind == 0:
+                client = ReplayClient(capture.sessions[index], url, http, clock, stats, args.drain)
+                tasks.append(asyncio.create_task(client.run()))
+            else:
+                tasks.append(asyncio.create_task(replay_http(http, url, capture.http[index][1], stats)))
+        await asyncio.gather(*tasks)
+        duration = time.perf_counter() - clock.start
+
+    for runner in runners:
+        await runner.cleanup()
+
+    return {
+        "duration_seconds": round(duration, 3),
+        "achieved_speed": round(capture.span / duration, 2) if duration > 0 else None,
+        "frames_sent": stats.frames_sent,
+        "responses": dict(stats.responses),
+        "errors": dict(stats.errors.most_common(TOP_ERRORS)),
+        "error_count": sum(stats.errors.values()),
+        "http": {
+            "status": {str(status): count for status, count in sorted(stats.http_status.items())},
+            "skipped": stats.http_skipped,
+            "latency_ms": percentiles(stats.http_latencies),
+        },
+        "lag_ms": percentiles(stats.lag),
+    }
+
+
+def write_scrubbed(args, scrubber: Scrubber) -> int:
+    """Ghi capture đã scrub (giữ timestamp và session id), không xoay file"""
+    output = CaptureFile(args.write_scrubbed, max_bytes=float("inf"))
+    codecs: Dict = {}
+    count = 0
+    for record in read_capture(args.capture[0]):
+        record = scrub_record(record, scrubber, codecs)
+        output.write(encode_record(record.timestamp, record.kind, record.session_id, record.payload))
+        count += 1
+    output.close()
+    return count
+
+
+def print_report(capture: dict, results: dict):
+    print(f"Capture: {capture['sessions']} session, {capture['frames']} frame, "
+          f"{capture['http_requests']} REST request trong {capture['span_seconds']:.1f} s")
+    print(f"Replay:  {results['duration_seconds']:.2f} s (x{results['achieved_speed']}), "
+          f"{results['frames_sent']} frame, REST {results['http']['status']} (bỏ qua {results['http']['skipped']})")
+    lag = results["lag_ms"]
+    if lag["count"]:
+        print(f"Lag so với lịch: p50 {lag['p50']:.2f}  p99 {lag['p99']:.2f}  max {lag['max']:.2f} ms")
+    latency = results["http"]["latency_ms"]
+    if latency["count"]:
+        print(f"REST:    p50 {latency['p50']:.2f}  p99 {latency['p99']:.2f}  p999 {latency['p999']:.2f} ms")
+    print(f"Response: {results['responses']}")
+    if results["errors"]:
+        print(f"Lỗi ({results['error_count']}):")
+        for message, count in results["errors"].items():
+            print(f"  {count:>8}  {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay traffic đã capture vào server local')
+    parser.add_argument('--capture', required=True, nargs='+',
+                        help='File capture (server chạy với --capture PATH); nhiều file được replay cùng timeline')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = như lúc capture, N = nhanh gấp N, 0 = nhanh nhất')
+    parser.add_argument('--drain', type=float, default=0.5,
+                        help='Với --speed 0: thời gian chờ response trước khi đóng mỗi session (default: 0.5)')
+    parser.add_argument('--ws-url', default=None, help='WebSocket server có sẵn (mặc định chạy trong process)')
+    parser.add_argument('--rest-url', default=None, help='REST server có sẵn (mặc định chạy trong process)')
+    parser.add_argument('--db', default=None, help='Database của server có sẵn để tạo user trong capture')
+    parser.add_argument('--scrub-users', action='store_true', help='Thay username/email bằng hash ổn định')
+    parser.add_argument('--scrub-text', action='store_true', help='Thay nội dung message bằng chuỗi cùng độ dài')
+    parser.add_argument('--scrub-files', action='store_true', help='Thay tên file và nội dung chunk')
+    parser.add_argument('--salt', default='', help='Salt cho hash khi scrub')
+    parser.add_argument('--write-scrubbed', default=None, metavar='OUT', help='Chỉ ghi capture đã scrub ra OUT')
+    parser.add_argument('--json', dest='json_path', default=None, help='Ghi kết quả ra file JSON')
+    parser.add_argument('--compare', default=None, help='File JSON của lần chạy trước để so sánh')
+    args = parser.parse_args()
+    if args.speed < 0:
+        parser.error("--speed phải >= 0")
+
+    scrubber = Scrubber(args.scrub_users, args.scrub_text, args.scrub_files, args.salt)
+    if args.write_scrubbed:
+        if len(args.capture) > 1:
+            parser.error("--write-scrubbed chỉ nhận một file capture")
+        count = write_scrubbed(args, scrubber)
+        print(f"Đã ghi {count} record -> {args.write_scrubbed}")
+        return
+
+    capture = Capture(args.capture, scrubber)
+    if not capture.sessions and not capture.http:
+        parser.error(f"{' '.join(args.capture)} không có traffic để replay")
+    json_path = Path(args.json_path).resolve() if args.json_path else None
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    if args.db:
+        args.db = str(Path(args.db).resolve())
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        in_process = args.ws_url is None and args.rest_url is None
+        results = asyncio.run(run_replay(args, capture))
+
+    report = {
+        "config": {"capture": args.capture, "speed": args.speed, "scrub_users": args.scrub_users,
+                   "scrub_text": args.scrub_text, "scrub_files": args.scrub_files, "in_process": in_process},
+        "capture": capture.summary(),
+        "results": results,
+    }
+    print_report(report["capture"], results)
+    if baseline:
+        print_comparison(baseline, report)
+    if json_path:
+        json_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"\nĐã ghi {json_path}")
+
+
+if __name__ == "__main__":
+    main()
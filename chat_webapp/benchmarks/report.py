@@ -0,0 +1,39 @@
+"""
+Tiện ích chung cho báo cáo benchmark: percentile độ trễ và so sánh với lần chạy trước (file --json)
+"""
+from typing import Dict, List
+
+
+def percentiles(values: List[float]) -> dict:
+    """count, p50/p99/p999/max (ms) của danh sách độ trễ (giây)"""
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def at(q: float) -> float:
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"count": len(values), "p50": at(0.50), "p99": at(0.99), "p999": at(0.999),
+            "max": round(values[-1] * 1000, 3)}
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    """{"a": {"b": 1}} -> {"a.b": 1} (chỉ giữ số)"""
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}{key}."))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+
+def print_comparison(baseline: dict, report: dict):
+    """So sánh các số liệu với một lần chạy trước (file --json)"""
+    old, new = flatten(baseline["results"]), flatten(report["results"])
+    print("\n== So với baseline ==")
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] == new[key]:
+            continue
+        change = f"{(new[key] - old[key]) / old[key]:+.1%}" if old[key] else "mới"
+        print(f"{key:<40} {old[key]:>12g} -> {new[key]:<12g} {change}")
@@ -21,6 +21,7 @@ export default function Message() {
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
   const selectedConversationRef = useRef(selectedConversation);
+  const conversationsTimerRef = useRef(null);
 
   useEffect(() => {
     loadConversations();
@@ -36,6 +37,8 @@ export default function Message() {
       websocketService.on('user_online', handleUserOnline);
       websocketService.on('user_offline', handleUserOffline);
       websocketService.on('online_users', handleOnlineUsersList);
+      websocketService.on('resync', handleResync);
+      websocketService.on('auth_error', handleAuthError);
     }
 
     // Polling để cập nhật danh sách online users mỗi 30 giây (fallback nếu WebSocket events không hoạt động)
@@ -52,6 +55,8 @@ export default function Message() {
       websocketService.off('user_online', handleUserOnline);
       websocketService.off('user_offline', handleUserOffline);
       websocketService.off('online_users', handleOnlineUsersList);
+      websocketService.off('resync', handleResync);
+      websocketService.off('auth_error', handleAuthError);
       clearInterval(onlineUsersInterval);
     };
   }, []);
@@ -82,13 +87,31 @@ export default function Message() {
     try {
       const result = await chatAPI.getMessages(receiver);
       if (result.success) {
-        setMessages((result.messages || []).reverse());
+        const loaded = (result.messages || []).reverse();
+        setMessages(loaded);
+        // Đánh dấu đã đọc tới message mới nhất của bên kia
+        const lastIncoming = loaded.filter((msg) => msg.sender_username === receiver).pop();
+        if (lastIncoming?.id) {
+          markConversationRead(receiver, lastIncoming.id);
+        }
       }
     } catch (error) {
       console.error('Error loading messages:', error);
     }
   };
 
+  const markConversationRead = (peer, messageId) => {
+    // Ưu tiên WebSocket, dùng REST khi chưa kết nối
+    if (!websocketService.markRead(peer, messageId)) {
+      chatAPI.markRead(peer, messageId).catch((error) => {
+        console.error('Error marking conversation read:', error);
+      });
+    }
+    setConversations((prev) => prev.map((conv) => (
+      conv.username === peer ? { ...conv, unread_count: 0 } : conv
+    )));
+  };
+
   const loadOnlineUsers = async () => {
     try {
       const result = await userAPI.getOnlineUsers();
@@ -113,6 +136,22 @@ export default function Message() {
     }
   };
 
+  const handleResync = () => {
+    // Server không replay được phần thiếu: tải lại toàn bộ qua REST
+    loadConversations();
+    if (selectedConversationRef.current) {
+      loadMessages(selectedConversationRef.current.username);
+    }
+  };
+
+  const handleAuthError = (data) => {
+    // Token bị server từ chối lúc kết nối WebSocket: giống REST 401, đăng nhập lại
+    console.error('WebSocket auth error:', data?.message);
+    localStorage.removeItem('token');
+    localStorage.removeItem('user');
+    window.location.href = '/login';
+  };
+
   const handleNewMessage = (data) => {
     // Chỉ thêm message nếu có nội dung thực sự
     if (data && (data.message || data.message_text)) {
@@ -138,6 +177,10 @@ export default function Message() {
             // Kiểm tra xem message đã tồn tại chưa để tránh duplicate
             // So sánh dựa trên sender, receiver, message content, và file_id (nếu có)
             const exists = prev.some(msg => {
+              // Message từ server có id (REST, replay, hàng chờ giao): so sánh trực tiếp
+              if (data.id && msg.id) {
+                return data.id === msg.id;
+              }
               const msgSender = msg.sender_username || msg.sender;
               const msgReceiver = msg.receiver_username || msg.receiver;
               const msgText = msg.message || msg.message_text;
@@ -171,14 +214,29 @@ export default function Message() {
             }
             return [...prev, data];
           });
+          // Đang mở conversation: tin của bên kia coi như đã đọc
+          if (sender === currentUsername && data.id) {
+            markConversationRead(currentUsername, data.id);
+          }
         }
       }
       
       // Luôn cập nhật conversations list để hiển thị tin nhắn mới trong sidebar
-      loadConversations();
+      // (gộp lại khi nhận nhiều message liên tiếp, ví dụ lúc drain hàng chờ giao)
+      scheduleLoadConversations();
     }
   };
 
+  const scheduleLoadConversations = () => {
+    if (conversationsTimerRef.current) {
+      return;
+    }
+    conversationsTimerRef.current = setTimeout(() => {
+      conversationsTimerRef.current = null;
+      loadConversations();
+    }, 300);
+  };
+
   const handleUserOnline = (data) => {
     // Khi có user online, thêm vào danh sách
     console.log('User online event:', data);
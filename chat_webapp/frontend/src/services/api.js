@@ -135,6 +135,11 @@ export const chatAPI = {
     const response = await api.get('/api/chat/conversations');
     return response.data;
   },
+
+  markRead: async (peer, messageId) => {
+    const response = await api.post('/api/chat/read', { peer, message_id: messageId });
+    return response.data;
+  },
 };
 
 // User API
@@ -0,0 +1,225 @@
+/**
+ * Codec nhị phân kiểu MessagePack cho WebSocket
+ * Phải khớp với BinaryCodec trong backend/protocol.py
+ */
+
+export const BINARY_SUBPROTOCOL = 'chatchit.msgpack';
+export const JSON_SUBPROTOCOL = 'chatchit.json';
+// Subprotocol mang JWT khi upgrade (AUTH_SUBPROTOCOL_PREFIX trong backend/protocol.py)
+export const AUTH_SUBPROTOCOL_PREFIX = 'chatchit.auth.';
+
+// Cùng thứ tự với INTERNED_STRINGS trong backend/protocol.py (chỉ thêm vào cuối)
+const INTERNED_STRINGS = [
+  'type', 'data', 'success', 'message', 'sender', 'receiver',
+  'username', 'users', 'status', 'action', 'token', 'email',
+  'transfer_id', 'chunk_index', 'received_size', 'is_last',
+  'filename', 'file_id', 'file_size', 'message_type', 'size',
+  'online', 'offline', 'private', 'broadcast', 'file', 'text',
+  'AUTH', 'REGISTER', 'LOGIN', 'LOGOUT', 'CHAT', 'FILE_REQUEST',
+  'FILE_DATA', 'FILE_ACK', 'BROADCAST', 'ERROR', 'SUCCESS',
+  'USER_LIST', 'PRIVATE_MESSAGE', 'user_online', 'user_offline',
+  'online_users', 'BATCH', 'messages', 'seq', 'id', 'RESYNC',
+  'DELIVERY_ACK', 'ids', 'MARK_READ', 'READ_RECEIPT', 'peer',
+  'message_id', 'last_read_id', 'unread_count', 'reader',
+  'SYNC', 'stream', 'last_seq',
+];
+const INTERN_INDEX = new Map(INTERNED_STRINGS.map((s, i) => [s, i]));
+const EXT_INTERNED = 0x01;
+
+const textEncoder = new TextEncoder();
+const textDecoder = new TextDecoder();
+
+class Writer {
+  constructor() {
+    this.buffer = new Uint8Array(256);
+    this.view = new DataView(this.buffer.buffer);
+    this.length = 0;
+  }
+
+  ensure(size) {
+    if (this.length + size <= this.buffer.length) {
+      return;
+    }
+    let capacity = this.buffer.length * 2;
+    while (capacity < this.length + size) {
+      capacity *= 2;
+    }
+    const next = new Uint8Array(capacity);
+    next.set(this.buffer.subarray(0, this.length));
+    this.buffer = next;
+    this.view = new DataView(next.buffer);
+  }
+
+  byte(value) {
+    this.ensure(1);
+    this.buffer[this.length++] = value;
+  }
+
+  uint(marker, value, size) {
+    this.ensure(1 + size);
+    this.buffer[this.length++] = marker;
+    if (size === 1) this.view.setUint8(this.length, value);
+    else if (size === 2) this.view.setUint16(this.length, value);
+    else this.view.setUint32(this.length, value);
+    this.length += size;
+  }
+
+  bytes(data) {
+    this.ensure(data.length);
+    this.buffer.set(data, this.length);
+    this.length += data.length;
+  }
+}
+
+function pack(value, w) {
+  if (value === null || value === undefined) {
+    w.byte(0xc0);
+  } else if (value === true) {
+    w.byte(0xc3);
+  } else if (value === false) {
+    w.byte(0xc2);
+  } else if (typeof value === 'string') {
+    const index = INTERN_INDEX.get(value);
+    if (index !== undefined) {
+      w.byte(0xd4);
+      w.byte(EXT_INTERNED);
+      w.byte(index);
+      return;
+    }
+    const raw = textEncoder.encode(value);
+    if (raw.length < 32) w.byte(0xa0 | raw.length);
+    else if (raw.length < 0x100) w.uint(0xd9, raw.length, 1);
+    else if (raw.length < 0x10000) w.uint(0xda, raw.length, 2);
+    else w.uint(0xdb, raw.length, 4);
+    w.bytes(raw);
+  } else if (typeof value === 'number') {
+    if (Number.isInteger(value) && value >= 0 && value < 0x80) {
+      w.byte(value);
+    } else if (Number.isInteger(value) && value >= -32 && value < 0) {
+      w.byte(value & 0xff);
+    } else if (Number.isInteger(value) && value >= 0 && value < 0x100000000) {
+      w.uint(0xce, value, 4);
+    } else if (Number.isInteger(value) && value < 0 && value >= -0x80000000) {
+      w.ensure(5);
+      w.buffer[w.length++] = 0xd2;
+      w.view.setInt32(w.length, value);
+      w.length += 4;
+    } else {
+      w.ensure(9);
+      w.buffer[w.length++] = 0xcb;
+      w.view.setFloat64(w.length, value);
+      w.length += 8;
+    }
+  } else if (Array.isArray(value)) {
+    if (value.length < 16) w.byte(0x90 | value.length);
+    else if (value.length < 0x10000) w.uint(0xdc, value.length, 2);
+    else w.uint(0xdd, value.length, 4);
+    value.forEach((item) => pack(item, w));
+  } else if (value instanceof Uint8Array) {
+    if (value.length < 0x100) w.uint(0xc4, value.length, 1);
+    else if (value.length < 0x10000) w.uint(0xc5, value.length, 2);
+    else w.uint(0xc6, value.length, 4);
+    w.bytes(value);
+  } else if (typeof value === 'object') {
+    const entries = Object.entries(value).filter(([, v]) => v !== undefined);
+    if (entries.length < 16) w.byte(0x80 | entries.length);
+    else if (entries.length < 0x10000) w.uint(0xde, entries.length, 2);
+    else w.uint(0xdf, entries.length, 4);
+    entries.forEach(([k, v]) => {
+      pack(k, w);
+      pack(v, w);
+    });
+  } else {
+    throw new TypeError(`Không encode được kiểu ${typeof value}`);
+  }
+}
+
+export function encode(value) {
+  const w = new Writer();
+  pack(value, w);
+  return w.buffer.subarray(0, w.length);
+}
+
+export function decode(buffer) {
+  const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  let offset = 0;
+
+  const readStr = (n) => {
+    const s = textDecoder.decode(bytes.subarray(offset, offset + n));
+    offset += n;
+    return s;
+  };
+  const readArray = (n) => {
+    const result = new Array(n);
+    for (let i = 0; i < n; i++) result[i] = unpack();
+    return result;
+  };
+  const readMap = (n) => {
+    const result = {};
+    for (let i = 0; i < n; i++) {
+      const key = unpack();
+      result[key] = unpack();
+    }
+    return result;
+  };
+  const readUint = (size) => {
+    let v;
+    if (size === 1) v = view.getUint8(offset);
+    else if (size === 2) v = view.getUint16(offset);
+    else v = view.getUint32(offset);
+    offset += size;
+    return v;
+  };
+
+  function unpack() {
+    const b = bytes[offset++];
+    if (b < 0x80) return b;
+    if (b >= 0xe0) return b - 0x100;
+    if (b >= 0xa0 && b <= 0xbf) return readStr(b & 0x1f);
+    if (b >= 0x80 && b <= 0x8f) return readMap(b & 0x0f);
+    if (b >= 0x90 && b <= 0x9f) return readArray(b & 0x0f);
+    let v;
+    switch (b) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xd4: {
+        const extType = bytes[offset];
+        const index = bytes[offset + 1];
+        offset += 2;
+        if (extType !== EXT_INTERNED) throw new Error(`Ext type không hỗ trợ: ${extType}`);
+        return INTERNED_STRINGS[index];
+      }
+      case 0xcc: return readUint(1);
+      case 0xcd: return readUint(2);
+      case 0xce: return readUint(4);
+      case 0xcf: v = Number(view.getBigUint64(offset)); offset += 8; return v;
+      case 0xd0: v = view.getInt8(offset); offset += 1; return v;
+      case 0xd1: v = view.getInt16(offset); offset += 2; return v;
+      case 0xd2: v = view.getInt32(offset); offset += 4; return v;
+      case 0xd3: v = Number(view.getBigInt64(offset)); offset += 8; return v;
+      case 0xca: v = view.getFloat32(offset); offset += 4; return v;
+      case 0xcb: v = view.getFloat64(offset); offset += 8; return v;
+      case 0xd9: return readStr(readUint(1));
+      case 0xda: return readStr(readUint(2));
+      case 0xdb: return readStr(readUint(4));
+      case 0xc4:
+      case 0xc5:
+      case 0xc6: {
+        const n = readUint(b === 0xc4 ? 1 : b === 0xc5 ? 2 : 4);
+        v = bytes.slice(offset, offset + n);
+        offset += n;
+        return v;
+      }
+      case 0xdc: return readArray(readUint(2));
+      case 0xdd: return readArray(readUint(4));
+      case 0xde: return readMap(readUint(2));
+      case 0xdf: return readMap(readUint(4));
+      default:
+        throw new Error(`Byte định dạng không hỗ trợ: 0x${b.toString(16)}`);
+    }
+  }
+
+  return unpack();
+}
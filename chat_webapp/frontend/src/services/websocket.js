@@ -4,37 +4,100 @@
 // WebSocket service - sử dụng native WebSocket API
 // (Socket.io có thể được thêm sau nếu cần)
 
+import {
+  encode, decode, BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL, AUTH_SUBPROTOCOL_PREFIX,
+} from './codec';
+
 const WS_URL = import.meta.env.VITE_WS_URL || 'ws://localhost:8080';
+// Đặt VITE_WS_CODEC=msgpack để dùng codec nhị phân (server phải hỗ trợ subprotocol chatchit.*)
+const WS_CODEC = import.meta.env.VITE_WS_CODEC || 'json';
+// Đặt VITE_WS_BATCH_MS > 0 để server gom message outbound thành frame BATCH
+const WS_BATCH_MS = Number(import.meta.env.VITE_WS_BATCH_MS || 0);
+// Gom các DELIVERY_ACK trong khoảng này thành một message (tối đa MAX_ACK_IDS id)
+const ACK_DELAY_MS = 200;
+const MAX_ACK_IDS = 1000;
+// Reconnect: backoff lũy thừa có jitter; close code 1013 (server quá tải) kèm retry_after_ms
+const RECONNECT_MIN_MS = 1000;
+const RECONNECT_MAX_MS = 30000;
+const CLOSE_TRY_AGAIN_LATER = 1013;
+// Token gửi lúc upgrade không hợp lệ/hết hạn (close reason là thông báo lỗi): không reconnect
+const CLOSE_AUTH_FAILED = 4001;
 
 class WebSocketService {
   constructor() {
     this.socket = null;
     this.listeners = new Map();
+    // Seq cuối cùng đã nhận (stream của user và stream broadcast), gửi lại khi reconnect
+    this.lastSeq = null;
+    this.lastBroadcastSeq = null;
+    // Stream đang chờ replay sau khi gửi SYNC (thấy seq nhảy cóc)
+    this.syncing = { user: false, broadcast: false };
+    // Id các private message đã nhận, gửi DELIVERY_ACK theo lô
+    this.username = null;
+    this.pendingAcks = [];
+    this.ackTimer = null;
+    // Token để tự reconnect khi mất kết nối (null sau disconnect chủ động)
+    this.token = null;
+    this.reconnectTimer = null;
+    this.reconnectAttempts = 0;
   }
 
   connect(token) {
-    if (this.socket?.readyState === WebSocket.OPEN) {
+    if (this.socket?.readyState === WebSocket.OPEN
+      || this.socket?.readyState === WebSocket.CONNECTING) {
       return;
     }
+    this.token = token;
+    clearTimeout(this.reconnectTimer);
+    this.reconnectTimer = null;
 
     try {
-      this.socket = new WebSocket(`${WS_URL}/ws`);
+      const protocols = WS_CODEC === 'msgpack'
+        ? [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]
+        : [JSON_SUBPROTOCOL];
+      // Xác thực ngay lúc upgrade: token đi trong subprotocol (không lộ trên URL/log),
+      // các tham số còn lại qua query. Server gửi online_users + SUCCESS ngay sau khi mở
+      const params = new URLSearchParams();
+      if (token) {
+        protocols.push(`${AUTH_SUBPROTOCOL_PREFIX}${token}`);
+        if (WS_BATCH_MS > 0) {
+          params.set('batch_ms', String(WS_BATCH_MS));
+        }
+        // Server chỉ replay các event có seq lớn hơn
+        if (this.lastSeq !== null) {
+          params.set('last_seq', String(this.lastSeq));
+        }
+        if (this.lastBroadcastSeq !== null) {
+          params.set('last_broadcast_seq', String(this.lastBroadcastSeq));
+        }
+      }
+      const query = params.toString();
+      const socket = new WebSocket(`${WS_URL}/ws${query ? `?${query}` : ''}`, protocols);
+      this.socket = socket;
+      this.socket.binaryType = 'arraybuffer';
 
       this.socket.onopen = () => {
-        console.log('WebSocket connected');
-        // Gửi token để authenticate
-        if (token) {
-          this.socket.send(JSON.stringify({
-            type: 'AUTH',
-            data: { token }
-          }));
-        }
+        console.log('WebSocket connected', this.socket.protocol);
         this.emit('connected');
       };
 
-      this.socket.onclose = () => {
-        console.log('WebSocket disconnected');
+      this.socket.onclose = (event) => {
+        console.log('WebSocket disconnected', event.code);
+        if (socket !== this.socket) {
+          return;
+        }
+        this.socket = null;
         this.emit('disconnected');
+        if (event.code === CLOSE_AUTH_FAILED) {
+          // Reconnect với cùng token sẽ thất bại mãi: bỏ token, UI yêu cầu đăng nhập lại
+          this.token = null;
+          this.reconnectAttempts = 0;
+          this.emit('auth_error', { message: event.reason || 'Token không hợp lệ hoặc đã hết hạn' });
+          return;
+        }
+        if (this.token) {
+          this.scheduleReconnect(this.reconnectDelay(event));
+        }
       };
 
       this.socket.onerror = (error) => {
@@ -44,34 +107,10 @@ class WebSocketService {
 
       this.socket.onmessage = (event) => {
         try {
-          const data = JSON.parse(event.data);
-          // Route messages based on type
-          if (data.type === 'BROADCAST') {
-            this.emit('broadcast', data.data);
-          } else if (data.type === 'PRIVATE_MESSAGE') {
-            this.emit('private_message', data.data);
-          } else if (data.type === 'CHAT') {
-            this.emit('message', data.data);
-          } else if (data.type === 'user_online') {
-            // User online event
-            this.emit('user_online', data.data);
-          } else if (data.type === 'user_offline') {
-            // User offline event
-            this.emit('user_offline', data.data);
-          } else if (data.type === 'online_users') {
-            // Online users list event
-            this.emit('online_users', data.data);
-          } else if (data.type === 'SUCCESS' && data.data?.message === 'Xác thực thành công') {
-            // AUTH thành công
-            console.log('WebSocket authenticated:', data.data.username);
-            this.emit('authenticated', data.data);
-          } else if (data.type === 'ERROR') {
-            // Xử lý lỗi (bao gồm AUTH error)
-            console.error('WebSocket error:', data.data?.message || 'Unknown error');
-            this.emit('error', data.data);
-          } else {
-            this.emit('message', data);
-          }
+          const data = typeof event.data === 'string'
+            ? JSON.parse(event.data)
+            : decode(event.data);
+          this.handleMessage(data);
         } catch (error) {
           console.error('Error parsing WebSocket message:', error);
         }
@@ -81,11 +120,179 @@ class WebSocketService {
     }
   }
 
+  handleMessage(data) {
+    // Frame BATCH chứa nhiều message, route từng message như bình thường
+    if (data.type === 'BATCH') {
+      (data.data?.messages || []).forEach((message) => this.handleMessage(message));
+      return;
+    }
+    if (!this.trackSeq(data)) {
+      return;
+    }
+    this.trackDelivery(data);
+    // Route messages based on type
+    if (data.type === 'BROADCAST') {
+      this.emit('broadcast', data.data);
+    } else if (data.type === 'PRIVATE_MESSAGE') {
+      this.emit('private_message', data.data);
+    } else if (data.type === 'READ_RECEIPT') {
+      // Bên kia đã đọc tới last_read_id
+      this.emit('read_receipt', data.data);
+    } else if (data.type === 'CHAT') {
+      this.emit('message', data.data);
+    } else if (data.type === 'user_online') {
+      // User online event
+      this.emit('user_online', data.data);
+    } else if (data.type === 'user_offline') {
+      // User offline event
+      this.emit('user_offline', data.data);
+    } else if (data.type === 'online_users') {
+      // Online users list event
+      this.emit('online_users', data.data);
+    } else if (data.type === 'SUCCESS' && data.data?.message === 'Xác thực thành công') {
+      // AUTH thành công
+      console.log('WebSocket authenticated:', data.data.username);
+      this.username = data.data.username;
+      this.reconnectAttempts = 0;
+      this.syncing = { user: false, broadcast: false };
+      // Kết nối đầu tiên: bắt đầu theo dõi từ seq hiện tại của server
+      if (this.lastSeq === null) this.lastSeq = data.data.seq ?? null;
+      if (this.lastBroadcastSeq === null) this.lastBroadcastSeq = data.data.broadcast_seq ?? null;
+      this.emit('authenticated', data.data);
+    } else if (data.type === 'RESYNC') {
+      // Thiếu quá nhiều event để replay: UI phải tải lại dữ liệu qua REST
+      if (data.data?.stream === 'broadcast') {
+        this.lastBroadcastSeq = data.data.seq;
+        this.syncing.broadcast = false;
+      } else {
+        this.lastSeq = data.data?.seq ?? this.lastSeq;
+        this.syncing.user = false;
+      }
+      this.emit('resync', data.data);
+    } else if (data.type === 'ERROR') {
+      // Xử lý lỗi (bao gồm AUTH error)
+      console.error('WebSocket error:', data.data?.message || 'Unknown error');
+      this.emit('error', data.data);
+    } else {
+      this.emit('message', data);
+    }
+  }
+
+  reconnectDelay(event) {
+    // Server quá tải gợi ý thời gian chờ (đã có jitter) trong close reason
+    if (event.code === CLOSE_TRY_AGAIN_LATER) {
+      try {
+        const retryAfter = JSON.parse(event.reason).retry_after_ms;
+        if (typeof retryAfter === 'number') {
+          this.reconnectAttempts += 1;
+          return retryAfter;
+        }
+      } catch (error) {
+        // Reason không phải JSON: dùng backoff
+      }
+    }
+    const base = Math.min(RECONNECT_MAX_MS, RECONNECT_MIN_MS * 2 ** this.reconnectAttempts);
+    this.reconnectAttempts += 1;
+    // Jitter để các client không reconnect cùng lúc (sau deploy)
+    return base / 2 + Math.random() * (base / 2);
+  }
+
+  scheduleReconnect(delay) {
+    clearTimeout(this.reconnectTimer);
+    console.log(`WebSocket reconnect sau ${Math.round(delay)} ms`);
+    this.reconnectTimer = setTimeout(() => {
+      this.reconnectTimer = null;
+      if (this.token) {
+        this.connect(this.token);
+      }
+    }, delay);
+  }
+
+  // Trả về false nếu bỏ qua event (đã nhận rồi, hoặc đến trước event còn thiếu)
+  trackSeq(data) {
+    const seq = data.data?.seq;
+    if (data.type === 'BROADCAST') {
+      return this.advanceSeq('broadcast', seq);
+    }
+    if (['PRIVATE_MESSAGE', 'FILE_REQUEST', 'READ_RECEIPT'].includes(data.type)) {
+      return this.advanceSeq('user', seq);
+    }
+    if (data.type === 'SUCCESS' && data.data?.action === 'chat'
+      && typeof data.data.broadcast_seq === 'number') {
+      // Broadcast của chính mình không được gửi lại, server báo seq trong response
+      this.advanceSeq('broadcast', data.data.broadcast_seq);
+    }
+    return true;
+  }
+
+  advanceSeq(stream, seq) {
+    const key = stream === 'broadcast' ? 'lastBroadcastSeq' : 'lastSeq';
+    const last = this[key];
+    if (typeof seq !== 'number' || last === null) {
+      if (typeof seq === 'number') this[key] = seq;
+      return true;
+    }
+    if (seq <= last) {
+      // Replay trùng với event đã nhận
+      return false;
+    }
+    if (seq > last + 1) {
+      // Event ghi từ process khác (REST API) không được đẩy real-time: xin replay từ last,
+      // event này sẽ nằm trong phần replay
+      if (!this.syncing[stream]) {
+        this.syncing[stream] = true;
+        this.send({ type: 'SYNC', data: { stream, last_seq: last } });
+      }
+      return false;
+    }
+    this[key] = seq;
+    this.syncing[stream] = false;
+    return true;
+  }
+
+  trackDelivery(data) {
+    if (data.type !== 'PRIVATE_MESSAGE' || typeof data.data?.id !== 'number') {
+      return;
+    }
+    if (data.data.receiver !== this.username) {
+      return;
+    }
+    this.pendingAcks.push(data.data.id);
+    if (!this.ackTimer) {
+      this.ackTimer = setTimeout(() => this.flushAcks(), ACK_DELAY_MS);
+    }
+  }
+
+  flushAcks() {
+    this.ackTimer = null;
+    if (this.pendingAcks.length === 0) {
+      return;
+    }
+    const ids = this.pendingAcks.splice(0, MAX_ACK_IDS);
+    this.send({ type: 'DELIVERY_ACK', data: { ids } });
+    if (this.pendingAcks.length > 0) {
+      this.ackTimer = setTimeout(() => this.flushAcks(), 0);
+    }
+  }
+
   disconnect() {
+    // Đóng chủ động: không reconnect
+    this.token = null;
+    clearTimeout(this.reconnectTimer);
+    this.reconnectTimer = null;
+    this.reconnectAttempts = 0;
     if (this.socket) {
       this.socket.close();
       this.socket = null;
     }
+    // Đóng chủ động (logout): user sau không dùng lại seq của user trước
+    this.lastSeq = null;
+    this.lastBroadcastSeq = null;
+    this.syncing = { user: false, broadcast: false };
+    this.username = null;
+    this.pendingAcks = [];
+    clearTimeout(this.ackTimer);
+    this.ackTimer = null;
   }
 
   on(event, callback) {
@@ -113,27 +320,46 @@ class WebSocketService {
     }
   }
 
+  send(payload) {
+    if (this.socket?.readyState !== WebSocket.OPEN) {
+      return;
+    }
+    // Dùng codec nhị phân nếu server đã chấp nhận subprotocol
+    if (this.socket.protocol === BINARY_SUBPROTOCOL) {
+      this.socket.send(encode(payload));
+    } else {
+      this.socket.send(JSON.stringify(payload));
+    }
+  }
+
   sendMessage(message, receiver = null) {
-    if (this.socket?.readyState === WebSocket.OPEN) {
-      this.socket.send(JSON.stringify({
-        type: 'CHAT',
-        data: { message, receiver },
-      }));
+    this.send({
+      type: 'CHAT',
+      data: { message, receiver },
+    });
+  }
+
+  markRead(peer, messageId) {
+    if (this.socket?.readyState !== WebSocket.OPEN) {
+      return false;
     }
+    this.send({
+      type: 'MARK_READ',
+      data: { peer, message_id: messageId },
+    });
+    return true;
   }
 
   sendFile(file, receiver = null) {
-    if (this.socket?.readyState === WebSocket.OPEN) {
-      // File transfer qua WebSocket (có thể dùng REST API thay thế)
-      this.socket.send(JSON.stringify({
-        type: 'FILE_REQUEST',
-        data: {
-          filename: file.name,
-          size: file.size,
-          receiver,
-        },
-      }));
-    }
+    // File transfer qua WebSocket (có thể dùng REST API thay thế)
+    this.send({
+      type: 'FILE_REQUEST',
+      data: {
+        filename: file.name,
+        size: file.size,
+        receiver,
+      },
+    });
   }
 }
 
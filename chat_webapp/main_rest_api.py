@@ -4,8 +4,14 @@ Main entry point cho RESTful API server
 import asyncio
 import sys
 import argparse
+import logging
 from pathlib import Path
+from backend.log import LogSettings, setup_logging, shutdown_logging
 from backend.rest_api import RESTAPIServer
+from backend.rate_limit import RateLimiter
+from backend.loop_monitor import LoopMonitor
+from backend.admin import AdminSettings
+from backend.capture import CaptureSettings
 
 def main():
     parser = argparse.ArgumentParser(description='RESTful API Chat Server')
@@ -14,9 +20,31 @@ def main():
     parser.add_argument('--ssl-cert', default='server.crt', help='SSL certificate file (default: server.crt)')
     parser.add_argument('--ssl-key', default='server.key', help='SSL key file (default: server.key)')
     parser.add_argument('--no-ssl', action='store_true', help='Chạy server không SSL')
+    parser.add_argument('--no-rate-limit', action='store_true', help='Tắt rate limit theo user/connection')
+    parser.add_argument('--no-loop-monitor', action='store_true', help='Tắt đo loop lag và phát hiện bước chậm')
+    parser.add_argument('--slow-threshold-ms', type=float, default=100.0, help='Ngưỡng ghi nhận loop bị chặn/bước chậm (default: 100)')
+    parser.add_argument('--log-level', default='info', help='Log level: debug, info, warning, error (default: info)')
+    parser.add_argument('--log-module', action='append', default=[], metavar='MODULE=LEVEL',
+                        help='Log level riêng cho module, vd. backend.rest_api.access=warning (lặp lại được)')
+    parser.add_argument('--log-json', action='store_true', help='Ghi log dạng JSON (mỗi dòng một object)')
+    parser.add_argument('--log-sample', type=int, default=1, help='Chỉ giữ 1/N log DEBUG của từng message (default: 1)')
+    parser.add_argument('--no-admin', action='store_true', help='Tắt /admin (profile, heap snapshot, state)')
+    parser.add_argument('--admin-token', default=None, help='Token cho header X-Admin-Token (mặc định: env CHAT_ADMIN_TOKEN; không có thì chỉ localhost)')
+    parser.add_argument('--capture', default=None, metavar='PATH', help='Ghi traffic inbound ra file capture để replay (benchmarks/replay.py)')
+    parser.add_argument('--capture-max-mb', type=float, default=64.0, help='Kích thước mỗi file capture trước khi xoay (default: 64)')
+    parser.add_argument('--capture-files', type=int, default=5, help='Số file capture giữ lại khi xoay (default: 5)')
     
     args = parser.parse_args()
     
+    # Log ghi ở thread nền, không chặn event loop
+    try:
+        module_levels = LogSettings.parse_module_levels(args.log_module)
+        setup_logging(LogSettings(level=args.log_level, module_levels=module_levels, json=args.log_json,
+                                  sample_every=args.log_sample))
+    except ValueError as e:
+        parser.error(str(e))
+    logger = logging.getLogger("backend.main")
+    
     # Kiểm tra SSL files
     ssl_cert = None
     ssl_key = None
@@ -25,24 +53,32 @@ def main():
         if Path(args.ssl_cert).exists() and Path(args.ssl_key).exists():
             ssl_cert = args.ssl_cert
             ssl_key = args.ssl_key
-            print(f"Sử dụng SSL certificate: {ssl_cert}")
+            logger.info("Sử dụng SSL certificate: %s", ssl_cert)
         else:
-            print(f"Warning: SSL certificate không tìm thấy. Chạy server không SSL.")
-            print(f"Để tạo SSL certificate, chạy: python backend/generate_ssl_cert.py")
+            logger.warning("SSL certificate không tìm thấy. Chạy server không SSL.")
+            logger.warning("Để tạo SSL certificate, chạy: python backend/generate_ssl_cert.py")
     
     # Tạo và khởi động server
     server = RESTAPIServer(
         host=args.host,
         port=args.port,
         ssl_cert=ssl_cert,
-        ssl_key=ssl_key
+        ssl_key=ssl_key,
+        rate_limiter=RateLimiter(enabled=not args.no_rate_limit),
+        loop_monitor=LoopMonitor(threshold=args.slow_threshold_ms / 1000, enabled=not args.no_loop_monitor),
+        admin=AdminSettings(enabled=not args.no_admin, token=args.admin_token),
+        capture=CaptureSettings(path=args.capture, max_bytes=int(args.capture_max_mb * 1024 * 1024),
+                                max_files=args.capture_files)
     )
     
     try:
         asyncio.run(server.start())
     except KeyboardInterrupt:
-        print("\nĐang dừng server...")
+        logger.info("Đang dừng server...")
         sys.exit(0)
+    finally:
+        server.capture.close()
+        shutdown_logging()
 
 if __name__ == "__main__":
     main()
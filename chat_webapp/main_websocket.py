@@ -4,8 +4,17 @@ Main entry point cho WebSocket server
 import asyncio
 import sys
 import argparse
+import logging
 from pathlib import Path
+from backend.log import LogSettings, setup_logging, shutdown_logging
 from backend.websocket_server import WebSocketChatServer
+from backend.compression import CompressionSettings
+from backend.heartbeat import HeartbeatSettings
+from backend.admission import AdmissionSettings
+from backend.rate_limit import RateLimiter
+from backend.loop_monitor import LoopMonitor
+from backend.admin import AdminSettings
+from backend.capture import CaptureSettings
 
 def main():
     parser = argparse.ArgumentParser(description='WebSocket Chat Server')
@@ -14,9 +23,45 @@ def main():
     parser.add_argument('--ssl-cert', default='server.crt', help='SSL certificate file (default: server.crt)')
     parser.add_argument('--ssl-key', default='server.key', help='SSL key file (default: server.key)')
     parser.add_argument('--no-ssl', action='store_true', help='Chạy server không SSL')
+    parser.add_argument('--no-rate-limit', action='store_true', help='Tắt rate limit theo user/connection')
+    parser.add_argument('--no-loop-monitor', action='store_true', help='Tắt đo loop lag và phát hiện bước chậm')
+    parser.add_argument('--slow-threshold-ms', type=float, default=100.0, help='Ngưỡng ghi nhận loop bị chặn/bước chậm (default: 100)')
+    parser.add_argument('--log-level', default='info', help='Log level: debug, info, warning, error (default: info)')
+    parser.add_argument('--log-module', action='append', default=[], metavar='MODULE=LEVEL',
+                        help='Log level riêng cho module, vd. backend.rest_api.access=warning (lặp lại được)')
+    parser.add_argument('--log-json', action='store_true', help='Ghi log dạng JSON (mỗi dòng một object)')
+    parser.add_argument('--log-sample', type=int, default=1, help='Chỉ giữ 1/N log DEBUG của từng message (default: 1)')
+    parser.add_argument('--no-admin', action='store_true', help='Tắt /admin (profile, heap snapshot, state)')
+    parser.add_argument('--admin-token', default=None, help='Token cho header X-Admin-Token (mặc định: env CHAT_ADMIN_TOKEN; không có thì chỉ localhost)')
+    parser.add_argument('--capture', default=None, metavar='PATH', help='Ghi traffic inbound ra file capture để replay (benchmarks/replay.py)')
+    parser.add_argument('--capture-max-mb', type=float, default=64.0, help='Kích thước mỗi file capture trước khi xoay (default: 64)')
+    parser.add_argument('--capture-files', type=int, default=5, help='Số file capture giữ lại khi xoay (default: 5)')
+    parser.add_argument('--tcp-port', type=int, default=None, help='Port cho raw TCP/TLS listener (mặc định: tắt)')
+    parser.add_argument('--no-compress', action='store_true', help='Tắt permessage-deflate')
+    parser.add_argument('--compress-level', type=int, default=1, help='zlib level 0-9 (default: 1)')
+    parser.add_argument('--compress-window-bits', type=int, default=15, help='Window bits 9-15 (default: 15)')
+    parser.add_argument('--compress-no-context-takeover', action='store_true', help='Reset context nén sau mỗi message')
+    parser.add_argument('--compress-threshold', type=int, default=256, help='Frame nhỏ hơn (bytes) gửi không nén (default: 256)')
+    parser.add_argument('--no-heartbeat', action='store_true', help='Tắt ping/pong và dọn connection chết')
+    parser.add_argument('--ping-interval', type=float, default=30.0, help='Gửi ping khi connection im lặng N giây (default: 30)')
+    parser.add_argument('--pong-timeout', type=float, default=10.0, help='Đóng connection không trả lời ping sau N giây (default: 10)')
+    parser.add_argument('--idle-timeout', type=float, default=0.0, help='Đóng connection không gửi message N giây (default: 0 = tắt)')
+    parser.add_argument('--no-admission', action='store_true', help='Tắt giới hạn nhận connection mới')
+    parser.add_argument('--accept-rate', type=float, default=200.0, help='Số connection mới nhận mỗi giây (default: 200)')
+    parser.add_argument('--accept-burst', type=int, default=400, help='Số connection nhận dồn tối đa (default: 400)')
+    parser.add_argument('--max-handshakes', type=int, default=100, help='Số handshake xử lý đồng thời tối đa (default: 100)')
     
     args = parser.parse_args()
     
+    # Log ghi ở thread nền, không chặn event loop
+    try:
+        module_levels = LogSettings.parse_module_levels(args.log_module)
+        setup_logging(LogSettings(level=args.log_level, module_levels=module_levels, json=args.log_json,
+                                  sample_every=args.log_sample))
+    except ValueError as e:
+        parser.error(str(e))
+    logger = logging.getLogger("backend.main")
+    
     # Kiểm tra SSL files
     ssl_cert = None
     ssl_key = None
@@ -25,24 +70,52 @@ def main():
         if Path(args.ssl_cert).exists() and Path(args.ssl_key).exists():
             ssl_cert = args.ssl_cert
             ssl_key = args.ssl_key
-            print(f"Sử dụng SSL certificate: {ssl_cert}")
+            logger.info("Sử dụng SSL certificate: %s", ssl_cert)
         else:
-            print(f"Warning: SSL certificate không tìm thấy. Chạy server không SSL.")
-            print(f"Để tạo SSL certificate, chạy: python backend/generate_ssl_cert.py")
+            logger.warning("SSL certificate không tìm thấy. Chạy server không SSL.")
+            logger.warning("Để tạo SSL certificate, chạy: python backend/generate_ssl_cert.py")
     
     # Tạo và khởi động server
     server = WebSocketChatServer(
         host=args.host,
         port=args.port,
         ssl_cert=ssl_cert,
-        ssl_key=ssl_key
+        ssl_key=ssl_key,
+        tcp_port=args.tcp_port,
+        compression=CompressionSettings(
+            enabled=not args.no_compress,
+            level=args.compress_level,
+            window_bits=args.compress_window_bits,
+            context_takeover=not args.compress_no_context_takeover,
+            threshold=args.compress_threshold
+        ),
+        heartbeat=HeartbeatSettings(
+            enabled=not args.no_heartbeat,
+            ping_interval=args.ping_interval,
+            pong_timeout=args.pong_timeout,
+            idle_timeout=args.idle_timeout
+        ),
+        admission=AdmissionSettings(
+            enabled=not args.no_admission,
+            accept_rate=args.accept_rate,
+            accept_burst=args.accept_burst,
+            max_handshakes=args.max_handshakes
+        ),
+        rate_limiter=RateLimiter(enabled=not args.no_rate_limit),
+        loop_monitor=LoopMonitor(threshold=args.slow_threshold_ms / 1000, enabled=not args.no_loop_monitor),
+        admin=AdminSettings(enabled=not args.no_admin, token=args.admin_token),
+        capture=CaptureSettings(path=args.capture, max_bytes=int(args.capture_max_mb * 1024 * 1024),
+                                max_files=args.capture_files)
     )
     
     try:
         asyncio.run(server.start())
     except KeyboardInterrupt:
-        print("\nĐang dừng server...")
+        logger.info("Đang dừng server...")
         sys.exit(0)
+    finally:
+        server.capture.close()
+        shutdown_logging()
 
 if __name__ == "__main__":
     main()
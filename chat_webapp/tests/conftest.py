@@ -0,0 +1,52 @@
+"""
+Fixture dùng chung cho test backend (chạy: python -m pytest trong chat_webapp/)
+Test async chạy bằng asyncio.run, không cần plugin pytest-asyncio
+"""
+import sys
+from pathlib import Path
+
+import bcrypt
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.database import Database  # noqa: E402
+
+_gensalt = bcrypt.gensalt
+
+
+class RecordingConnection:
+    """Connection giả, ghi lại mọi message server gửi đi"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+    async def send_bytes(self, payload):
+        self.sent.append(payload)
+
+    async def close(self):
+        self.closed = True
+
+    def types(self):
+        return [message["type"] for message in self.sent]
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Server ghi chat_app.db và uploads/ vào thư mục làm việc: mỗi test một thư mục tạm"""
+    monkeypatch.chdir(tmp_path)
+    # bcrypt mặc định 12 rounds (~0.2 s mỗi user), test không cần
+    monkeypatch.setattr(bcrypt, "gensalt", lambda rounds=4, prefix=b"2b": _gensalt(4, prefix))
+    return tmp_path
+
+
+@pytest.fixture
+def db(workdir):
+    database = Database(str(workdir / "chat_app.db"))
+    for username in ("alice", "bob", "carol"):
+        database.register_user(username, f"{username}@test.local", "password123")
+    return database
@@ -0,0 +1,105 @@
+"""Unread counter (mark_read), hàng chờ giao và event log trong Database"""
+from backend import database
+from backend.chat_handler import ChatHandler
+from backend.database import BROADCAST_STREAM
+
+
+def send(db, sender, receiver, text="hi"):
+    events = ChatHandler(db).save_message(sender, receiver, text)
+    return next(iter(events.values()))["data"]["id"]
+
+
+def test_unread_count_tracks_new_messages_and_mark_read(db):
+    ids = [send(db, "bob", "alice", f"m{i}") for i in range(5)]
+    send(db, "alice", "bob")  # Message của chính mình không tính là chưa đọc
+    assert db.get_read_state("alice", "bob") == {"last_read_id": 0, "unread_count": 5}
+
+    assert db.mark_read("alice", "bob", ids[1]) == (ids[1], 3)
+    assert db.get_read_state("alice", "bob") == {"last_read_id": ids[1], "unread_count": 3}
+    # Marker không lùi lại, đánh dấu lại cùng id không đổi gì
+    assert db.mark_read("alice", "bob", ids[0]) is None
+    assert db.mark_read("alice", "bob", ids[1]) is None
+    # Marker không vượt message mới nhất của conversation
+    assert db.mark_read("alice", "bob", 10 ** 9) == (ids[-1], 0)
+    assert db.get_read_states("alice") == {"bob": {"last_read_id": ids[-1], "unread_count": 0}}
+
+
+def test_mark_read_only_counts_messages_from_peer(db):
+    from_bob = send(db, "bob", "alice")
+    send(db, "carol", "alice")
+    assert db.mark_read("alice", "bob", from_bob + 1) == (from_bob, 0)
+    assert db.get_read_state("alice", "carol")["unread_count"] == 1
+
+
+def test_bulk_import_counts_unread(db):
+    rows = [("bob", "alice", f"m{i}", "text", None, "2024-01-01 00:00:00") for i in range(4)]
+    rows.append(("bob", None, "broadcast", "text", None, "2024-01-01 00:00:00"))
+    assert db.save_messages(rows) == 5
+    assert db.get_read_state("alice", "bob")["unread_count"] == 4
+
+
+def test_events_get_consecutive_seqs_per_stream(db):
+    send(db, "alice", "bob")
+    send(db, "alice", "carol")
+    ChatHandler(db).save_message("alice", None, "to all")
+    assert db.get_last_seqs(["alice", "bob", "carol", BROADCAST_STREAM]) == {
+        "alice": 2, "bob": 1, "carol": 1, BROADCAST_STREAM: 1
+    }
+    events = db.get_events_since("alice", 0, 10)
+    assert [event["data"]["seq"] for event in events] == [1, 2]
+    assert [event["data"]["receiver"] for event in events] == ["bob", "carol"]
+
+
+def test_event_log_trimmed_to_retention(db, monkeypatch):
+    monkeypatch.setattr(database, "EVENT_RETENTION", 5)
+    for i in range(12):
+        send(db, "alice", "bob", f"m{i}")
+    events = db.get_events_since("bob", 0, 100)
+    assert [event["data"]["seq"] for event in events] == list(range(8, 13))
+
+
+def pending_count(db, receiver):
+    conn = db.get_connection()
+    rows = conn.execute("SELECT COUNT(*) FROM pending_deliveries WHERE receiver_username = ?", (receiver,))
+    count = rows.fetchone()[0]
+    tracked = conn.execute("SELECT pending FROM pending_counts WHERE receiver_username = ?", (receiver,))
+    row = tracked.fetchone()
+    conn.close()
+    return count, row[0] if row else 0
+
+
+def test_pending_deliveries_capped_per_receiver(db, monkeypatch):
+    monkeypatch.setattr(database, "PENDING_DELIVERY_LIMIT", 10)
+    monkeypatch.setattr(database, "PENDING_TRIM_EVERY", 4)
+    # Xen kẽ hai receiver: giới hạn không phụ thuộc id message rơi vào ai
+    last_bob = None
+    for i in range(60):
+        receiver = "bob" if i % 3 else "carol"
+        message_id = send(db, "alice", receiver, f"m{i}")
+        if receiver == "bob":
+            last_bob = message_id
+        count, tracked = pending_count(db, receiver)
+        assert count == tracked
+        assert count < 10 + 4
+    pending = db.get_pending_deliveries("bob", 0, 100)
+    assert pending[-1]["data"]["id"] == last_bob
+    assert len(pending) >= 10
+
+
+def test_ack_deliveries_updates_pending_count(db):
+    ids = [send(db, "alice", "bob", f"m{i}") for i in range(5)]
+    assert db.ack_deliveries("bob", ids[:3] + [10 ** 9]) == 3
+    assert pending_count(db, "bob") == (2, 2)
+    assert [m["data"]["id"] for m in db.get_pending_deliveries("bob", 0, 10)] == ids[3:]
+    assert db.ack_deliveries("bob", []) == 0
+
+
+def test_pending_counts_rebuilt_at_startup(db):
+    for i in range(3):
+        send(db, "alice", "bob", f"m{i}")
+    conn = db.get_connection()
+    conn.execute("DELETE FROM pending_counts")
+    conn.commit()
+    conn.close()
+    database.Database(db.db_path)
+    assert pending_count(db, "bob") == (3, 3)
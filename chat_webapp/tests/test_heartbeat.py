@@ -0,0 +1,125 @@
+"""TimerWheel và HeartbeatMonitor (ping, pong timeout, idle timeout)"""
+import asyncio
+
+from backend.heartbeat import HeartbeatMonitor, HeartbeatSettings, TimerWheel
+from backend.session import Session
+
+
+def test_wheel_expires_after_rounded_up_ticks():
+    wheel = TimerWheel(slots=8, tick=1.0)
+    wheel.schedule("a", 2.5)
+    wheel.schedule("b", 0.1)  # Tối thiểu một tick
+    assert wheel.advance() == ["b"]
+    assert wheel.advance() == []
+    assert wheel.advance() == ["a"]
+    assert len(wheel) == 0
+
+
+def test_wheel_delay_longer_than_one_round():
+    wheel = TimerWheel(slots=8, tick=1.0)
+    wheel.schedule("late", 20)
+    expired = [(tick, item) for tick in range(1, 30) for item in wheel.advance()]
+    assert expired == [(20, "late")]
+
+
+def test_wheel_cancel_and_reschedule():
+    wheel = TimerWheel(slots=8, tick=1.0)
+    wheel.schedule("a", 1)
+    wheel.schedule("b", 1)
+    wheel.cancel("a")
+    wheel.cancel("missing")
+    wheel.schedule("b", 3)  # Dời lại: chỉ còn một deadline
+    assert wheel.advance(2) == []
+    assert wheel.advance() == ["b"]
+
+
+def test_wheel_advance_many_ticks_at_once():
+    wheel = TimerWheel(slots=4, tick=0.5)
+    for i in range(10):
+        wheel.schedule(i, i * 0.5 + 0.5)
+    assert sorted(wheel.advance(10)) == list(range(10))
+
+
+class FakeServer:
+    def __init__(self):
+        self.disconnected = []
+
+    async def disconnect_client(self, client_id):
+        self.disconnected.append(client_id)
+
+
+class PingConnection:
+    def __init__(self):
+        self.pings = 0
+
+    async def ping(self):
+        self.pings += 1
+
+
+def make_monitor(**settings):
+    server = FakeServer()
+    monitor = HeartbeatMonitor(server, HeartbeatSettings(tick=1.0, **settings))
+    return server, monitor
+
+
+def test_ping_then_reap_dead_connection():
+    async def scenario():
+        server, monitor = make_monitor(ping_interval=30, pong_timeout=10)
+        session = Session("ws_1", PingConnection(), None)
+        monitor.track(session)
+        now = session.last_seen + 30
+        monitor._check(session, now)
+        await asyncio.sleep(0)
+        assert session.conn.pings == 1
+        assert session.ping_sent == now
+        assert monitor.stats.pings_sent == 1
+        # Im lặng sau ping quá pong_timeout
+        monitor._check(session, now + 10)
+        await asyncio.sleep(0)
+        assert server.disconnected == ["ws_1"]
+        assert monitor.stats.reaped_dead == 1
+
+    asyncio.run(scenario())
+
+
+def test_pong_clears_pending_ping():
+    async def scenario():
+        server, monitor = make_monitor(ping_interval=30, pong_timeout=10)
+        session = Session("ws_1", PingConnection(), None)
+        monitor.track(session)
+        now = session.last_seen + 30
+        monitor._check(session, now)
+        session.last_seen = now + 1  # Nhận pong
+        monitor._check(session, now + 10)
+        await asyncio.sleep(0)
+        assert session.ping_sent is None
+        assert server.disconnected == []
+        assert session in monitor.wheel.deadlines
+
+    asyncio.run(scenario())
+
+
+def test_idle_timeout_reaps_without_ping():
+    async def scenario():
+        server, monitor = make_monitor(ping_interval=0, idle_timeout=60)
+        session = Session("tcp_1", object(), None)  # Raw TCP: không có ping
+        monitor.track(session)
+        assert session in monitor.wheel.deadlines
+        monitor._check(session, session.last_message + 59)
+        await asyncio.sleep(0)
+        assert server.disconnected == []
+        monitor._check(session, session.last_message + 60)
+        await asyncio.sleep(0)
+        assert server.disconnected == ["tcp_1"]
+        assert monitor.stats.reaped_idle == 1
+
+    asyncio.run(scenario())
+
+
+def test_disabled_or_unpingable_sessions_are_not_tracked():
+    _, monitor = make_monitor(enabled=False)
+    monitor.track(Session("ws_1", PingConnection(), None))
+    assert len(monitor.wheel) == 0
+    _, monitor = make_monitor(idle_timeout=0)
+    monitor.track(Session("tcp_1", object(), None))
+    assert len(monitor.wheel) == 0
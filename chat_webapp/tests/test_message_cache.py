@@ -0,0 +1,90 @@
+"""MessageCache: write path, bắt kịp ghi từ process khác qua data_version và reset khi thiếu quá nhiều"""
+from backend import message_cache
+from backend.chat_handler import ChatHandler
+from backend.database import Database
+from backend.message_cache import MessageCache
+
+
+def page_ids(cache, username, receiver, limit=10):
+    page = cache.get_page(username, receiver, limit, 0)
+    return [message["id"] for message in page]
+
+
+def other_process(db):
+    """Database/ChatHandler riêng, như process WebSocket ghi cùng file"""
+    return ChatHandler(Database(db.db_path))
+
+
+def test_write_path_updates_cached_conversation(db):
+    cache = MessageCache(db)
+    handler = ChatHandler(db, message_cache=cache)
+    first = handler.save_message("alice", "bob", "a")["bob"]["data"]["id"]
+    assert page_ids(cache, "alice", "bob") == [first]
+    second = handler.save_message("bob", "alice", "b")["alice"]["data"]["id"]
+    assert page_ids(cache, "bob", "alice") == [second, first]
+    assert cache.latest("alice", "bob")["message"] == "b"
+    assert cache.snapshot()["hits"] >= 2
+
+
+def test_catch_up_on_data_version_change(db):
+    cache = MessageCache(db)
+    ChatHandler(db, message_cache=cache).save_message("alice", "bob", "a")
+    assert len(page_ids(cache, "alice", "bob")) == 1
+
+    writer = other_process(db)
+    ids = [writer.save_message("bob", "alice", f"m{i}")["alice"]["data"]["id"] for i in range(3)]
+    writer.save_message("alice", "carol", "not cached")
+    # Không có add() nào: cache phát hiện qua PRAGMA data_version
+    assert page_ids(cache, "alice", "bob")[:3] == ids[::-1]
+    assert cache.catch_up_rows == 4
+    assert cache.resets == 0
+
+
+def test_add_out_of_order_catches_up_first(db):
+    cache = MessageCache(db)
+    handler = ChatHandler(db, message_cache=cache)
+    handler.save_message("alice", "bob", "a")
+    page_ids(cache, "alice", "bob")
+    other_process(db).save_message("bob", "alice", "from other process")
+    handler.save_message("alice", "bob", "c")
+    assert [m["message"] for m in cache.get_page("alice", "bob", 3, 0)] == ["c", "from other process", "a"]
+
+
+def test_large_gap_resets_cache(db, monkeypatch):
+    monkeypatch.setattr(message_cache, "CATCH_UP_BATCH", 5)
+    monkeypatch.setattr(message_cache, "CATCH_UP_MAX_BATCHES", 2)
+    cache = MessageCache(db)
+    ChatHandler(db, message_cache=cache).save_message("alice", "bob", "a")
+    page_ids(cache, "alice", "bob")
+    assert cache.snapshot()["conversations"] == 1
+
+    writer = other_process(db)
+    ids = [writer.save_message("bob", "alice", f"m{i}")["alice"]["data"]["id"] for i in range(11)]
+    assert cache.latest("alice", "bob") is None  # Cache đã bị xóa
+    assert cache.resets == 1
+    assert cache.catch_up_rows == 0
+    assert cache.snapshot()["conversations"] == 0
+    # Đọc lại từ database, sau đó tiếp tục cập nhật bình thường
+    assert page_ids(cache, "alice", "bob", 11) == ids[::-1]
+    next_id = writer.save_message("bob", "alice", "after reset")["alice"]["data"]["id"]
+    assert page_ids(cache, "alice", "bob", 1) == [next_id]
+    assert cache.resets == 1
+
+
+def test_small_gap_below_threshold_is_replayed(db, monkeypatch):
+    monkeypatch.setattr(message_cache, "CATCH_UP_BATCH", 5)
+    monkeypatch.setattr(message_cache, "CATCH_UP_MAX_BATCHES", 2)
+    cache = MessageCache(db)
+    page_ids(cache, "alice", "bob")
+    writer = other_process(db)
+    for i in range(10):
+        writer.save_message("bob", "alice", f"m{i}")
+    assert len(page_ids(cache, "alice", "bob")) == 10
+    assert cache.resets == 0
+    assert cache.catch_up_rows == 10
+
+
+def test_page_outside_cache_is_a_miss(db):
+    cache = MessageCache(db, per_conversation=5)
+    assert cache.get_page("alice", "bob", 10, 0) is None
+    assert cache.get_page("alice", "bob", 5, 0) == []
@@ -0,0 +1,207 @@
+"""Codec JSON/nhị phân, FrameDecoder và Message.encode/decode"""
+import json
+import random
+
+import pytest
+
+from backend.protocol import (
+    BINARY_CODEC, JSON_CODEC, INTERNED_STRINGS, FRAME_HEADER_SIZE,
+    FrameDecoder, FrameDecodeError, FrameTooLargeError, Message, MessageType, get_codec,
+)
+
+SAMPLES = [
+    {"type": "CHAT", "data": {"message": "xin chào", "receiver": "bob"}},
+    {"type": "PRIVATE_MESSAGE", "data": {"sender": "alice", "seq": 42, "id": 7, "timestamp": "2024-01-01 12:00:00"}},
+    {"type": "BATCH", "data": {"messages": [{"type": "BROADCAST", "data": {"seq": i}} for i in range(20)]}},
+    {"type": "USER_LIST", "data": {"users": [f"user{i}" for i in range(40)], "online": True, "away": None}},
+    {"type": "ERROR", "data": {"success": False, "message": "x" * 300, "ratio": 0.25, "delta": -3}},
+    {"type": "FILE_DATA", "data": {f"k{i}": i for i in range(20)}},
+    {},
+    [],
+]
+
+INTS = [0, 1, 127, 128, 255, 256, 65535, 65536, 2 ** 32 - 1, 2 ** 32, 2 ** 63 - 1,
+        -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31, -2 ** 31 - 1, -2 ** 63]
+
+
+def frame(payload: bytes) -> bytes:
+    return len(payload).to_bytes(FRAME_HEADER_SIZE, 'big') + payload
+
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, BINARY_CODEC], ids=lambda c: c.name)
+@pytest.mark.parametrize("message", SAMPLES)
+def test_codec_round_trip(codec, message):
+    encoded = codec.dumps(message)
+    assert codec.loads(encoded) == message
+    assert codec.loads(memoryview(encoded)) == message
+
+
+@pytest.mark.parametrize("value", INTS)
+def test_binary_int_boundaries(value):
+    assert BINARY_CODEC.loads(BINARY_CODEC.dumps(value)) == value
+    assert BINARY_CODEC.loads(BINARY_CODEC.dumps({"seq": value})) == {"seq": value}
+
+
+@pytest.mark.parametrize("length", [0, 31, 32, 255, 256, 65535, 65536])
+def test_binary_string_and_bytes_lengths(length):
+    text = "é" * (length // 2) + "a" * (length % 2)
+    assert BINARY_CODEC.loads(BINARY_CODEC.dumps(text)) == text
+    raw = bytes(range(256)) * (length // 256) + bytes(length % 256)
+    assert BINARY_CODEC.loads(BINARY_CODEC.dumps(raw)) == raw
+
+
+def test_binary_collections_beyond_fixed_size():
+    big_list = list(range(70000))
+    big_map = {str(i): i for i in range(70000)}
+    assert BINARY_CODEC.loads(BINARY_CODEC.dumps(big_list)) == big_list
+    assert BINARY_CODEC.loads(BINARY_CODEC.dumps(big_map)) == big_map
+
+
+def test_binary_interned_strings_take_three_bytes():
+    for value in INTERNED_STRINGS:
+        encoded = BINARY_CODEC.dumps(value)
+        assert len(encoded) == 3
+        assert BINARY_CODEC.loads(encoded) == value
+
+
+def test_binary_is_smaller_than_json():
+    message = SAMPLES[1]
+    assert len(BINARY_CODEC.dumps(message)) < len(JSON_CODEC.dumps(message))
+
+
+def test_binary_rejects_trailing_bytes_and_unknown_input():
+    with pytest.raises(ValueError):
+        BINARY_CODEC.loads(BINARY_CODEC.dumps({"a": 1}) + b"\x00")
+    with pytest.raises(ValueError):
+        BINARY_CODEC.loads(b"\xc1")
+    with pytest.raises(ValueError):
+        BINARY_CODEC.loads(bytes((0xd4, 0x7f, 0x00)))
+    with pytest.raises(TypeError):
+        BINARY_CODEC.dumps({"a": object()})
+
+
+@pytest.mark.parametrize("message", SAMPLES[:6])
+def test_binary_truncated_payload_raises(message):
+    encoded = BINARY_CODEC.dumps(message)
+    for cut in range(1, len(encoded)):
+        with pytest.raises(ValueError):
+            BINARY_CODEC.loads(encoded[:cut])
+
+
+def test_get_codec_defaults_to_json():
+    assert get_codec("chatchit.msgpack") is BINARY_CODEC
+    assert get_codec(None) is JSON_CODEC
+    assert get_codec("unknown") is JSON_CODEC
+
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, BINARY_CODEC], ids=lambda c: c.name)
+def test_decoder_byte_by_byte(codec):
+    stream = b"".join(frame(codec.dumps(message)) for message in SAMPLES)
+    decoder = FrameDecoder(codec=codec)
+    received = []
+    for i in range(len(stream)):
+        received += decoder.feed(stream[i:i + 1])
+    assert received == SAMPLES
+    assert decoder.buffered == 0
+
+
+def test_decoder_keeps_truncated_frame_until_complete():
+    payload = JSON_CODEC.dumps(SAMPLES[0])
+    data = frame(payload)
+    decoder = FrameDecoder()
+    assert decoder.feed(data[:2]) == []
+    assert decoder.feed(data[2:-3]) == []
+    assert decoder.buffered == len(data) - 3
+    assert decoder.feed(data[-3:]) == [SAMPLES[0]]
+    assert decoder.buffered == 0
+
+
+def test_decoder_with_sizes():
+    payload = JSON_CODEC.dumps(SAMPLES[0])
+    assert FrameDecoder(with_sizes=True).feed(frame(payload)) == [(SAMPLES[0], len(payload))]
+
+
+def test_decoder_skips_garbage_frames_and_keeps_good_ones():
+    good = [frame(JSON_CODEC.dumps({"type": "CHAT", "data": {"n": i}})) for i in range(3)]
+    bad = frame(b"{not json")
+    decoder = FrameDecoder()
+    with pytest.raises(FrameDecodeError) as info:
+        decoder.feed(good[0] + bad + good[1] + bad + good[2])
+    assert info.value.errors == 2
+    assert [m["data"]["n"] for m in info.value.messages] == [0, 1, 2]
+    # Decoder vẫn dùng tiếp được sau frame lỗi
+    assert decoder.buffered == 0
+    assert decoder.feed(good[0]) == [{"type": "CHAT", "data": {"n": 0}}]
+
+
+def test_decoder_garbage_split_across_feeds():
+    good = frame(JSON_CODEC.dumps({"ok": 1}))
+    bad = frame(b"\xff\xfe")
+    data = bad + good
+    decoder = FrameDecoder()
+    assert decoder.feed(data[:3]) == []
+    with pytest.raises(FrameDecodeError) as info:
+        decoder.feed(data[3:])
+    assert info.value.errors == 1
+    assert info.value.messages == [{"ok": 1}]
+
+
+def test_decoder_frame_too_large():
+    decoder = FrameDecoder(max_frame_size=16)
+    good = frame(JSON_CODEC.dumps({"a": 1}))
+    with pytest.raises(FrameTooLargeError) as info:
+        decoder.feed(good + (1000).to_bytes(FRAME_HEADER_SIZE, 'big') + b"x" * 10)
+    assert info.value.messages == [{"a": 1}]
+    decoder.reset()
+    assert decoder.buffered == 0
+    assert decoder.feed(good) == [{"a": 1}]
+
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, BINARY_CODEC], ids=lambda c: c.name)
+@pytest.mark.parametrize("seed", range(5))
+def test_decoder_fuzz(codec, seed):
+    """Xen frame lỗi vào luồng frame hợp lệ, cắt thành chunk ngẫu nhiên"""
+    rng = random.Random(seed)
+    expected = []
+    stream = bytearray()
+    bad_frames = 0
+    for i in range(200):
+        if rng.random() < 0.2:
+            garbage = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 40)))
+            try:
+                codec.loads(garbage)
+            except Exception:
+                stream += frame(garbage)
+                bad_frames += 1
+                continue
+        message = {"type": "CHAT", "data": {"n": i, "text": "x" * rng.randrange(0, 300)}}
+        expected.append(message)
+        stream += frame(codec.dumps(message))
+
+    decoder = FrameDecoder(codec=codec)
+    received, errors, offset = [], 0, 0
+    while offset < len(stream):
+        size = rng.randrange(1, 512)
+        try:
+            received += decoder.feed(bytes(stream[offset:offset + size]))
+        except FrameDecodeError as e:
+            received += e.messages
+            errors += e.errors
+        offset += size
+    assert received == expected
+    assert errors == bad_frames
+    assert decoder.buffered == 0
+
+
+def test_message_encode_decode():
+    data = {"message": "hi", "receiver": "bob"}
+    for codec in (JSON_CODEC, BINARY_CODEC):
+        encoded = Message.encode(MessageType.CHAT, data, codec)
+        assert Message.decode(encoded, codec) == {"type": "CHAT", "data": data}
+        assert Message.decode(encoded[:-1], codec) is None
+    assert json.loads(Message.encode(MessageType.CHAT, data)[4:]) == {"type": "CHAT", "data": data}
+
+
+def test_message_response():
+    response = Message.response(MessageType.SUCCESS, True, "ok", {"seq": 1})
+    assert response == {"type": "SUCCESS", "data": {"success": True, "message": "ok", "seq": 1}}
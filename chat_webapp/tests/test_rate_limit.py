@@ -0,0 +1,94 @@
+"""TokenBucket và RateLimiter theo connection / theo user"""
+import pytest
+
+from backend.rate_limit import (
+    RateLimit, RateLimiter, TokenBucket,
+    RATE_CLASS_CONTROL, RATE_CLASS_FILE_BYTES, RATE_CLASS_MESSAGE,
+)
+
+
+def elapse(bucket: TokenBucket, seconds: float):
+    """Giả lập thời gian trôi qua mà không cần sleep"""
+    bucket.updated -= seconds
+
+
+def test_token_bucket_burst_and_refill():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert all(bucket.try_acquire() for _ in range(3))
+    assert not bucket.try_acquire()
+    assert bucket.wait_time() == pytest.approx(0.1, abs=0.01)
+    elapse(bucket, 0.1)
+    assert bucket.try_acquire()
+    # Không nạp quá burst
+    elapse(bucket, 100)
+    assert bucket.wait_time(3) == 0.0
+    assert bucket.wait_time(4) > 0
+
+
+def test_token_bucket_zero_rate_never_refills():
+    bucket = TokenBucket(rate=0, burst=1)
+    assert bucket.try_acquire()
+    assert bucket.wait_time() == float('inf')
+
+
+def limiter(**kwargs):
+    return RateLimiter(
+        per_connection={RATE_CLASS_MESSAGE: RateLimit(1, 2), RATE_CLASS_FILE_BYTES: RateLimit(100, 1000)},
+        per_user={RATE_CLASS_MESSAGE: RateLimit(1, 3)},
+        **kwargs
+    )
+
+
+def test_per_connection_limit():
+    rl = limiter()
+    assert rl.check(RATE_CLASS_MESSAGE, connection="c1") is None
+    assert rl.check(RATE_CLASS_MESSAGE, connection="c1") is None
+    assert rl.check(RATE_CLASS_MESSAGE, connection="c1") > 0
+    # Connection khác có bucket riêng
+    assert rl.check(RATE_CLASS_MESSAGE, connection="c2") is None
+    assert rl.stats.throttled == {"message:connection": 1}
+
+
+def test_per_user_limit_spans_connections():
+    rl = limiter()
+    assert rl.check(RATE_CLASS_MESSAGE, username="alice", connection="c1") is None
+    assert rl.check(RATE_CLASS_MESSAGE, username="alice", connection="c2") is None
+    assert rl.check(RATE_CLASS_MESSAGE, username="alice", connection="c3") is None
+    assert rl.check(RATE_CLASS_MESSAGE, username="alice", connection="c4") > 0
+    assert rl.stats.throttled == {"message:user": 1}
+
+
+def test_throttled_request_consumes_no_tokens():
+    rl = limiter()
+    rl.check(RATE_CLASS_MESSAGE, username="alice", connection="c1")
+    rl.check(RATE_CLASS_MESSAGE, username="alice", connection="c1")
+    assert rl.check(RATE_CLASS_MESSAGE, username="alice", connection="c1") > 0
+    # Bucket user không bị trừ khi bucket connection chặn
+    assert rl.buckets[("user", "alice", RATE_CLASS_MESSAGE)].tokens == pytest.approx(1, abs=0.01)
+
+
+def test_cost_above_burst_needs_full_bucket():
+    rl = limiter()
+    assert rl.check(RATE_CLASS_FILE_BYTES, cost=5000, connection="c1") is None
+    assert rl.check(RATE_CLASS_FILE_BYTES, cost=5000, connection="c1") == pytest.approx(10, rel=0.01)
+
+
+def test_unlimited_class_and_disabled_limiter():
+    rl = limiter()
+    for _ in range(100):
+        assert rl.check(RATE_CLASS_CONTROL, username="alice", connection="c1") is None
+    disabled = limiter(enabled=False)
+    for _ in range(100):
+        assert disabled.check(RATE_CLASS_MESSAGE, connection="c1") is None
+    assert disabled.snapshot()["buckets"] == 0
+
+
+def test_forget_connection_and_lru_bound():
+    rl = limiter(max_buckets=3)
+    for i in range(5):
+        rl.check(RATE_CLASS_MESSAGE, connection=f"c{i}")
+    assert len(rl.buckets) == 3
+    assert ("connection", "c0", RATE_CLASS_MESSAGE) not in rl.buckets
+    rl.forget_connection("c4")
+    assert ("connection", "c4", RATE_CLASS_MESSAGE) not in rl.buckets
+    assert rl.snapshot()["allowed"][RATE_CLASS_MESSAGE] == 5
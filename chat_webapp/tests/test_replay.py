@@ -0,0 +1,147 @@
+"""Replay theo seq khi reconnect, SYNC khi client thấy seq nhảy cóc, RESYNC khi không replay được"""
+import asyncio
+
+import pytest
+
+from backend import websocket_server
+from backend.chat_handler import ChatHandler
+from backend.database import Database
+from backend.protocol import JSON_CODEC, MessageType
+from backend.rate_limit import RateLimiter
+from backend.websocket_server import WebSocketChatServer
+
+from conftest import RecordingConnection
+
+
+@pytest.fixture
+def server(db):
+    # Database() của server mở chat_app.db trong thư mục làm việc, cùng file với fixture db
+    return WebSocketChatServer(rate_limiter=RateLimiter(enabled=False))
+
+
+def connect(server, username=None):
+    conn = RecordingConnection()
+    session = server.register_connection("test", conn, JSON_CODEC)
+    if username:
+        server.sessions.authenticate(session.client_id, username)
+    return session, conn
+
+
+def write_from_other_process(db, sender, receiver, count):
+    """Ghi qua Database/ChatHandler riêng (như REST API): không đẩy real-time tới session nào"""
+    handler = ChatHandler(Database(db.db_path))
+    return [handler.save_message(sender, receiver, f"m{i}") for i in range(count)]
+
+
+def seqs(messages):
+    return [m["data"]["seq"] for m in messages if "seq" in m["data"]]
+
+
+def test_replay_small_gap_in_order(server, db):
+    write_from_other_process(db, "alice", "bob", 5)
+    session, conn = connect(server, "bob")
+    assert asyncio.run(server.replay_events(session, "bob", 2, 5)) is True
+    assert seqs(conn.sent) == [3, 4, 5]
+
+
+def test_replay_up_to_date_sends_nothing(server, db):
+    write_from_other_process(db, "alice", "bob", 3)
+    session, conn = connect(server, "bob")
+    assert asyncio.run(server.replay_events(session, "bob", 3, 3)) is True
+    assert conn.sent == []
+    # Không có last_seq (login mới): không replay, không RESYNC
+    assert asyncio.run(server.replay_events(session, "bob", None, 3)) is False
+    assert conn.sent == []
+
+
+def test_gap_over_replay_limit_sends_resync(server, db, monkeypatch):
+    monkeypatch.setattr(websocket_server, "EVENT_REPLAY_LIMIT", 3)
+    write_from_other_process(db, "alice", "bob", 6)
+    session, conn = connect(server, "bob")
+    assert asyncio.run(server.replay_events(session, "bob", 2, 6)) is False
+    assert conn.sent == [{
+        "type": MessageType.RESYNC.value,
+        "data": {"stream": "user", "last_seq": 2, "seq": 6}
+    }]
+
+
+def test_trimmed_event_log_sends_resync(server, db, monkeypatch):
+    monkeypatch.setattr("backend.database.EVENT_RETENTION", 4)
+    write_from_other_process(db, "alice", "bob", 10)
+    session, conn = connect(server, "bob")
+    # Event seq 2..6 đã bị xóa khỏi log: replay sẽ để lại lỗ hổng
+    assert asyncio.run(server.replay_events(session, "bob", 1, 10)) is False
+    assert conn.types() == [MessageType.RESYNC.value]
+    # Phần còn trong log thì vẫn replay được
+    conn.sent.clear()
+    assert asyncio.run(server.replay_events(session, "bob", 6, 10)) is True
+    assert seqs(conn.sent) == [7, 8, 9, 10]
+
+
+def test_sync_replays_events_written_elsewhere(server, db):
+    session, conn = connect(server, "bob")
+    write_from_other_process(db, "alice", "bob", 2)
+    write_from_other_process(db, "alice", None, 2)
+    message = {"type": MessageType.SYNC.value, "data": {"stream": "user", "last_seq": 0}}
+    assert asyncio.run(server.process_websocket_message(session, message)) is None
+    assert seqs(conn.sent) == [1, 2]
+
+    conn.sent.clear()
+    message = {"type": MessageType.SYNC.value, "data": {"stream": "broadcast", "last_seq": 1}}
+    asyncio.run(server.process_websocket_message(session, message))
+    assert seqs(conn.sent) == [2]
+    assert conn.types() == [MessageType.BROADCAST.value]
+
+
+@pytest.mark.parametrize("data", [
+    {"stream": "other", "last_seq": 0},
+    {"stream": "user", "last_seq": -1},
+    {"stream": "user", "last_seq": True},
+    {"stream": "user", "last_seq": "1"},
+])
+def test_sync_rejects_invalid_request(server, db, data):
+    session, conn = connect(server, "bob")
+    message = {"type": MessageType.SYNC.value, "data": data}
+    asyncio.run(server.process_websocket_message(session, message))
+    assert conn.types() == [MessageType.ERROR.value]
+
+
+def test_sync_requires_auth(server, db):
+    session, conn = connect(server)
+    message = {"type": MessageType.SYNC.value, "data": {"stream": "user", "last_seq": 0}}
+    asyncio.run(server.process_websocket_message(session, message))
+    assert conn.types() == [MessageType.ERROR.value]
+
+
+def test_resume_with_last_seq_skips_pending_drain(server, db):
+    write_from_other_process(db, "alice", "bob", 3)
+    write_from_other_process(db, "alice", None, 1)
+    session, conn = connect(server)
+    asyncio.run(server.complete_auth(session, "bob", {"last_seq": 1, "last_broadcast_seq": 0}))
+    assert conn.types() == [
+        MessageType.ONLINE_USERS.value, MessageType.SUCCESS.value,
+        MessageType.PRIVATE_MESSAGE.value, MessageType.PRIVATE_MESSAGE.value, MessageType.BROADCAST.value
+    ]
+    success = conn.sent[1]["data"]
+    assert (success["seq"], success["broadcast_seq"]) == (3, 1)
+    assert [m["data"].get("receiver") for m in conn.sent[2:]] == ["bob", "bob", None]
+
+
+def test_fresh_login_drains_pending_deliveries(server, db):
+    write_from_other_process(db, "alice", "bob", 3)
+    session, conn = connect(server)
+    asyncio.run(server.complete_auth(session, "bob", {}))
+    assert conn.types() == [MessageType.ONLINE_USERS.value, MessageType.SUCCESS.value, MessageType.BATCH.value]
+    assert len(conn.sent[2]["data"]["messages"]) == 3
+
+
+def test_pending_drain_over_limit_sends_resync(server, db, monkeypatch):
+    monkeypatch.setattr(websocket_server, "PENDING_DRAIN_BATCH", 2)
+    monkeypatch.setattr(websocket_server, "PENDING_DRAIN_MAX_BATCHES", 2)
+    write_from_other_process(db, "alice", "bob", 5)
+    session, conn = connect(server)
+    asyncio.run(server.complete_auth(session, "bob", {}))
+    assert conn.types()[2:] == [MessageType.BATCH.value, MessageType.BATCH.value, MessageType.RESYNC.value]
+    drained = [m["data"]["id"] for batch in conn.sent[2:4] for m in batch["data"]["messages"]]
+    assert drained == sorted(drained) and len(drained) == 4
+    assert conn.sent[-1]["data"] == {"stream": "user", "last_seq": None, "seq": 5}
@@ -0,0 +1,96 @@
+"""MessageRouter: validate message, xác thực, giới hạn kích thước và rate limit theo route"""
+import asyncio
+
+from backend.protocol import MessageType
+from backend.rate_limit import RateLimit, RateLimiter, RATE_CLASS_FILE_BYTES, RATE_CLASS_MESSAGE
+from backend.router import MessageRouter
+
+
+class FakeAuth:
+    def __init__(self, users=None):
+        self.users = users or {}
+
+    def get_username(self, client_id):
+        return self.users.get(client_id)
+
+
+def make_router(rate_limiter=None):
+    router = MessageRouter(FakeAuth({"c1": "alice"}), rate_limiter)
+    calls = []
+
+    async def echo(msg, conn):
+        calls.append((msg.type, msg.client_id, msg.username, msg.data, msg.size, conn))
+        return {"type": "SUCCESS", "data": {"echo": msg.data}}
+
+    router.add_route(MessageType.CHAT, echo, rate_class=RATE_CLASS_MESSAGE)
+    router.add_route(MessageType.LOGIN, echo, require_auth=False)
+    router.add_route(MessageType.FILE_DATA, echo, rate_class=RATE_CLASS_FILE_BYTES, max_size=100)
+    return router, calls
+
+
+def dispatch(router, client_id, raw, conn=None, size=0):
+    return asyncio.run(router.dispatch(client_id, raw, conn, size))
+
+
+def error_message(response):
+    assert response["type"] == "ERROR"
+    assert response["data"]["success"] is False
+    return response["data"]["message"]
+
+
+def test_invalid_messages_are_rejected():
+    router, calls = make_router()
+    assert error_message(dispatch(router, "c1", ["CHAT"])) == "Message phải là object"
+    assert error_message(dispatch(router, "c1", {"data": {}})) == "Thiếu trường type"
+    assert error_message(dispatch(router, "c1", {"type": "CHAT", "data": "x"})) == "Trường data phải là object"
+    assert "không hợp lệ" in error_message(dispatch(router, "c1", {"type": "NOPE"}))
+    assert calls == []
+
+
+def test_dispatch_passes_parsed_message_to_handler():
+    router, calls = make_router()
+    conn = object()
+    response = dispatch(router, "c1", {"type": "CHAT", "data": {"message": "hi"}}, conn, 12)
+    assert response == {"type": "SUCCESS", "data": {"echo": {"message": "hi"}}}
+    assert calls == [("CHAT", "c1", "alice", {"message": "hi"}, 12, conn)]
+    # data thiếu được coi là object rỗng
+    dispatch(router, "c1", {"type": "CHAT"})
+    assert calls[-1][3] == {}
+
+
+def test_require_auth():
+    router, calls = make_router()
+    assert error_message(dispatch(router, "anon", {"type": "CHAT", "data": {}})) == "Bạn cần đăng nhập trước"
+    assert dispatch(router, "anon", {"type": "LOGIN", "data": {}})["type"] == "SUCCESS"
+    assert [call[2] for call in calls] == [None]
+
+
+def test_max_size():
+    router, calls = make_router()
+    assert "quá lớn" in error_message(dispatch(router, "c1", {"type": "FILE_DATA", "data": {}}, size=101))
+    assert dispatch(router, "c1", {"type": "FILE_DATA", "data": {}}, size=100)["type"] == "SUCCESS"
+    assert len(calls) == 1
+
+
+def test_rate_limited_route_returns_retry_after():
+    limiter = RateLimiter(per_connection={RATE_CLASS_MESSAGE: RateLimit(1, 2)}, per_user={})
+    router, calls = make_router(limiter)
+    for _ in range(2):
+        assert dispatch(router, "c1", {"type": "CHAT", "data": {}})["type"] == "SUCCESS"
+    response = dispatch(router, "c1", {"type": "CHAT", "data": {}})
+    assert response["data"]["rate_limited"] is True
+    assert response["data"]["rate_class"] == RATE_CLASS_MESSAGE
+    assert 0 < response["data"]["retry_after_ms"] <= 1000
+    assert len(calls) == 2
+    # Route không có giới hạn cho lớp này không bị chặn
+    assert dispatch(router, "c1", {"type": "LOGIN", "data": {}})["type"] == "SUCCESS"
+
+
+def test_route_decorator():
+    router = MessageRouter()
+
+    @router.route(MessageType.USER_LIST, require_auth=False)
+    async def users(msg, conn):
+        return {"type": "USER_LIST", "data": {"users": []}}
+
+    assert dispatch(router, "c1", {"type": "USER_LIST"}) == {"type": "USER_LIST", "data": {"users": []}}